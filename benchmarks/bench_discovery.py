@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# intermux/benchmarks/bench_discovery.py
+#
+# Measures how get_active_interfaces() scales with the number of interfaces.
+# The 'ip' calls are answered from a synthetic topology, so no root is needed.
+
+import sys
+import os
+import json
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import core.interface as interface
+
+SIZES = [1, 10, 100, 500, 1000]
+
+
+def make_topology(count):
+    """
+    Returns (links, addrs) JSON strings and the 'ip -o route show' lines for
+    `count` veth interfaces.
+    """
+    links, addrs, routes = [], [], []
+    for i in range(count):
+        name = f"veth{i}"
+        links.append({'ifindex': i + 2, 'ifname': name, 'flags': ['BROADCAST', 'UP', 'LOWER_UP'],
+                      'link_type': 'ether', 'address': f"02:00:00:00:{i // 256:02x}:{i % 256:02x}"})
+        addrs.append({'ifname': name, 'addr_info': [
+            {'family': 'inet', 'local': f"10.{i // 256}.{i % 256}.1", 'prefixlen': 24}]})
+        routes.append(f"10.{i // 256}.{i % 256}.0/24 dev {name} metric {100 + i}\n")
+        routes.append(f"default via 10.{i // 256}.{i % 256}.254 dev {name}\n")
+    return json.dumps(links), json.dumps(addrs), routes
+
+
+def run(count):
+    links, addrs, routes = make_topology(count)
+    calls = []
+
+    def fake_run_command(command_parts, check_return=True, suppress_errors=False):
+        calls.append(command_parts)
+        if 'link' in command_parts:
+            return links
+        return addrs
+
+    def fake_stream_command(command_parts):
+        calls.append(command_parts)
+        return iter(routes)
+
+    originals = interface._run_command, interface._stream_command
+    interface._run_command, interface._stream_command = fake_run_command, fake_stream_command
+    try:
+        start = time.perf_counter()
+        result = interface.get_active_interfaces(backend='ip', use_cache=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        interface._run_command, interface._stream_command = originals
+
+    assert len(result) == count
+    return {'interfaces': count, 'subprocesses': len(calls), 'seconds': round(elapsed, 6)}
+
+
+if __name__ == "__main__":
+    print(f"{'interfaces':>10} {'subprocesses':>13} {'seconds':>10}")
+    for size in SIZES:
+        r = run(size)
+        print(f"{r['interfaces']:>10} {r['subprocesses']:>13} {r['seconds']:>10.4f}")
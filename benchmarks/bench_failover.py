@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# intermux/benchmarks/bench_failover.py
+#
+# Measures how long core.health takes to move a binding to its backup uplink and
+# back. Two fake gateways live in their own namespaces behind veth pairs, and an
+# app namespace is bound to the first one. The gateway is then broken in two ways:
+#   silent   its address is removed, so only missed probes reveal the failure
+#   link     the uplink is set down, which the netlink link event reports at once
+# Runs inside a throw-away user, network and mount namespace, so no root is needed.
+
+import sys
+import os
+import io
+import time
+import tempfile
+import threading
+import contextlib
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+import core.router as router
+from core import ledger
+from core import rt_tables
+from core.executor import run_cmd
+from core.health import HealthMonitor
+from core.monitor import InterfaceMonitor
+
+# Reachable through either gateway, like an address on the internet
+REMOTE = "203.0.113.1"
+APP_SUBNET = "10.0.7.0/24"
+
+
+def build_topology():
+    run_cmd("ip link set lo up")
+    run_cmd("sysctl -w net.ipv4.ip_forward=1")
+    for i in range(2):
+        gw, inner = f"gw{i}", f"g{i}"
+        run_cmd(f"ip netns add {gw}")
+        run_cmd(f"ip link add up{i} type veth peer name {inner}")
+        run_cmd(f"ip link set {inner} netns {gw}")
+        run_cmd(f"ip addr add 192.168.5{i}.2/24 dev up{i}")
+        run_cmd(f"ip link set up{i} up")
+        for cmd in ("ip link set lo up", f"ip addr add {REMOTE}/32 dev lo",
+                    f"ip addr add 192.168.5{i}.1/24 dev {inner}", f"ip link set {inner} up",
+                    f"ip route add 10.0.0.0/8 via 192.168.5{i}.2"):
+            run_cmd(f"ip netns exec {gw} {cmd}")
+    run_cmd("ip route add default via 192.168.50.1 dev up0")
+    run_cmd("ip route add default via 192.168.51.1 dev up1 metric 200")
+
+    run_cmd("ip netns add ns_app")
+    run_cmd("ip link add app0 type veth peer name app1")
+    run_cmd("ip link set app1 netns ns_app")
+    run_cmd("ip addr add 10.0.7.1/24 dev app0")
+    run_cmd("ip link set app0 up")
+    for cmd in ("ip link set lo up", "ip addr add 10.0.7.2/24 dev app1", "ip link set app1 up",
+                "ip route add default via 10.0.7.1"):
+        run_cmd(f"ip netns exec ns_app {cmd}")
+
+
+def bind_app():
+    """Creates the uplink tables and steers the app namespace into up0's table, as provision does."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        router.setup_routing_tables()
+    table_id = router.get_routing_table_ids()["up0_rt"]
+    rule = f"from {APP_SUBNET} table {table_id} priority {router.BINDING_PRIORITY}"
+    ledger.record([('netns', 'ns_app', {'iface': 'up0'}),
+                   ('rule', rule, {'ns': 'ns_app', 'table': table_id})])
+    run_cmd(f"ip rule add {rule}")
+
+
+def bound_uplink():
+    tables = {table_id: name[:-3] for name, table_id in router.get_routing_table_ids().items()}
+    rules = [details['table'] for details in ledger.entries('rule').values() if details.get('ns') == 'ns_app']
+    return tables.get(rules[0]) if rules else None
+
+
+def app_reaches_remote():
+    # Pings from inside the app namespace with the same ICMP probe the health monitor uses
+    code = f"from core.health import GatewayProbe; print(GatewayProbe('app1', '{REMOTE}', 1).probe())"
+    return run_cmd(["ip", "netns", "exec", "ns_app", sys.executable, "-c", code]) == "True"
+
+
+def measure(health, events, fail, repair, name):
+    events.clear()
+    start = time.perf_counter()
+    fail()
+    if not events['down'].wait(5):
+        raise RuntimeError(f"{name}: no failover within 5s")
+    failover = events['down_at'] - start
+    via_backup = bound_uplink() == 'up1' and app_reaches_remote()
+
+    start = time.perf_counter()
+    repair()
+    if not events['up'].wait(10):
+        raise RuntimeError(f"{name}: no failback within 10s")
+    failback = events['up_at'] - start
+    back_home = bound_uplink() == 'up0' and app_reaches_remote()
+    print(f"{name:<8} failover {failover * 1000:7.1f} ms (traffic via up1: {via_backup})   "
+          f"failback {failback * 1000:7.1f} ms (traffic via up0: {back_home})")
+
+
+class Events(dict):
+
+    def __init__(self):
+        super().__init__(down=threading.Event(), up=threading.Event())
+
+    def clear(self):
+        self['down'].clear()
+        self['up'].clear()
+
+    def __call__(self, primary, state, moved):
+        self[f"{state}_at"] = time.perf_counter()
+        self[state].set()
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    rt_tables.RT_TABLES_PATH = os.path.join(workdir, "rt_tables")
+    rt_tables.RT_TABLES_DIR = os.path.join(workdir, "rt_tables.d")
+    ledger.LEDGER_PATH = os.path.join(workdir, "ledger.json")
+    build_topology()
+    bind_app()
+    assert app_reaches_remote(), "the app namespace cannot reach the fake gateway"
+
+    events = Events()
+    monitor = InterfaceMonitor()
+    monitor.start()
+    health = HealthMonitor({'up0': 'up1'}, on_event=events, monitor=monitor)
+    health.start()
+    try:
+        measure(health, events,
+                lambda: run_cmd("ip netns exec gw0 ip addr del 192.168.50.1/24 dev g0"),
+                # Removing the address also dropped the gateway's route back to the host
+                lambda: [run_cmd("ip netns exec gw0 ip addr add 192.168.50.1/24 dev g0"),
+                         run_cmd("ip netns exec gw0 ip route add 10.0.0.0/8 via 192.168.50.2")], "silent")
+        measure(health, events,
+                lambda: run_cmd("ip link set up0 down"),
+                lambda: run_cmd("ip link set up0 up"), "link")
+    finally:
+        health.stop()
+        monitor.stop()
+
+
+if __name__ == "__main__":
+    if os.environ.get("INTERMUX_BENCH_NETNS") != "1":
+        os.environ["INTERMUX_BENCH_NETNS"] = "1"
+        os.environ["PYTHONPATH"] = ROOT
+        # A private /run so 'ip netns' can create its namespaces without touching the host's
+        script = f"mount -t tmpfs none /run && mkdir -p /run/netns && exec {sys.executable} {os.path.abspath(__file__)}"
+        os.execvp("unshare", ["unshare", "-Urnm", "--propagation", "private", "sh", "-c", script])
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# intermux/benchmarks/bench_routing.py
+#
+# Compares programming N routing tables one 'ip' command at a time (the old
+# path) with a single batched transaction through core.router.RouteBatch.
+# Runs inside a throw-away user and network namespace, so no root is needed.
+
+import sys
+import os
+import io
+import time
+import shutil
+import tempfile
+import contextlib
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import core.router as router
+from core import ledger
+from core import rt_tables
+from core.executor import run_cmd
+
+TABLES = 50
+
+
+def legacy_setup(name, ip_with_cidr, gateway, table_id):
+    ip, _prefix = router.extract_ip_and_prefix(ip_with_cidr)
+    priority = router.rule_priority(table_id)
+    run_cmd(f"ip route flush table {table_id}")
+    run_cmd(f"ip rule del from {ip} table {table_id} priority {priority}")
+    run_cmd(f"ip route add {router.get_network(ip_with_cidr)} dev {name} scope link table {table_id}")
+    run_cmd(f"ip route add default via {gateway} dev {name} table {table_id}")
+    run_cmd(f"ip rule add from {ip} table {table_id} priority {priority}")
+
+
+def timed(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    return time.perf_counter() - start
+
+
+def main():
+    # One uplink per table, each with its own address
+    uplinks = [(f"bench{i}", f"10.99.{i}.1/24", f"10.99.{i}.254") for i in range(TABLES)]
+    for name, address, _gateway in uplinks:
+        run_cmd(f"ip link add {name} type veth peer name {name}p")
+        run_cmd(f"ip link set {name} up")
+        run_cmd(f"ip addr add {address} dev {name}")
+    workdir = tempfile.mkdtemp()
+    rt_tables.RT_TABLES_PATH = os.path.join(workdir, "rt_tables")
+    rt_tables.RT_TABLES_DIR = os.path.join(workdir, "rt_tables.d")
+    ledger.LEDGER_PATH = os.path.join(workdir, "ledger.json")
+    tables = range(rt_tables.FIRST_TABLE_ID, rt_tables.FIRST_TABLE_ID + TABLES)
+
+    def legacy():
+        for table_id, (name, address, gateway) in zip(tables, uplinks):
+            legacy_setup(name, address, gateway, table_id)
+
+    def batched():
+        batch = router.RouteBatch()
+        with rt_tables.transaction() as index:
+            for name, address, gateway in uplinks:
+                router.setup_interface_routing(name, address, gateway, batch=batch, tables=index)
+        assert batch.commit()
+
+    legacy_time = timed(legacy)
+    router.run_batch([f"route flush table {t}" for t in tables] + [f"rule del table {t}" for t in tables], force=True)
+    batch_time = timed(batched)
+    shutil.rmtree(workdir)
+
+    print(f"tables: {TABLES}")
+    print(f"per-command: {legacy_time:.3f}s")
+    print(f"batched:     {batch_time:.3f}s ({legacy_time / batch_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    if os.environ.get("INTERMUX_BENCH_NETNS") != "1":
+        os.environ["INTERMUX_BENCH_NETNS"] = "1"
+        os.execvp("unshare", ["unshare", "-Urn", sys.executable, os.path.abspath(__file__)])
+    main()
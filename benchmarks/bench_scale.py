@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# intermux/benchmarks/bench_scale.py
+#
+# Measures how discovery and routing-table management scale with the size of the
+# system. A fake 'ip' executable placed first on PATH answers every query from a
+# generated topology and swallows every change, so nothing touches the real
+# network and no root is needed (non-root runs re-exec inside 'unshare -Ur' so
+# the root checks in core.router pass).
+#
+# Every measurement runs in a fresh child process and reports wall time, the
+# number of 'ip' processes spawned and the child's peak RSS. Results are printed
+# as JSON; pass --compare with an earlier result file to see the ratios.
+#
+#   python3 benchmarks/bench_scale.py --output before.json
+#   python3 benchmarks/bench_scale.py --quick --compare before.json
+
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+INTERFACE_SIZES = [1, 10, 100, 500, 1000, 2000]
+ROUTE_SIZES = [10, 1000, 100000, 1000000]
+QUICK_INTERFACE_SIZES = [1, 10, 100]
+QUICK_ROUTE_SIZES = [10, 1000]
+# Interfaces used by the route sweep, routes used by the interface sweep (per interface)
+ROUTE_SWEEP_INTERFACES = 10
+ROUTES_PER_INTERFACE = 2
+
+ENTRY_POINTS = ['get_active_interfaces', 'router.main', 'clear_custom_routing_tables']
+
+FAKE_IP = """#!/bin/sh
+# Fake 'ip' for intermux benchmarks: logs each call, answers from the topology files.
+echo "$*" >> "$INTERMUX_FAKE_IP_DIR/calls.log"
+case "$*" in
+    *-batch*) cat > /dev/null ;;
+    *"-j link"*) cat "$INTERMUX_FAKE_IP_DIR/links.json" ;;
+    *"-j addr"*) cat "$INTERMUX_FAKE_IP_DIR/addrs.json" ;;
+    *"-o route"*) cat "$INTERMUX_FAKE_IP_DIR/routes.txt" ;;
+esac
+exit 0
+"""
+
+
+def _octets(i):
+    return f"{(i >> 8) & 255}.{i & 255}"
+
+
+def _route_line(route):
+    line = route['dst']
+    if 'gateway' in route:
+        line += f" via {route['gateway']}"
+    line += f" dev {route['dev']}"
+    if 'scope' in route:
+        line += f" proto kernel scope {route['scope']}"
+    if 'metric' in route:
+        line += f" metric {route['metric']}"
+    return line + "\n"
+
+
+def write_topology(directory, interfaces, routes):
+    """
+    Writes links.json, addrs.json and routes.txt ('ip -o route' lines) for
+    `interfaces` veth interfaces and `routes` main-table routes, streaming so a
+    million routes stay cheap.
+
+    Every interface gets its connected route and a default route; the remaining
+    routes are /32 host routes spread over the interfaces.
+    """
+    with open(os.path.join(directory, 'links.json'), 'w') as f:
+        json.dump([{'ifindex': i + 2, 'ifname': f"veth{i}", 'flags': ['BROADCAST', 'UP', 'LOWER_UP'],
+                    'link_type': 'ether', 'address': f"02:00:00:00:{(i >> 8) & 255:02x}:{i & 255:02x}"}
+                   for i in range(interfaces)], f)
+    with open(os.path.join(directory, 'addrs.json'), 'w') as f:
+        json.dump([{'ifname': f"veth{i}", 'addr_info': [
+            {'family': 'inet', 'local': f"10.{_octets(i)}.1", 'prefixlen': 24}]}
+            for i in range(interfaces)], f)
+    with open(os.path.join(directory, 'routes.txt'), 'w') as f:
+        written = 0
+        for i in range(interfaces):
+            for route in ({'dst': 'default', 'gateway': f"10.{_octets(i)}.254", 'dev': f"veth{i}",
+                           'metric': 100 + i},
+                          {'dst': f"10.{_octets(i)}.0/24", 'dev': f"veth{i}", 'scope': 'link'}):
+                if written < routes:
+                    f.write(_route_line(route))
+                    written += 1
+        for n in range(routes - written):
+            route = {'dst': f"172.{16 + (n >> 16) % 16}.{_octets(n)}", 'gateway': f"10.{_octets(n % interfaces)}.254",
+                     'dev': f"veth{n % interfaces}"}
+            f.write(_route_line(route))
+    with open(os.path.join(directory, 'rt_tables'), 'w') as f:
+        f.write("255\tlocal\n254\tmain\n253\tdefault\n0\tunspec\n")
+        # Pre-existing custom tables, for clear_custom_routing_tables
+        f.writelines(f"{100 + i} veth{i}_rt\n" for i in range(interfaces))
+
+
+def child(entry, directory):
+    """Runs one entry point against the fake topology and prints its measurements."""
+    sys.path.append(ROOT)
+    import core.router as router
+    from core import rt_tables
+    rt_tables.RT_TABLES_PATH = os.path.join(directory, 'rt_tables')
+    rt_tables.RT_TABLES_DIR = os.path.join(directory, 'rt_tables.d')
+    if entry == 'router.main':
+        # Start from a table file without our tables so every table is created
+        with open(rt_tables.RT_TABLES_PATH) as f:
+            lines = [line for line in f if not line.rstrip().endswith('_rt')]
+        with open(rt_tables.RT_TABLES_PATH, 'w') as f:
+            f.writelines(lines)
+    func = {
+        'get_active_interfaces': lambda: router.get_active_interfaces(backend='ip', use_cache=False),
+        'router.main': router.main,
+        'clear_custom_routing_tables': router.clear_custom_routing_tables,
+    }[entry]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'seconds': round(elapsed, 6),
+                      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def measure(entry, interfaces, routes, workdir, fake_bin):
+    directory = os.path.join(workdir, f"{interfaces}x{routes}")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+        write_topology(directory, interfaces, routes)
+    calls_log = os.path.join(directory, 'calls.log')
+    open(calls_log, 'w').close()
+    shutil.copy(os.path.join(directory, 'rt_tables'), os.path.join(directory, 'rt_tables.orig'))
+
+    env = dict(os.environ, PATH=f"{fake_bin}:{os.environ.get('PATH', '')}",
+               INTERMUX_FAKE_IP_DIR=directory, INTERMUX_BACKEND='ip', INTERMUX_CACHE_TTL='0',
+               INTERMUX_LEDGER=os.path.join(directory, 'ledger.json'))
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', entry, directory]
+    if os.geteuid() != 0:
+        cmd = ['unshare', '-Ur'] + cmd
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    # Leave the table file as generated for the next entry point
+    os.replace(os.path.join(directory, 'rt_tables.orig'), os.path.join(directory, 'rt_tables'))
+    shutil.rmtree(os.path.join(directory, 'rt_tables.d'), ignore_errors=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{entry} ({interfaces}x{routes}) failed: {result.stderr.strip()}")
+
+    with open(calls_log) as f:
+        subprocesses = sum(1 for _ in f)
+    return dict(json.loads(result.stdout.splitlines()[-1]), entry=entry, interfaces=interfaces,
+                routes=routes, subprocesses=subprocesses)
+
+
+def cases(quick):
+    interface_sizes = QUICK_INTERFACE_SIZES if quick else INTERFACE_SIZES
+    route_sizes = QUICK_ROUTE_SIZES if quick else ROUTE_SIZES
+    sweep = [(count, count * ROUTES_PER_INTERFACE) for count in interface_sizes]
+    sweep += [(ROUTE_SWEEP_INTERFACES, count) for count in route_sizes]
+    return sorted(set(sweep))
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['entry'], r['interfaces'], r['routes']): r for r in json.load(f)['results']}
+    print(f"{'entry':<28} {'ifaces':>6} {'routes':>8} {'time x':>8} {'procs':>11} {'rss x':>6}",
+          file=sys.stderr)
+    for r in results:
+        old = baseline.get((r['entry'], r['interfaces'], r['routes']))
+        if not old:
+            continue
+        print(f"{r['entry']:<28} {r['interfaces']:>6} {r['routes']:>8} "
+              f"{r['seconds'] / max(old['seconds'], 1e-9):>8.2f} "
+              f"{old['subprocesses']:>5}->{r['subprocesses']:<5} "
+              f"{r['peak_rss_kb'] / max(old['peak_rss_kb'], 1):>6.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="InterMux scale benchmarks")
+    parser.add_argument('--quick', action='store_true', help="Small sizes only")
+    parser.add_argument('--entry', choices=ENTRY_POINTS, action='append', help="Entry point(s) to run")
+    parser.add_argument('--output', help="Write the JSON results to this file")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="intermux-bench-")
+    try:
+        fake_bin = os.path.join(workdir, 'bin')
+        os.makedirs(fake_bin)
+        with open(os.path.join(fake_bin, 'ip'), 'w') as f:
+            f.write(FAKE_IP)
+        os.chmod(os.path.join(fake_bin, 'ip'), 0o755)
+
+        results = []
+        for interfaces, routes in cases(args.quick):
+            for entry in args.entry or ENTRY_POINTS:
+                r = measure(entry, interfaces, routes, workdir, fake_bin)
+                print(f"[+] {entry:<28} {interfaces:>5} ifaces {routes:>8} routes "
+                      f"{r['seconds']:>9.4f}s {r['subprocesses']:>4} procs {r['peak_rss_kb']:>8} KB",
+                      file=sys.stderr)
+                results.append(r)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'python': sys.version.split()[0], 'quick': args.quick, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# intermux/benchmarks/bench_startup.py
+#
+# Measures how long cli.py takes from process start to exit for commands that
+# scripts run often, next to a bare interpreter. With --imports, the slowest
+# modules of each command are listed (python -X importtime).
+# Runs without root: 'list' only reads netlink, the other commands stop at --help.
+
+import sys
+import os
+import time
+import statistics
+import subprocess
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CLI = os.path.join(ROOT, "cli.py")
+
+RUNS = 20
+COMMANDS = [
+    ["-c", "pass"],
+    [CLI, "--help"],
+    [CLI, "--no-daemon", "list", "--json"],
+    [CLI, "--no-daemon", "list", "--jsonl"],
+    [CLI, "--no-daemon", "list"],
+    [CLI, "assign", "--help"],
+]
+
+
+def label(argv):
+    return "python (bare)" if argv[0] == "-c" else " ".join(argv[1:])
+
+
+def run(argv, runs=RUNS):
+    """Returns the wall-clock seconds of `runs` executions of `argv`."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def slowest_imports(argv, count=8):
+    """Returns (microseconds, module) of the modules with the largest cumulative import time."""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith('  '):
+            imports.append((int(parts[1]), parts[2].strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    show_imports = "--imports" in sys.argv[1:]
+    print(f"{'command':<32} {'min ms':>8} {'median ms':>10}")
+    for argv in COMMANDS:
+        times = run(argv)
+        print(f"{label(argv):<32} {min(times) * 1000:>8.1f} {statistics.median(times) * 1000:>10.1f}")
+        if show_imports and argv[0] != "-c":
+            for microseconds, module in slowest_imports(argv):
+                print(f"    {module:<28} {microseconds / 1000:>8.1f}")
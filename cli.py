@@ -1,31 +1,36 @@
 #!/usr/bin/env python3
 import os
 import sys
-import subprocess
+import json
+import time
 import argparse
+from contextlib import nullcontext
 
 # Add the project root to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-from core.interface import get_active_interfaces
-from core.router import clear_custom_routing_tables, check_existing_routing_tables
+from core.shaping import make_shape, shape_key, PRIORITIES
+from core import client
 
-def run_cmd(cmd):
-    """Helper function to run a shell command."""
-    try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stderr = result.stderr.strip()
-        if result.returncode != 0 and "Cannot find device" not in stderr and "No such file or directory" not in stderr:
-            print(f"[!] {cmd}\n    -> {stderr}")
-        return result.stdout.strip()
-    except Exception as e:
-        print(f"[X] Exception while running '{cmd}': {e}")
-        return None
-
-def list_interfaces():
-    """Lists all active network interfaces."""
+# Each command imports the modules it needs, so '--help' and 'list' start fast
+
+def list_interfaces(interfaces=None, output=None):
+    """
+    Lists all active network interfaces (scanned now unless given). With output
+    'json' or 'jsonl' every interface is printed as it is, as one JSON array or
+    one object per line, for scripts.
+    """
+    if interfaces is None:
+        from core.interface import get_active_interfaces
+        interfaces = get_active_interfaces()
+    if output == 'json':
+        print(json.dumps(interfaces))
+        return
+    if output == 'jsonl':
+        for iface in interfaces:
+            print(json.dumps(iface))
+        return
     print("--- Active Network Interfaces ---")
-    interfaces = get_active_interfaces()
     if not interfaces:
         print("No active network interfaces found.")
         return
@@ -38,36 +43,304 @@ def list_interfaces():
             print(f"  IP Addresses: {', '.join(iface['ip_addresses'])}")
             print(f"  Gateways: {', '.join(iface['gateways'] if iface['gateways'] else ['N/A'])}")
 
-def assign_app(app, iface):
-    """Assigns an application to a specific network interface."""
+def parse_weight(value):
+    """Parses an 'IFACE=N' option into (iface, N)."""
+    name, _, weight = value.partition('=')
+    if not name or not weight.isdigit() or int(weight) < 1:
+        raise argparse.ArgumentTypeError(f"invalid weight '{value}', expected IFACE=N with N >= 1")
+    return name, int(weight)
+
+def parse_rate(value):
+    """Checks a tc rate option such as '20mbit'."""
+    try:
+        make_shape(download=value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def assign_app(app, ifaces, weights=None, hash_policy='l3', shape=None, mode='netns'):
+    """
+    Assigns an application to a network interface, or balances it over several
+    interfaces with a weighted multipath route. `shape` limits its bandwidth.
+    In 'cgroup' mode the app runs without a namespace, see core.cgroup.
+    """
+    from core import executor
+    from core.multipath import setup_multipath_routing
+
+    if not check_app(app):
+        return
+
+    if len(ifaces) > 1:
+        print(f"[+] Assigning '{app}' to interfaces {', '.join(ifaces)} (load balanced)...")
+        iface = setup_multipath_routing(ifaces, weights, hash_policy)
+        if iface is None:
+            return
+    else:
+        iface = ifaces[0]
+        print(f"[+] Assigning '{app}' to interface '{iface}'...")
+
+    if mode == 'cgroup':
+        if shape:
+            print("[X] Error: Bandwidth limits and priority need a namespace; drop --mode cgroup.")
+            return
+
+        def launch_in_cgroup(app, names):
+            print(f"[+] Starting application in cgroup '{names['cgroup']}' (fwmark {names['mark']:#x})...")
+            executor.spawn(["env", f"DISPLAY={os.environ.get('DISPLAY', '')}",
+                            f"XAUTHORITY={os.path.expanduser('~/.Xauthority')}", app], cgroup=names['dir'])
+
+        from core import cgroup
+        try:
+            report = cgroup.provision([(app, iface)], launch=launch_in_cgroup)
+        except (RuntimeError, ValueError) as e:
+            print(f"[X] Error: {e}")
+            return
+        print(f"[✓] Application '{app}' is running through '{iface}' (ready in {report['total_seconds']:.2f}s).")
+        return
+
+    def launch(app, names):
+        print(f"[+] Starting application in network namespace '{names['ns']}'...")
+        # Note: This command runs in the background.
+        executor.spawn(["ip", "netns", "exec", names['ns'], "env",
+                        f"DISPLAY={os.environ.get('DISPLAY', '')}",
+                        f"XAUTHORITY={os.path.expanduser('~/.Xauthority')}", app])
+
+    from core.provision import provision
+    from core.pool import NamespacePool, POOL_SIZE
+
+    # Use a pre-built namespace if one is ready; the pool refills before the CLI exits
+    pool = NamespacePool(size=POOL_SIZE) if not executor.dry_running() else None
+    if shape:
+        print(f"[+] Shaping: {shape_key(shape)}")
+    try:
+        report = provision([(app, iface, shape)], launch=launch, pool=pool)
+    except (RuntimeError, ValueError) as e:
+        print(f"[X] Error: {e}")
+        return
+    print(f"[✓] Application '{app}' is running through '{iface}' (ready in {report['total_seconds']:.2f}s).")
+
+def apply_manifest(path, prune=False, remote=False):
+    """
+    Validates a manifest of bindings, then sets all of them up in one pass, see core.manifest.
+    With `prune`, namespaces no binding uses anymore are removed afterwards.
+    """
+    from core import manifest
+    from core.provision import print_report
+
+    try:
+        entries = manifest.load(path)
+    except (OSError, ValueError) as e:
+        print(f"[X] Error: {e}")
+        return
+    if remote:
+        print(f"[+] Applying {len(entries)} binding(s) from '{path}' through intermuxd...")
+        env = {key: os.environ[key] for key in client.LAUNCH_ENV if key in os.environ}
+        print_report(client.request('apply', bindings=entries, env=env, prune=prune))
+        return
+    try:
+        bindings = manifest.validate(entries)
+    except ValueError as e:
+        print("[X] The manifest has errors, nothing was changed:")
+        for line in str(e).split('\n'):
+            print(f"    {line}")
+        return
+
+    from core import executor
+    from core.pool import NamespacePool, POOL_SIZE
+
+    def launch(binding, names):
+        argv = ["env", f"DISPLAY={os.environ.get('DISPLAY', '')}",
+                f"XAUTHORITY={os.path.expanduser('~/.Xauthority')}", binding['app']] + binding['args']
+        if 'ns' in names:
+            executor.spawn(["ip", "netns", "exec", names['ns']] + argv)
+        else:
+            executor.spawn(argv, cgroup=names['dir'])
+
+    print(f"[+] Applying {len(bindings)} binding(s) from '{path}'...")
+    pool = NamespacePool(size=POOL_SIZE) if not executor.dry_running() else None
+    try:
+        report = manifest.apply(bindings, launch=launch, pool=pool, prune=prune)
+    except (RuntimeError, ValueError) as e:
+        print(f"[X] Error: {e}")
+        return
+    print_report(report)
+
+def check_app(app):
     if "chromium" in app.lower():
         print("[X] Error: Chromium is not supported due to its sandboxing architecture, which conflicts with network namespacing.")
-        return
+        return False
 
     if not os.path.exists(app):
         print(f"[X] Error: Application path not found: {app}")
+        return False
+    return True
+
+def assign_remote(app, ifaces, weights, hash_policy, shape, mode):
+    """Asks intermuxd to assign the application; it is launched as the calling user."""
+    if not check_app(app):
         return
+    app = os.path.abspath(app)
+    print(f"[+] Assigning '{app}' to {', '.join(ifaces)} through intermuxd...")
+    env = {key: os.environ[key] for key in client.LAUNCH_ENV if key in os.environ}
+    report = client.request('assign', app=app, ifaces=ifaces, weights=weights, hash_policy=hash_policy,
+                            shape=shape, mode=mode, env=env)
+    print(f"[✓] Application '{app}' is running (ready in {report['total_seconds']:.2f}s).")
 
-    print(f"[+] Assigning '{app}' to interface '{iface}'...")
-    
-    ns = f"ns_{iface}"
-    run_cmd(f"ip netns add {ns}")
-    run_cmd("ip link add veth0 type veth peer name veth1")
-    run_cmd(f"ip link set veth1 netns {ns}")
-    run_cmd("ip addr add 10.0.0.1/24 dev veth0")
-    run_cmd("ip link set veth0 up")
-    run_cmd(f"mkdir -p /etc/netns/{ns}/tmp")
-
-    print(f"[+] Starting application in network namespace '{ns}'...")
-    # Note: This command runs in the background.
-    subprocess.Popen(
-        f"sudo ip netns exec {ns} env DISPLAY=$DISPLAY XAUTHORITY=$HOME/.Xauthority {app}",
-        shell=True
-    )
-    print(f"[✓] Application '{app}' is running through '{iface}'.")
-
-def clear_all_paths():
+def release_bindings(iface, remote=False):
+    """Removes the namespaces and cgroups bound to an interface."""
+    if remote:
+        removed = client.request('release', iface=iface)
+    else:
+        from core.teardown import release
+        removed = release(iface, progress=lambda message: print(f"[+] {message}"))
+    if not removed:
+        print(f"[i] Nothing is bound to '{iface}'.")
+        return
+    print(f"[✓] Released '{iface}' ({removed} resources removed).")
+
+def manage_pool(iface, size, drain):
+    """Pre-builds namespaces for an interface, or removes every pooled namespace."""
+    from core.pool import NamespacePool, POOL_SIZE
+
+    size = max(POOL_SIZE, 2) if size is None else size
+    pool = NamespacePool(size=size)
+    if drain:
+        print("[+] Removing pooled namespaces...")
+        pool.drain()
+        print("[✓] Namespace pool drained.")
+        return
+    if not iface:
+        print("[X] Error: --iface is required unless --drain is given.")
+        return
+    print(f"[+] Pre-building {size} namespace(s) for '{iface}'...")
+    pool.fill(iface)
+    print(f"[✓] {pool.idle_count(iface)} namespace(s) ready for '{iface}'.")
+
+def balance_system(ifaces, weights, hash_policy):
+    """Sends all traffic of the host over several interfaces with a weighted multipath route."""
+    from core.multipath import setup_multipath_routing
+    print(f"[+] Balancing all traffic over {', '.join(ifaces)}...")
+    setup_multipath_routing(ifaces, weights, hash_policy, system_wide=True)
+
+def show_stats(ifaces, interval, count, as_json, remote=False):
+    """
+    Prints the throughput of every interface and binding veth once per interval,
+    as a table or as one JSON object per line. The rates are sampled here, or
+    taken from intermuxd's history if `remote`.
+    """
+    from core.stats import ThroughputSampler, format_rate, INTERVAL
+
+    interval = INTERVAL if interval is None else interval
+    if remote:
+        window = max(1, round(interval / INTERVAL))
+
+        def fetch():
+            return client.request('stats', window=window)
+    else:
+        sampler = ThroughputSampler(interval=interval)
+        sampler.sample()
+
+        def fetch():
+            sampler.sample()
+            return sampler.snapshot()
+
+    printed = 0
+    try:
+        while count is None or printed < count:
+            time.sleep(interval)
+            rows = [row for row in fetch()
+                    if (row['name'] in ifaces if ifaces else row['name'] != 'lo')]
+            printed += 1
+            if as_json:
+                print(json.dumps({'time': round(time.time(), 3), 'interfaces': rows}), flush=True)
+                continue
+            print(f"\n{'interface':<18} {'rx':>13} {'tx':>13} {'rx pkt/s':>9} {'tx pkt/s':>9} {'drops/s':>8}  role")
+            for row in rows:
+                print(f"{row['name']:<18} {format_rate(row['rx_bps']):>13} {format_rate(row['tx_bps']):>13} "
+                      f"{row['rx_pps']:>9.0f} {row['tx_pps']:>9.0f} {row['rx_drops'] + row['tx_drops']:>8.0f}  "
+                      f"{row['label']}", flush=True)
+    except KeyboardInterrupt:
+        pass
+
+def parse_pair(value):
+    """Parses a 'PRIMARY=BACKUP' option into (primary, backup)."""
+    primary, _, backup = value.partition('=')
+    if not primary or not backup or primary == backup:
+        raise argparse.ArgumentTypeError(f"invalid pair '{value}', expected PRIMARY=BACKUP")
+    return primary, backup
+
+def watch_gateways(pairs, interval, jitter):
+    """Probes the primary uplinks and fails their bindings over until Ctrl-C."""
+    from core.health import HealthMonitor, PROBE_INTERVAL, PROBE_JITTER
+    from core.monitor import InterfaceMonitor
+
+    def on_event(primary, state, moved):
+        if state == 'down':
+            print(f"[!] {primary} is down, moved {moved} binding(s) to {backups[primary]}", flush=True)
+        else:
+            print(f"[✓] {primary} is back, moved {moved} binding(s) home", flush=True)
+
+    backups = dict(pairs)
+    monitor = InterfaceMonitor()
+    try:
+        monitor.start()
+    except OSError as e:
+        print(f"[!] Link events unavailable, relying on probes only: {e}")
+        monitor = None
+    health = HealthMonitor(backups, interval=PROBE_INTERVAL if interval is None else interval,
+                           jitter=PROBE_JITTER if jitter is None else jitter, on_event=on_event, monitor=monitor)
+    try:
+        health.start()
+    except ValueError as e:
+        print(f"[X] Error: {e}")
+        return
+    print(f"[+] Watching {', '.join(f'{p} (backup {b})' for p, b in backups.items())}; Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        health.stop()
+        if monitor:
+            monitor.stop()
+
+def manage_nat(rebuild):
+    """Shows which subnets are masqueraded, or rebuilds the NAT from the ledger."""
+    from core import nat
+
+    if rebuild:
+        print(f"[+] Rebuilding NAT from the ledger ({nat.backend()})...")
+        print(f"[✓] {nat.rebuild()} subnet(s) masqueraded.")
+        return
+    subnets = nat.masqueraded()
+    print(f"[i] NAT backend: {nat.backend()}, {len(subnets)} subnet(s) masqueraded")
+    for subnet in sorted(subnets):
+        print(f"    {subnet}")
+
+def run_daemon(path):
+    """Runs intermuxd in the foreground until Ctrl-C."""
+    from core import daemon
+
+    server = daemon.Intermuxd(path)
+    server.start()
+    print(f"[✓] intermuxd listening on {server.path}; Ctrl-C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+def clear_all_paths(remote=False):
     """Clears all custom routing tables."""
+    if remote:
+        print("[+] Clearing all custom routing tables through intermuxd...")
+        client.request('clear')
+        print("[✓] All paths cleared successfully.")
+        return
+    from core.router import clear_custom_routing_tables, check_existing_routing_tables
+
     if not check_existing_routing_tables():
         print("[i] No custom routing tables found to clear.")
         return
@@ -76,57 +349,207 @@ def clear_all_paths():
     clear_custom_routing_tables()
     print("[✓] All paths cleared successfully.")
 
-def reset_system():
-    """Resets the system by removing all created network resources."""
-    print("[+] Resetting system to defaults...")
+def reset_system(remote=False):
+    """
+    Resets the system by removing all created network resources, in parallel
+    batched stages (see core.teardown). A dry run prints the plan.
+    """
+    from core import executor
+    from core.teardown import plan, run, print_plan, print_timings
 
-    # Clear custom routing tables
-    clear_custom_routing_tables()
+    print("[+] Resetting system to defaults...")
+    if remote:
+        report = client.request('reset')
+    else:
+        from core.pool import NamespacePool
 
-    # Remove veth interface
-    run_cmd("ip link del veth0 2>/dev/null")
+        # Everything recorded in the ledger: namespaces, veths, rules, NAT, cgroups, tables
+        changes = plan()
+        if executor.dry_running():
+            print("[i] Teardown plan; the lanes run in parallel:")
+            print_plan(changes)
+            run(changes)
+            return
+        report = run(changes, progress=lambda message: print(f"[+] {message}"))
+        # Forget pre-built namespace state
+        NamespacePool().drain()
 
-    # Remove network namespaces
-    interfaces = get_active_interfaces()
-    if interfaces:
-        for iface in interfaces:
-            ns = f"ns_{iface['name']}"
-            run_cmd(f"ip netns del {ns} 2>/dev/null")
+    print_timings(report)
+    print(f"[✓] System has been reset ({report['removed']} resources removed in "
+          f"{report['total_seconds']:.2f}s).")
 
-    print("[✓] System has been reset.")
+def add_balancing_arguments(parser):
+    parser.add_argument("--weight", action="append", type=parse_weight, metavar="IFACE=N",
+                        help="Relative share of an interface (default: its link speed).")
+    parser.add_argument("--hash-policy", choices=["l3", "l4"], default="l3",
+                        help="Spread flows by addresses (l3) or also by ports (l4).")
 
 def main():
     """Main function to parse arguments and execute commands."""
-    if os.geteuid() != 0:
-        print("[X] This script must be run as root.")
-        sys.exit(1)
-
     parser = argparse.ArgumentParser(description="CLI for network interface binding.")
+    parser.add_argument("--profile", nargs="?", const="intermux-trace.json", metavar="TRACE",
+                        help="Time every command and write a Chrome trace (default: intermux-trace.json).")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the commands that would change the system instead of running them.")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="Do the work in this process even if intermuxd is running.")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     # 'list' command
     parser_list = subparsers.add_parser("list", help="List active network interfaces.")
-    parser_list.set_defaults(func=list_interfaces)
+    output = parser_list.add_mutually_exclusive_group()
+    output.add_argument("--json", dest="output", action="store_const", const="json",
+                        help="Print the interfaces as one JSON array.")
+    output.add_argument("--jsonl", dest="output", action="store_const", const="jsonl",
+                        help="Print one JSON object per interface and line.")
+    # Listing only reads netlink, so it needs no root
+    parser_list.set_defaults(func=lambda args: list_interfaces(output=args.output), root=False,
+                             remote=lambda args: list_interfaces(client.request('list'), args.output))
 
     # 'assign' command
     parser_assign = subparsers.add_parser("assign", help="Assign an application to an interface.")
     parser_assign.add_argument("--app", required=True, help="Path to the application.")
-    parser_assign.add_argument("--iface", required=True, help="Name of the interface.")
-    parser_assign.set_defaults(func=lambda args: assign_app(args.app, args.iface))
+    parser_assign.add_argument("--iface", required=True, action="append",
+                               help="Name of the interface; repeat to balance the app over several.")
+    add_balancing_arguments(parser_assign)
+    parser_assign.add_argument("--download", type=parse_rate, metavar="RATE",
+                               help="Limit the app's download rate, e.g. 20mbit.")
+    parser_assign.add_argument("--upload", type=parse_rate, metavar="RATE",
+                               help="Limit the app's upload rate, e.g. 5mbit.")
+    parser_assign.add_argument("--priority", choices=list(PRIORITIES),
+                               help="Mark the app's traffic as interactive (served first) or bulk (served last).")
+    parser_assign.add_argument("--mode", choices=["netns", "cgroup"], default="netns",
+                               help="Isolate the app in a network namespace (default), or only steer its "
+                                    "packets by cgroup: faster, no veth or namespace, no shaping.")
+    parser_assign.set_defaults(func=lambda args: assign_app(args.app, args.iface, dict(args.weight or []),
+                                                            args.hash_policy,
+                                                            make_shape(args.download, args.upload, args.priority),
+                                                            args.mode),
+                               remote=lambda args: assign_remote(args.app, args.iface, dict(args.weight or []),
+                                                                 args.hash_policy,
+                                                                 make_shape(args.download, args.upload, args.priority),
+                                                                 args.mode))
+
+    # 'release' command
+    parser_release = subparsers.add_parser("release", help="Remove the bindings of an interface.")
+    parser_release.add_argument("--iface", required=True, help="Name of the interface.")
+    parser_release.set_defaults(func=lambda args: release_bindings(args.iface),
+                                remote=lambda args: release_bindings(args.iface, remote=True))
+
+    # 'apply' command
+    parser_apply = subparsers.add_parser("apply", help="Assign many applications at once from a manifest file.")
+    parser_apply.add_argument("manifest", help="JSON or TOML (.toml) file listing the bindings.")
+    parser_apply.add_argument("--prune", action="store_true",
+                              help="Also remove the namespaces intermux created that no binding uses anymore.")
+    parser_apply.set_defaults(func=lambda args: apply_manifest(args.manifest, args.prune),
+                              remote=lambda args: apply_manifest(args.manifest, args.prune, remote=True))
+
+    # 'balance' command
+    parser_balance = subparsers.add_parser("balance", help="Balance all traffic of this host over several interfaces.")
+    parser_balance.add_argument("--iface", required=True, action="append",
+                                help="Name of an interface to balance over; give it at least twice.")
+    add_balancing_arguments(parser_balance)
+    parser_balance.set_defaults(func=lambda args: balance_system(args.iface, dict(args.weight or []),
+                                                                 args.hash_policy))
+
+    # 'pool' command
+    parser_pool = subparsers.add_parser("pool", help="Pre-build namespaces so assign can launch apps instantly.")
+    parser_pool.add_argument("--iface", help="Name of the interface to pre-build namespaces for.")
+    parser_pool.add_argument("--size", type=int, help="Number of ready namespaces to keep.")
+    parser_pool.add_argument("--drain", action="store_true", help="Remove all pre-built namespaces.")
+    parser_pool.set_defaults(func=lambda args: manage_pool(args.iface, args.size, args.drain))
+
+    # 'stats' command
+    parser_stats = subparsers.add_parser("stats", help="Show live throughput of interfaces and bindings.")
+    parser_stats.add_argument("--iface", action="append", help="Only show this interface (repeatable).")
+    parser_stats.add_argument("--interval", type=float, help="Seconds between samples.")
+    parser_stats.add_argument("--count", type=int, help="Stop after this many samples (default: until Ctrl-C).")
+    parser_stats.add_argument("--json", action="store_true", help="Print one JSON object per sample.")
+    parser_stats.set_defaults(func=lambda args: show_stats(args.iface, args.interval, args.count, args.json),
+                              remote=lambda args: show_stats(args.iface, args.interval, args.count, args.json,
+                                                             remote=True))
+
+    # 'failover' command
+    parser_failover = subparsers.add_parser("failover", help="Move bindings to a backup uplink while a gateway is down.")
+    parser_failover.add_argument("--pair", required=True, action="append", type=parse_pair, metavar="PRIMARY=BACKUP",
+                                 help="Uplink to watch and where its bindings go (repeatable).")
+    parser_failover.add_argument("--interval", type=float, help="Seconds between probes.")
+    parser_failover.add_argument("--jitter", type=float,
+                                 help="Random variation of the interval, in seconds.")
+    parser_failover.set_defaults(func=lambda args: watch_gateways(args.pair, args.interval, args.jitter))
+
+    # 'nat' command
+    parser_nat = subparsers.add_parser("nat", help="Show or rebuild the NAT of the bindings.")
+    parser_nat.add_argument("--rebuild", action="store_true",
+                            help="Replace the NAT with exactly the subnets recorded in the ledger.")
+    parser_nat.set_defaults(func=lambda args: manage_nat(args.rebuild))
 
     # 'clear' command
     parser_clear = subparsers.add_parser("clear", help="Clear all assigned paths and routing tables.")
-    parser_clear.set_defaults(func=clear_all_paths)
+    parser_clear.set_defaults(func=lambda args: clear_all_paths(), remote=lambda args: clear_all_paths(remote=True))
 
     # 'reset' command
     parser_reset = subparsers.add_parser("reset", help="Reset everything to system defaults.")
-    parser_reset.set_defaults(func=reset_system)
+    parser_reset.add_argument("--dry-run", action="store_true", default=argparse.SUPPRESS,
+                              help="Print the teardown plan and its commands without running them.")
+    parser_reset.set_defaults(func=lambda args: reset_system(),
+                              remote=lambda args: reset_system(remote=True))
+
+    # 'daemon' command
+    parser_daemon = subparsers.add_parser("daemon", help="Run intermuxd, so other commands need no root.")
+    parser_daemon.add_argument("--socket", default=client.SOCKET_PATH, help="Path of the Unix socket.")
+    parser_daemon.set_defaults(func=lambda args: run_daemon(args.socket))
 
     args = parser.parse_args()
-    if hasattr(args, 'func'):
-        args.func(args) if 'app' in args or 'iface' in args else args.func()
-    else:
+    if not hasattr(args, 'func'):
         parser.print_help()
+        return
+
+    # With intermuxd running, the commands it serves need no root here
+    if (hasattr(args, 'remote') and not (args.no_daemon or args.dry_run or args.profile)
+            and client.available()):
+        try:
+            args.remote(args)
+        except client.DaemonError as e:
+            print(f"[X] Error: {e}")
+        except KeyboardInterrupt:
+            pass
+        return
+    if os.geteuid() != 0 and getattr(args, 'root', True):
+        print("[X] This script must be run as root (or start intermuxd with 'cli.py daemon').")
+        sys.exit(1)
+
+    import logging
+    from core import trace
+    from core import ledger
+    from core import executor
+    logging.basicConfig(level=os.environ.get('INTERMUX_LOG_LEVEL', 'INFO').upper(),
+                        format='%(levelname)s: %(message)s')
+    if args.profile:
+        trace.enable()
+    try:
+        with trace.action(args.command), executor.dry_run() if args.dry_run else nullcontext() as recorded:
+            args.func(args)
+        if args.dry_run:
+            print(f"\n[i] Dry run: {len(recorded)} change(s) would be made:")
+            for argv in recorded:
+                if '<<' in argv:
+                    # ip -batch: show the batched commands one per line
+                    split = argv.index('<<')
+                    print(f"    {' '.join(argv[:split])}")
+                    for line in argv[split + 1].split('\n'):
+                        print(f"        {line}")
+                else:
+                    print(f"    {' '.join(argv)}")
+    except ledger.LedgerError as e:
+        print(f"[X] Error: {e}")
+        sys.exit(1)
+    finally:
+        if args.profile:
+            trace.export_chrome(args.profile)
+            print()
+            trace.print_summary()
+            print(f"[✓] Trace written to {args.profile} (open it in chrome://tracing or ui.perfetto.dev)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+# intermux/core/cgroup.py
+
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import nat
+from core import ledger
+from core import executor
+from core.executor import run_cmd
+from core.router import (check_existing_routing_tables, setup_routing_tables,
+                         ensure_uplink_routing, BINDING_PRIORITY)
+
+# A lightweight binding needs no namespace: the app runs in the cgroup
+# 'intermux/<iface>', the intermux nftables table marks the packets of its
+# sockets ('socket cgroupv2') and an 'ip rule fwmark' sends them to the uplink's
+# routing table. There is no veth hop, and the app keeps the host's loopback,
+# D-Bus and abstract sockets. Bandwidth shaping needs the veth and is not available.
+CGROUP_PARENT = "intermux"
+# The fwmark of a binding is MARK_BASE plus its uplink's routing table ID
+MARK_BASE = 0x1e0000
+
+
+def cgroup2_root():
+    """
+    Returns:
+        str or None: Mount point of the cgroup v2 hierarchy ('/sys/fs/cgroup' on
+                     unified hosts, '/sys/fs/cgroup/unified' on hybrid ones).
+    """
+    try:
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'cgroup2':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def binding_for(iface, root=None):
+    """
+    Returns the names used for the cgroup binding of an uplink.
+
+    Returns:
+        dict: iface, cgroup (path relative to the cgroup2 root) and dir (its directory).
+    """
+    root = root or cgroup2_root() or '/sys/fs/cgroup'
+    path = f"{CGROUP_PARENT}/{iface}"
+    return {'iface': iface, 'cgroup': path, 'dir': os.path.join(root, path)}
+
+
+def fwmark_for(table_id):
+    return MARK_BASE + table_id
+
+
+def bind(iface):
+    """
+    Creates the cgroup, packet marking and fwmark rule that send an uplink's binding
+    through its routing table. Already existing pieces are kept.
+
+    Returns:
+        dict: The binding description, see binding_for(), with 'mark' and 'table' added.
+
+    Raises:
+        RuntimeError: If cgroup v2 or nftables is not available, or the uplink's
+                      routing could not be set up.
+        ValueError: If the uplink has no IPv4 address and gateway.
+    """
+    root = cgroup2_root()
+    if root is None:
+        raise RuntimeError("No cgroup v2 hierarchy is mounted")
+    if not check_existing_routing_tables():
+        setup_routing_tables()
+    table_id = ensure_uplink_routing(iface)
+
+    names = binding_for(iface, root)
+    names['mark'] = fwmark_for(table_id)
+    names['table'] = table_id
+    rule = f"fwmark {names['mark']:#x} table {table_id} priority {BINDING_PRIORITY}"
+    details = {'iface': iface, 'dir': names['dir'], 'mark': names['mark']}
+    # A rule left from an earlier table ID of the same uplink
+    stale = [key for key, entry in ledger.entries('rule').items()
+             if entry.get('cgroup') == names['cgroup'] and key != rule]
+    ledger.record([('cgroup', names['cgroup'], details),
+                   ('rule', rule, {'cgroup': names['cgroup'], 'table': table_id})])
+
+    if not executor.record_instead(['mkdir', '-p', names['dir']]):
+        os.makedirs(names['dir'], exist_ok=True)
+    cgroups = ledger.entries('cgroup')
+    cgroups[names['cgroup']] = details
+    if not nat.mark_cgroups(cgroups):
+        raise RuntimeError(f"Could not mark the packets of cgroup {names['cgroup']}")
+    for key in stale:
+        run_cmd(f"ip rule del {key}")
+    ledger.forget([('rule', key) for key in stale])
+    run_cmd(f"ip rule add {rule}")
+    return names
+
+
+def remove_cgroup(directory):
+    """
+    Removes a binding cgroup. Apps still running in it are moved to the root
+    cgroup first; they keep running on the host's default routing.
+    """
+    root = os.path.dirname(os.path.dirname(directory))
+    try:
+        with open(os.path.join(directory, "cgroup.procs")) as f:
+            pids = f.read().split()
+    except OSError:
+        return
+    for pid in pids:
+        try:
+            with open(os.path.join(root, "cgroup.procs"), "w") as f:
+                f.write(pid)
+        except OSError:
+            pass  # The process exited meanwhile
+    for path in (directory, os.path.dirname(directory)):
+        try:
+            os.rmdir(path)
+        except OSError:
+            break  # The parent still holds other bindings
+
+
+def provision(bindings, launch=None, progress=None):
+    """
+    Binds apps to uplinks through cgroups and launches them.
+
+    Args:
+        bindings (list): (app, iface) tuples.
+        launch (callable): launch(app, names) called once the app's cgroup is ready;
+                           it must start the app in names['dir'].
+        progress (callable): Called with a message before each step.
+
+    Returns:
+        dict: {'bindings': [{'app', 'iface', 'cgroup', 'seconds'}], 'total_seconds': float},
+              like core.provision.provision().
+    """
+    step = progress or (lambda message: None)
+    start = time.perf_counter()
+    bound = {}
+    report = []
+    for app, iface in bindings:
+        if iface not in bound:
+            step(f"{iface}: binding cgroup")
+            bound[iface] = bind(iface)
+        names = bound[iface]
+        if launch:
+            step(f"{iface}: launching {os.path.basename(app)}")
+            launch(app, names)
+        report.append({'app': app, 'iface': iface, 'cgroup': names['cgroup'],
+                       'seconds': time.perf_counter() - start})
+    return {'bindings': report, 'total_seconds': time.perf_counter() - start}
@@ -0,0 +1,63 @@
+# intermux/core/client.py
+
+import os
+import sys
+import json
+import socket
+
+# Client side of intermuxd (core.daemon), kept free of heavy imports so thin
+# clients start fast. One JSON object per line each way:
+#   request   {"command": "assign", ...arguments}
+#   response  {"ok": true, "result": ..., "output": "..."} or {"ok": false, "error": "..."}
+SOCKET_PATH = os.environ.get('INTERMUX_SOCKET', '/run/intermux/intermuxd.sock')
+REQUEST_TIMEOUT = float(os.environ.get('INTERMUX_REQUEST_TIMEOUT', '120'))
+
+# Client variables passed on to launched apps, so they reach the user's display and session bus
+LAUNCH_ENV = ('DISPLAY', 'XAUTHORITY', 'WAYLAND_DISPLAY', 'XDG_RUNTIME_DIR', 'DBUS_SESSION_BUS_ADDRESS')
+
+
+class DaemonError(RuntimeError):
+    """The daemon refused or failed a request."""
+
+
+def available(path=None):
+    """Returns True if a daemon answers on the socket."""
+    path = path or SOCKET_PATH
+    if not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def request(command, path=None, timeout=REQUEST_TIMEOUT, **arguments):
+    """
+    Sends one request to the daemon and waits for its answer.
+
+    Progress messages the daemon printed while handling the request are written
+    to stdout.
+
+    Returns:
+        The command's result.
+
+    Raises:
+        OSError: If the daemon is not running.
+        DaemonError: If the daemon could not carry out the request.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or SOCKET_PATH)
+        sock.sendall((json.dumps(dict(arguments, command=command)) + '\n').encode())
+        with sock.makefile('rb') as stream:
+            line = stream.readline()
+    if not line:
+        raise DaemonError("The daemon closed the connection")
+    response = json.loads(line)
+    if response.get('output'):
+        sys.stdout.write(response['output'])
+    if not response['ok']:
+        raise DaemonError(response['error'])
+    return response['result']
@@ -0,0 +1,263 @@
+# intermux/core/daemon.py
+
+import io
+import os
+import sys
+import grp
+import json
+import socket
+import struct
+import logging
+import threading
+import contextlib
+import contextvars
+import socketserver
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import cgroup
+from core import executor
+from core import manifest
+from core.client import SOCKET_PATH, LAUNCH_ENV
+from core.interface import get_active_interfaces
+from core.monitor import InterfaceMonitor
+from core.provision import provision
+from core.pool import NamespacePool, POOL_SIZE
+from core.router import clear_custom_routing_tables, setup_routing_tables
+from core.multipath import setup_multipath_routing
+from core.shaping import make_shape
+from core.stats import ThroughputSampler
+from core.teardown import teardown, release
+
+# intermuxd keeps the interface table, throughput history and namespace pool in
+# memory and serves them over a Unix socket; the protocol and the client are in
+# core.client. Only the daemon runs as root. The socket is open to root and to
+# members of SOCKET_GROUP; apps are launched with the uid and gid of the client
+# that asked.
+SOCKET_GROUP = os.environ.get('INTERMUX_GROUP', 'intermux')
+
+_PEERCRED = struct.Struct('3i')
+
+# Buffer of the request the current thread (or its carried worker) is handling
+_request_output = contextvars.ContextVar('intermux_request_output', default=None)
+
+
+class _Output(io.TextIOBase):
+    """
+    The daemon's sys.stdout: what core prints while handling a request goes to that
+    request's buffer, so concurrent requests never see each other's output.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        return (_request_output.get() or self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _spawn_in(names, argv):
+    """Starts argv in the namespace or cgroup of a binding."""
+    if 'ns' in names:
+        executor.spawn(["ip", "netns", "exec", names['ns']] + argv)
+    else:
+        executor.spawn(argv, cgroup=names['dir'])
+
+
+def _launch_command(app, arguments, env, uid, gid):
+    """argv that starts `app` as the client's user with the client's session variables."""
+    argv = ["env"] + [f"{key}={value}" for key, value in sorted(env.items()) if key in LAUNCH_ENV]
+    argv += [app] + list(arguments)
+    if uid != 0:
+        argv = ["setpriv", f"--reuid={uid}", f"--regid={gid}", "--init-groups"] + argv
+    return argv
+
+
+class Intermuxd:
+    """
+    The daemon: owns the in-memory state and answers requests.
+
+    Commands:
+        list      Interface table (from the netlink monitor, no scan per request).
+        assign    app, ifaces, weights, hash_policy, shape, mode, args, env -> provisioning report.
+        apply     bindings (from core.manifest.load()), env, prune -> provisioning report.
+        release   iface -> number of resources removed.
+        stats     window -> throughput of every interface, see core.stats.
+        tables    Creates the per-uplink routing tables.
+        clear     Removes the custom routing tables.
+        reset     Removes everything intermux created -> timing report, see core.teardown.run().
+
+    Changes are made one request at a time; list and stats are answered concurrently.
+
+    Args:
+        path (str): Socket path.
+        pool_size (int): Pre-built namespaces kept per uplink.
+    """
+
+    def __init__(self, path=None, pool_size=POOL_SIZE):
+        self.path = path or SOCKET_PATH
+        self.monitor = InterfaceMonitor()
+        self.sampler = ThroughputSampler()
+        self.pool = NamespacePool(size=pool_size) if pool_size > 0 else None
+        self._changing = threading.Lock()
+        self._server = None
+        self._commands = {
+            'list': self.list,
+            'assign': self.assign,
+            'apply': self.apply,
+            'release': self.release,
+            'stats': self.stats,
+            'tables': self.tables,
+            'clear': self.clear,
+            'reset': self.reset,
+        }
+        self._changes = {'assign', 'apply', 'release', 'tables', 'clear', 'reset'}
+
+    def start(self):
+        """Loads the interface table, starts sampling and listens on the socket."""
+        try:
+            self.monitor.start()
+        except OSError as e:
+            logging.warning(f"Interface monitor unavailable, scanning per request: {e}")
+            self.monitor = None
+        self.sampler.start()
+        if not isinstance(sys.stdout, _Output):
+            sys.stdout = _Output(sys.stdout)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._server = _Server(self.path, self)
+        try:
+            os.chown(self.path, 0, grp.getgrnam(SOCKET_GROUP).gr_gid)
+            os.chmod(self.path, 0o660)
+        except KeyError:
+            os.chmod(self.path, 0o600)  # No such group: root only
+        if self.pool and self.monitor:
+            for iface in self.monitor.get_interfaces():
+                if iface['flag'] == 'UP' and iface['gateways']:
+                    self.pool.refill_async(iface['name'])
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+        self.sampler.stop()
+        if self.monitor:
+            self.monitor.stop()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+        if isinstance(sys.stdout, _Output):
+            sys.stdout = sys.stdout.stream
+
+    def handle(self, message, uid, gid):
+        """
+        Runs one request.
+
+        Returns:
+            tuple: (result, printed output).
+        """
+        if not isinstance(message, dict):
+            raise ValueError("A request must be a JSON object")
+        command = self._commands.get(message.get('command'))
+        if command is None:
+            raise ValueError(f"Unknown command '{message.get('command')}'")
+        arguments = {key: value for key, value in message.items() if key != 'command'}
+        output = io.StringIO()
+        token = _request_output.set(output)
+        try:
+            if message['command'] not in self._changes:
+                return command(**arguments), output.getvalue()
+            with self._changing:
+                if message['command'] in ('assign', 'apply'):
+                    arguments.update(uid=uid, gid=gid)
+                result = command(**arguments)
+            return result, output.getvalue()
+        finally:
+            _request_output.reset(token)
+
+    def list(self):
+        return self.monitor.get_interfaces() if self.monitor else get_active_interfaces()
+
+    def assign(self, app, ifaces, uid, gid, weights=None, hash_policy='l3', shape=None, mode='netns',
+               args=(), env=None):
+        if not os.path.isabs(app) or not os.path.exists(app):
+            raise ValueError(f"Application path not found: {app}")
+        if not ifaces:
+            raise ValueError("No interface given")
+        shape = make_shape(**(shape or {}))
+        if len(ifaces) > 1:
+            iface = setup_multipath_routing(ifaces, weights, hash_policy)
+            if iface is None:
+                raise RuntimeError(f"Could not balance over {', '.join(ifaces)}")
+        else:
+            iface = ifaces[0]
+
+        def launch(app, names):
+            _spawn_in(names, _launch_command(app, args, env or {}, uid, gid))
+
+        if mode == 'cgroup':
+            if shape:
+                raise ValueError("Bandwidth limits and priority need a namespace")
+            return cgroup.provision([(app, iface)], launch=launch)
+        return provision([(app, iface, shape)], launch=launch, pool=self.pool)
+
+    def apply(self, bindings, uid, gid, env=None, prune=False):
+        bindings = manifest.validate(bindings, self.list())
+
+        def launch(binding, names):
+            _spawn_in(names, _launch_command(binding['app'], binding['args'], env or {}, uid, gid))
+
+        return manifest.apply(bindings, launch=launch, pool=self.pool, prune=prune)
+
+    def release(self, iface):
+        return release(iface, progress=lambda message: print(f"[+] {message}"))
+
+    def stats(self, window=1):
+        return self.sampler.snapshot(window)
+
+    def tables(self):
+        return setup_routing_tables()
+
+    def clear(self):
+        clear_custom_routing_tables()
+        return True
+
+    def reset(self):
+        report = teardown(progress=lambda message: print(f"[+] {message}"))
+        (self.pool or NamespacePool(size=0)).drain()
+        return report
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        credentials = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size)
+        _pid, uid, gid = _PEERCRED.unpack(credentials)
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                result, output = self.server.daemon.handle(message, uid, gid)
+                reply = json.dumps({'ok': True, 'result': result, 'output': output})
+            except (ValueError, TypeError, KeyError, RuntimeError, OSError) as e:
+                reply = json.dumps({'ok': False, 'error': str(e)})
+            except Exception as e:
+                # A bug in one request must not cost the client its connection
+                logging.exception("Request failed")
+                reply = json.dumps({'ok': False, 'error': f"Internal error: {e}"})
+            self.wfile.write((reply + '\n').encode())
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        super().__init__(path, _Handler)
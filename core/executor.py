@@ -0,0 +1,220 @@
+# intermux/core/executor.py
+
+import os
+import sys
+import time
+import shlex
+import threading
+import contextlib
+import contextvars
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import trace
+
+# Every external command intermux runs goes through this module: no shell, a
+# timeout on every call, retries while iptables waits for the xtables lock, and
+# a cap on how many commands run at the same time.
+TIMEOUT = float(os.environ.get('INTERMUX_CMD_TIMEOUT', '30'))
+MAX_CONCURRENT = int(os.environ.get('INTERMUX_MAX_PROCS', '8'))
+LOCK_RETRIES = 5
+
+# Errors that only mean the resource is already in the requested state
+HARMLESS_ERRORS = [
+    "File exists",
+    "Cannot create namespace file",
+    "already exists",
+    "exists but is not a directory",
+    "Cannot find device",
+    "No such file or directory",
+]
+
+# Errors after which the same command succeeds once another process is done
+LOCK_ERRORS = [
+    "xtables lock",
+    "Resource temporarily unavailable",
+]
+
+TIMEOUT_EXIT = 124
+NOT_FOUND_EXIT = 127
+
+_limiter = threading.BoundedSemaphore(MAX_CONCURRENT)
+_change_listeners = []
+# Per thread (and per task): one daemon request's dry run must not capture another's commands
+_recorded = contextvars.ContextVar('intermux_dry_run', default=None)
+
+
+def on_change(listener):
+    """Registers listener(), called after every command that may have changed the system."""
+    _change_listeners.append(listener)
+
+
+def dry_running():
+    return _recorded.get() is not None
+
+
+def carry(fn):
+    """
+    Wraps `fn` to run in a copy of the caller's context, so work handed to a thread
+    pool is still recorded when the caller is inside dry_run().
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def dry_run():
+    """
+    Records commands that would change the system instead of running them.
+
+    Read-only commands still run, so planning works as usual. Yields the list the
+    commands are appended to, as argv lists.
+    """
+    recorded = []
+    token = _recorded.set(recorded)
+    try:
+        yield recorded
+    finally:
+        _recorded.reset(token)
+
+
+def record_instead(description):
+    """
+    For changes made from Python (file edits): during a dry run, records
+    `description` (an argv-style list) and returns True so the caller skips
+    the change.
+    """
+    recorded = _recorded.get()
+    if recorded is None:
+        return False
+    recorded.append(list(description))
+    return True
+
+
+def _argv(cmd):
+    return shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+
+
+def _caller():
+    """Name of the first function outside this module, for the trace."""
+    frame = sys._getframe(1)
+    while frame and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame else None
+
+
+def run(cmd, input=None, timeout=TIMEOUT, readonly=False):
+    """
+    Runs one command without a shell.
+
+    Args:
+        cmd (list or str): argv list; a string is split like a shell would, but
+                           no shell features (redirections, variables) apply.
+        input (str): Written to the command's stdin.
+        timeout (float): Seconds before the command is killed.
+        readonly (bool): The command only reads state; it runs during a dry run
+                         and does not invalidate cached interface snapshots.
+
+    Returns:
+        subprocess.CompletedProcess: Never raises for a failing command; a timeout
+        gives exit code 124 and a missing program 127.
+    """
+    argv = _argv(cmd)
+    recorded = _recorded.get()
+    if recorded is not None and not readonly:
+        recorded.append(argv + (['<<', input.strip()] if input else []))
+        return subprocess.CompletedProcess(argv, 0, "", "")
+
+    with _limiter, trace.command(argv, caller=_caller()) as traced:
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                result = subprocess.run(argv, input=input, capture_output=True, text=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                result = subprocess.CompletedProcess(argv, TIMEOUT_EXIT, "", f"timed out after {timeout:g}s")
+            except FileNotFoundError:
+                result = subprocess.CompletedProcess(argv, NOT_FOUND_EXIT, "", f"{argv[0]}: command not found")
+            if (result.returncode == 0 or attempt == LOCK_RETRIES
+                    or not any(err in result.stderr for err in LOCK_ERRORS)):
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        traced.returncode = result.returncode
+
+    if not readonly:
+        for listener in _change_listeners:
+            listener()
+    return result
+
+
+def stream(cmd, timeout=TIMEOUT):
+    """
+    Runs a read-only command and yields its output line by line as it is produced,
+    so large outputs (e.g. a full routing table) never have to fit in memory.
+
+    The command is killed if it runs longer than `timeout` seconds; the lines read
+    until then are still yielded.
+    """
+    argv = _argv(cmd)
+    with trace.command(argv, caller=_caller()) as traced:
+        # The slot only limits how many commands start at once: a consumer that
+        # reads slowly (or stops early) must not hold it for the generator's lifetime
+        try:
+            with _limiter:
+                process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except FileNotFoundError:
+            traced.returncode = NOT_FOUND_EXIT
+            return
+        watchdog = threading.Timer(timeout, process.kill)
+        watchdog.start()
+        try:
+            yield from process.stdout
+        finally:
+            watchdog.cancel()
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            traced.returncode = process.wait()
+
+
+def run_cmd(cmd, readonly=False, harmless=HARMLESS_ERRORS):
+    """
+    Runs a command and prints its error unless it is harmless.
+
+    Returns:
+        str: The command's stripped standard output.
+    """
+    result = run(cmd, readonly=readonly)
+    stderr = result.stderr.strip()
+    if result.returncode != 0 and not any(err in stderr for err in harmless):
+        print(f"[!] {cmd if isinstance(cmd, str) else shlex.join(cmd)}\n    -> {stderr}")
+    return result.stdout.strip()
+
+
+# Moves the shell into the cgroup ($0 is the cgroup.procs path) and then replaces it with
+# the application, so the application starts inside the group without any Python code
+# running between fork and exec (which is unsafe in a threaded process)
+CGROUP_EXEC = 'echo $$ > "$0" && exec "$@"'
+
+
+def spawn(cmd, env=None, cgroup=None):
+    """
+    Starts a long-running process (an application) in the background; its argv is
+    never interpreted by a shell.
+
+    Args:
+        cgroup (str): Directory of a cgroup v2 group the process is started in, so
+                      even its first packets are matched by that group. A small
+                      'sh' wrapper joins the group and then execs the command.
+
+    Returns:
+        subprocess.Popen or None: None during a dry run.
+    """
+    argv = _argv(cmd)
+    recorded = _recorded.get()
+    if recorded is not None:
+        recorded.append(argv)
+        return None
+    if cgroup:
+        argv = ["sh", "-c", CGROUP_EXEC, os.path.join(cgroup, "cgroup.procs")] + argv
+    with trace.command(argv, caller=_caller()) as traced:
+        process = subprocess.Popen(argv, env=env)
+        traced.returncode = 0
+    return process
@@ -0,0 +1,285 @@
+# intermux/core/health.py
+
+import os
+import sys
+import time
+import random
+import select
+import socket
+import struct
+import logging
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import ledger
+from core.executor import run_cmd
+from core.interface import get_active_interfaces
+from core.router import (RouteBatch, get_routing_table_ids, setup_interface_routing,
+                         BINDING_PRIORITY)
+
+# An uplink is declared down after FAILURES missed probes in a row (or at once when
+# its link goes down) and up again after RECOVERIES answered probes in a row. With
+# the defaults a dead gateway is noticed in well under a second.
+PROBE_INTERVAL = float(os.environ.get('INTERMUX_PROBE_INTERVAL', '0.2'))
+PROBE_JITTER = 0.05
+PROBE_TIMEOUT = 0.15
+FAILURES = 2
+RECOVERIES = 3
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class GatewayProbe:
+    """
+    Pings a gateway with ICMP echo requests over a raw socket bound to its uplink.
+
+    No process is spawned per probe. Needs root (CAP_NET_RAW).
+
+    Args:
+        iface (str): The uplink interface.
+        gateway (str): The gateway's IPv4 address.
+        timeout (float): Seconds to wait for the reply.
+    """
+
+    def __init__(self, iface, gateway, timeout=PROBE_TIMEOUT):
+        self.iface = iface
+        self.gateway = gateway
+        self.timeout = timeout
+        self._ident = random.randrange(1 << 16)
+        self._sequence = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self._sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, iface.encode())
+        self._sock.setblocking(False)
+
+    def close(self):
+        self._sock.close()
+
+    def probe(self):
+        """
+        Returns:
+            bool: True if the gateway answered within the timeout.
+        """
+        self._sequence = (self._sequence + 1) & 0xffff
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self._ident, self._sequence)
+        payload = b'intermux'
+        packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, _checksum(header + payload),
+                             self._ident, self._sequence) + payload
+        try:
+            self._sock.sendto(packet, (self.gateway, 0))
+        except OSError:
+            return False  # No route or link down
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._sock], [], [], remaining)[0]:
+                return False
+            try:
+                data, (source, _port) = self._sock.recvfrom(2048)
+            except OSError:
+                continue
+            offset = (data[0] & 0x0f) * 4  # Skip the IP header
+            if source != self.gateway or len(data) < offset + 8:
+                continue
+            reply_type, _code, _sum, ident, sequence = struct.unpack_from('!BBHHH', data, offset)
+            if reply_type == ICMP_ECHO_REPLY and ident == self._ident and sequence == self._sequence:
+                return True
+
+
+def _binding_rules(uplink):
+    """
+    Returns the ledger's binding rules of the namespaces and cgroups created for `uplink`.
+
+    Returns:
+        list: (rule key, details) of 'from <subnet> table <id> priority <prio>' and
+              'fwmark <mark> table <id> priority <prio>' rules.
+    """
+    owners = {('ns', ns) for ns, details in ledger.entries('netns').items() if details.get('iface') == uplink}
+    owners |= {('cgroup', path) for path, details in ledger.entries('cgroup').items()
+               if details.get('iface') == uplink}
+    return [(key, details) for key, details in ledger.entries('rule').items()
+            if any((kind, details.get(kind)) in owners for kind in ('ns', 'cgroup'))]
+
+
+def move_bindings(uplink, target):
+    """
+    Steers the namespaces and cgroups bound to `uplink` into the routing table of `target`.
+
+    Their NAT masquerades on any interface, so only the steering rules change (the
+    source or fwmark selector is kept); the new rule is added before the old one is
+    removed, and the ledger follows.
+    Passing target == uplink moves them back.
+
+    Returns:
+        int: Number of bindings moved.
+    """
+    table_id = get_routing_table_ids().get(f"{target}_rt")
+    if table_id is None:
+        logging.error(f"No routing table for {target}, cannot move the bindings of {uplink}.")
+        return 0
+    batch = RouteBatch()
+    forget = []
+    subnets = []
+    for key, details in _binding_rules(uplink):
+        if details.get('table') == table_id:
+            continue
+        selector, value = key.split()[:2]
+        rule = f"{selector} {value} table {table_id} priority {BINDING_PRIORITY}"
+        batch.record('rule', rule, dict(details, table=table_id))
+        batch.add(f"rule add {rule}", undo=f"rule del {rule}")
+        batch.add(f"rule del {key}", undo=f"rule add {key}")
+        forget.append(('rule', key))
+        if selector == 'from':
+            subnets.append(value)
+    if not forget or not batch.commit():
+        return 0
+    ledger.forget(forget)
+    for subnet in subnets:
+        # Connections masqueraded behind the old uplink's address cannot survive the move
+        run_cmd(f"conntrack -D -s {subnet}", harmless=["0 flow entries", "command not found"])
+    return len(forget)
+
+
+def restore_uplink_routing(uplink):
+    """
+    Re-creates the routing table of an uplink whose routes the kernel flushed while its
+    link was down.
+    """
+    table_id = get_routing_table_ids().get(f"{uplink}_rt")
+    if table_id is None or run_cmd(f"ip route show table {table_id} default", readonly=True):
+        return
+    for iface in get_active_interfaces(use_cache=False):
+        ipv4s = [ip for ip in iface['ip_addresses'] if ':' not in ip]
+        if iface['name'] == uplink and ipv4s and iface['gateways']:
+            setup_interface_routing(uplink, ipv4s[0], iface['gateways'][0], table_id)
+
+
+class HealthMonitor:
+    """
+    Probes the gateway of each primary uplink and fails its bindings over to a backup.
+
+    Every primary gets a probing thread (interval plus random jitter, so probes of
+    many uplinks do not line up). The gateway is looked up in the interface table
+    before every probe, so a new DHCP lease is followed. If an InterfaceMonitor is
+    given, it is that table, and a link going down fails over at once instead of
+    waiting for missed probes. When the primary answers again, the bindings are
+    moved back.
+
+    Args:
+        backups (dict): Primary uplink -> backup uplink.
+        interval (float): Seconds between probes.
+        jitter (float): Up to this many seconds are added to or taken from each interval.
+        timeout (float): Seconds to wait for each reply.
+        failures (int): Missed probes in a row before an uplink is down.
+        recoveries (int): Answered probes in a row before it is up again.
+        on_event (callable): on_event(primary, state, moved) after every failover or recovery.
+        monitor (core.monitor.InterfaceMonitor): Optional source of link events.
+    """
+
+    def __init__(self, backups, interval=PROBE_INTERVAL, jitter=PROBE_JITTER, timeout=PROBE_TIMEOUT,
+                 failures=FAILURES, recoveries=RECOVERIES, on_event=None, monitor=None):
+        self.backups = dict(backups)
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.failures = failures
+        self.recoveries = recoveries
+        self.on_event = on_event
+        self.monitor = monitor
+        self.state = {primary: 'up' for primary in self.backups}
+        self._streak = {primary: 0 for primary in self.backups}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Starts probing every primary uplink.
+
+        Raises:
+            ValueError: If a primary uplink has no gateway.
+        """
+        gateways = self._gateways(use_cache=False)
+        missing = [primary for primary in self.backups if primary not in gateways]
+        if missing:
+            raise ValueError(f"No gateway to probe on: {', '.join(missing)}")
+        self._stop.clear()
+        for primary in self.backups:
+            probe = GatewayProbe(primary, gateways[primary], self.timeout)
+            thread = threading.Thread(target=self._run, args=(probe,), name=f"intermux-health-{primary}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.monitor:
+            self.monitor.add_callback(self._on_link_change)
+
+    def stop(self):
+        self._stop.set()
+        if self.monitor:
+            self.monitor.remove_callback(self._on_link_change)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _gateways(self, use_cache=True):
+        interfaces = self.monitor.get_interfaces() if self.monitor else get_active_interfaces(use_cache=use_cache)
+        return {iface['name']: iface['gateways'][0] for iface in interfaces if iface['gateways']}
+
+    def _run(self, probe):
+        try:
+            while not self._stop.is_set():
+                # No gateway (lease lost, link gone) counts as a missed probe
+                probe.gateway = self._gateways().get(probe.iface)
+                self.report(probe.iface, probe.gateway is not None and probe.probe())
+                delay = self.interval + random.uniform(-self.jitter, self.jitter)
+                self._stop.wait(max(delay, 0.01))
+        finally:
+            probe.close()
+
+    def _on_link_change(self, name, info):
+        if name in self.backups and (info is None or info['flag'] != 'UP'):
+            self._set_state(name, 'down')
+
+    def report(self, primary, answered):
+        """Counts one probe result and switches the uplink's state after enough in a row."""
+        with self._lock:
+            state = self.state[primary]
+            if answered == (state == 'up'):
+                self._streak[primary] = 0
+                return
+            self._streak[primary] += 1
+            needed = self.failures if state == 'up' else self.recoveries
+            if self._streak[primary] < needed:
+                return
+        self._set_state(primary, 'down' if state == 'up' else 'up')
+
+    def _set_state(self, primary, state):
+        # The transition and the move happen under one lock: a recovery cannot run
+        # before the failover it reverses has finished, and the backup's state is
+        # not read while it is changing
+        with self._lock:
+            if self.state[primary] == state:
+                return
+            self.state[primary] = state
+            self._streak[primary] = 0
+            if state == 'down':
+                backup = self.backups[primary]
+                if self.state.get(backup) == 'down':
+                    logging.warning(f"Backup {backup} of {primary} is down too, bindings stay where they are.")
+                    moved = 0
+                else:
+                    moved = move_bindings(primary, backup)
+            else:
+                restore_uplink_routing(primary)
+                moved = move_bindings(primary, primary)
+        if self.on_event:
+            self.on_event(primary, state, moved)
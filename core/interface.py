@@ -2,14 +2,34 @@
 
 import subprocess
 import re
+import json
 import logging
+import os
+import sys
+import copy
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import netlink
+from core import executor
 
-# Configure logging for better error reporting and debugging
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+# Discovery backend: 'netlink' (no process spawns) or 'ip' (subprocess fallback)
+BACKEND = os.environ.get('INTERMUX_BACKEND', 'netlink')
+
+# Seconds a cached interface snapshot stays valid
+CACHE_TTL = float(os.environ.get('INTERMUX_CACHE_TTL', '2'))
+RESOLV_CONF_PATH = '/etc/resolv.conf'
+
+# Bumped whenever intermux (or the interface monitor) sees links or routes change;
+# a cached snapshot from an older generation is never returned.
+_generation = 0
+_cache_lock = threading.Lock()
+_interface_cache = {}  # backend -> (generation, timestamp, interfaces)
+_dns_cache = None      # (resolv.conf mtime, servers)
 
 def _run_command(command_parts, check_return=True, suppress_errors=False):
     """
-    Helper function to run a shell command and capture its output.
+    Helper function to run a read-only command through core.executor and capture its output.
 
     Args:
         command_parts (list): A list of strings representing the command and its arguments.
@@ -25,14 +45,11 @@ def _run_command(command_parts, check_return=True, suppress_errors=False):
         FileNotFoundError: If the command itself is not found.
     """
     try:
-        result = subprocess.run(
-            command_parts,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,  # Capture stderr to log potential issues
-            text=True,
-            check=check_return,
-            encoding='utf-8' # Ensure consistent encoding
-        )
+        result = executor.run(command_parts, readonly=True)
+        if result.returncode == executor.NOT_FOUND_EXIT:
+            raise FileNotFoundError(result.stderr)
+        if check_return:
+            result.check_returncode()
         return result.stdout.strip()
     except FileNotFoundError:
         logging.error(f"Command not found: '{' '.join(command_parts)}'. Make sure it's in your PATH.")
@@ -49,17 +66,47 @@ def _run_command(command_parts, check_return=True, suppress_errors=False):
             raise
     return "" # Return empty string on error if suppressed
 
+def invalidate_cache():
+    """
+    Marks every cached interface snapshot as stale.
+
+    Call this after changing links, addresses or routes.
+    """
+    global _generation
+    with _cache_lock:
+        _generation += 1
+
+# Commands run through the executor that change links or routes make snapshots stale
+executor.on_change(invalidate_cache)
+
 def get_system_dns_servers():
     """
     Reads the system's DNS servers from /etc/resolv.conf.
     Note: These are typically system-wide, not per-interface.
 
+    The result is cached until the file's modification time changes.
+
     Returns:
         list: A list of IP addresses of DNS servers.
     """
+    global _dns_cache
+    try:
+        mtime = os.stat(RESOLV_CONF_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+    cached = _dns_cache
+    if cached is not None and mtime is not None and cached[0] == mtime:
+        return list(cached[1])
+
+    dns_servers = _read_system_dns_servers()
+    if mtime is not None:
+        _dns_cache = (mtime, dns_servers)
+    return list(dns_servers)
+
+def _read_system_dns_servers():
     dns_servers = []
     try:
-        with open('/etc/resolv.conf', 'r') as f:
+        with open(RESOLV_CONF_PATH, 'r') as f:
             for line in f:
                 line = line.strip()
                 if line.startswith('nameserver'):
@@ -71,116 +118,321 @@ def get_system_dns_servers():
                            re.match(r'^([0-9a-fA-F]{1,4}:){1,7}[0-9a-fA-F]{1,4}$', ip):
                             dns_servers.append(ip)
     except FileNotFoundError:
-        logging.warning("/etc/resolv.conf not found. Cannot determine DNS servers.")
+        logging.warning(f"{RESOLV_CONF_PATH} not found. Cannot determine DNS servers.")
     except Exception as e:
-        logging.error(f"Error reading /etc/resolv.conf: {e}")
+        logging.error(f"Error reading {RESOLV_CONF_PATH}: {e}")
     return dns_servers
 
-def get_active_interfaces():
+def _run_json_command(command_parts):
+    """
+    Runs an 'ip -j' command and decodes its JSON output.
+
+    Args:
+        command_parts (list): The command and its arguments, including '-j'.
+
+    Returns:
+        list: The decoded JSON array, or an empty list on error.
+    """
+    output = _run_command(command_parts, suppress_errors=True)
+    if not output:
+        return []
+    try:
+        return json.loads(output)
+    except ValueError as e:
+        logging.error(f"Could not parse JSON from '{' '.join(command_parts)}': {e}")
+        return []
+
+def _detect_interface_type(name):
+    """
+    Guesses the interface type from its name.
+
+    Args:
+        name (str): The interface name, e.g. 'wlan0'.
+
+    Returns:
+        str: A human readable interface type.
+    """
+    if name.startswith("wl"):
+        return "Wi-Fi"
+    elif name.startswith("en") or name.startswith("eth"):
+        return "Ethernet"
+    elif name.startswith("usb"):
+        return "USB"
+    elif name.startswith("bnep") or name.startswith("bt"):
+        return "Bluetooth Tethering"
+    elif name.startswith("veth") or name.startswith("br") or \
+         name.startswith("docker") or name.startswith("tun") or \
+         name.startswith("tap"):
+        return "Virtual/Bridge/VPN"
+    return "Unknown"
+
+def _index_addresses(addr_entries):
+    """
+    Builds a per-interface index of IP addresses from 'ip -j addr show' output.
+
+    IPv4 addresses are listed before IPv6 addresses for every interface.
+
+    Args:
+        addr_entries (list): Decoded 'ip -j addr show' output.
+
+    Returns:
+        dict: Interface name -> list of 'address/prefix' strings.
+    """
+    index = {}
+    for entry in addr_entries:
+        name = entry.get('ifname')
+        if not name:
+            continue
+        ipv4, ipv6 = [], []
+        for addr in entry.get('addr_info', []):
+            local = addr.get('local')
+            if not local:
+                continue
+            ip_with_cidr = f"{local}/{addr.get('prefixlen')}"
+            if addr.get('family') == 'inet6':
+                ipv6.append(ip_with_cidr)
+            else:
+                ipv4.append(ip_with_cidr)
+        index[name] = ipv4 + ipv6
+    return index
+
+def route_hops(route):
+    """
+    Returns the (dev, gateway) pairs a route sends traffic through: one for a plain
+    route, one per nexthop for a multipath route.
+    """
+    if 'nexthops' in route:
+        return [(hop.get('dev'), hop.get('gateway')) for hop in route['nexthops']]
+    return [(route.get('dev'), route.get('gateway'))]
+
+def _index_routes(route_entries):
+    """
+    Builds a per-interface index of metric and gateways from 'ip -j route show' style routes.
+
+    Routes are matched on their exact 'dev', so 'eth1' never picks up routes of 'eth10'.
+    The routes are consumed in a single pass and only the index is kept, so a generator
+    over a full routing table needs memory for the distinct gateways only.
+
+    Args:
+        route_entries (iterable): Route dictionaries with 'dev', 'gateway', 'metric'
+                                  and, for multipath routes, 'nexthops'.
+
+    Returns:
+        dict: Interface name -> {'metric': int or 'N/A', 'gateways': list}.
+    """
+    index = {}
+    for route in route_entries:
+        for dev, gateway in route_hops(route):
+            if not dev:
+                continue
+            info = index.get(dev)
+            if info is None:
+                # Gateways are kept as dict keys: O(1) dedup that keeps their order
+                info = index[dev] = {'metric': 'N/A', 'gateways': {}}
+            if 'metric' in route:
+                info['metric'] = int(route['metric'])
+            if gateway:
+                info['gateways'][gateway] = None
+    for info in index.values():
+        info['gateways'] = list(info['gateways'])
+    return index
+
+def _parse_hop(parts, hop):
+    """Stores the 'via' gateway and 'dev' found in `parts` in `hop`."""
+    for keyword, key in (('dev', 'dev'), ('via', 'gateway')):
+        if keyword in parts:
+            i = parts.index(keyword) + 1
+            if i < len(parts) and parts[i] in ('inet', 'inet6'):
+                # Gateway of another family, e.g. 'via inet6 fe80::1'
+                i += 1
+            if i < len(parts):
+                hop[key] = parts[i]
+
+def _parse_route_line(line):
+    """
+    Parses one line of 'ip -o route show' output into an 'ip -j route show' style
+    dictionary. The 'nexthop via X dev Y' pairs of a multipath route go to 'nexthops'.
+
+    Keywords are found with list.index() instead of walking every token, since a
+    full routing table means parsing a million lines.
+
+    Returns:
+        dict or None: The route, or None for an empty line.
+    """
+    parts = line.split()
+    if not parts:
+        return None
+    route = {'dst': parts[0]}
+    if 'metric' in parts:
+        i = parts.index('metric') + 1
+        if i < len(parts):
+            route['metric'] = int(parts[i])
+    if 'nexthop' not in parts:
+        _parse_hop(parts, route)
+        return route
+    starts = [i for i, part in enumerate(parts) if part == 'nexthop']
+    route['nexthops'] = []
+    for start, end in zip(starts, starts[1:] + [len(parts)]):
+        hop = {}
+        _parse_hop(parts[start + 1:end], hop)
+        route['nexthops'].append(hop)
+    return route
+
+def _stream_command(command_parts):
+    """Yields the output lines of a read-only command, see core.executor.stream."""
+    return executor.stream(command_parts)
+
+def _iter_routes_ip():
+    """Streams the main-table IPv4 routes from 'ip -o route show', one line at a time."""
+    for line in _stream_command(['ip', '-o', 'route', 'show']):
+        route = _parse_route_line(line)
+        if route is not None:
+            yield route
+
+def _get_snapshot_ip():
+    """
+    Collects links, addresses and routes by running 'ip' once for each.
+
+    Returns:
+        tuple: (links, addresses, routes); links and addresses are decoded JSON lists,
+               routes is a generator that streams them and can be consumed once.
+    """
+    links = _run_json_command(['ip', '-j', 'link', 'show'])
+    if not links:
+        return [], [], []
+    addresses = _run_json_command(['ip', '-j', 'addr', 'show'])
+    return links, addresses, _iter_routes_ip()
+
+def _get_snapshot(backend):
+    """
+    Collects links, addresses and routes using the requested backend.
+
+    The netlink backend talks to the kernel directly; if it is unavailable the
+    'ip' subprocess backend is used instead.
+
+    Args:
+        backend (str): 'netlink' or 'ip'.
+
+    Returns:
+        tuple: (links, addresses, routes) in 'ip -j' format; routes is an iterable
+               that may only be consumed once.
+    """
+    if backend == 'netlink':
+        try:
+            return netlink.get_snapshot()
+        except OSError as e:
+            logging.warning(f"Netlink backend unavailable ({e}), falling back to 'ip'.")
+    return _get_snapshot_ip()
+
+def build_interface_info(link, ip_addresses, route_info, system_dns):
+    """
+    Builds the interface dictionary returned by get_active_interfaces.
+
+    Args:
+        link (dict): An 'ip -j link' style link entry.
+        ip_addresses (list): 'address/prefix' strings of the interface.
+        route_info (dict): {'metric', 'gateways'} from the route index, or None.
+        system_dns (list): System-wide DNS servers.
+
+    Returns:
+        dict: The interface information.
+    """
+    name = link.get('ifname')
+    interface_info = {
+        'name': name,
+        'flag': 'DOWN',  # Default to DOWN, update if UP found
+        'type': 'Unknown',
+        'ip_addresses': [],
+        'mac': 'N/A',
+        'metric': 'N/A',
+        'gateways': [],
+        'system_dns': system_dns # Add system-wide DNS to each interface's info
+    }
+
+    if "UP" in link.get('flags', []):
+        interface_info['flag'] = "UP"
+
+    # Only process active interfaces for detailed information
+    if interface_info['flag'] == "DOWN":
+        return interface_info
+
+    if link.get('link_type') == 'ether' and link.get('address'):
+        interface_info['mac'] = link['address'].upper()
+
+    interface_info['type'] = _detect_interface_type(name)
+    interface_info['ip_addresses'] = list(ip_addresses)
+
+    if route_info:
+        interface_info['metric'] = route_info['metric']
+        interface_info['gateways'] = list(route_info['gateways'])
+
+    return interface_info
+
+def get_active_interfaces(backend=None, use_cache=True):
     """
     Connects to all available internet interfaces (Wi-Fi, LAN, USB, Bluetooth tethering)
     and retrieves detailed information for each active interface on a Linux system.
 
-    Uses 'ip' command-line utility for information gathering.
+    Links, addresses and routes are each fetched in a single pass (one rtnetlink dump or
+    one 'ip -j' call) and joined in memory, so the cost does not multiply with the number
+    of interfaces.
+
+    Results are cached for CACHE_TTL seconds, or until invalidate_cache() is called,
+    so repeated calls within one operation do not hit the kernel again.
+
+    Args:
+        backend (str): 'netlink' or 'ip'; defaults to BACKEND.
+        use_cache (bool): If False, always take a fresh snapshot.
 
     Returns:
         list: A list of dictionaries, where each dictionary represents an active network
               interface with its name, status flag, detected type, IP addresses (IPv4 & IPv6),
               MAC address, metric, and associated gateways.
     """
+    backend = backend or BACKEND
+    with _cache_lock:
+        generation = _generation
+        cached = _interface_cache.get(backend)
+    if use_cache and cached and cached[0] == generation and time.monotonic() - cached[1] < CACHE_TTL:
+        return copy.deepcopy(cached[2])
+
+    interfaces = _scan_interfaces(backend)
+    if interfaces:
+        with _cache_lock:
+            _interface_cache[backend] = (generation, time.monotonic(), interfaces)
+    return copy.deepcopy(interfaces)
+
+def _scan_interfaces(backend):
+    """
+    Takes a fresh snapshot of all interfaces, see get_active_interfaces.
+    """
     interfaces = []
     system_dns = get_system_dns_servers() # Get system-wide DNS once
 
-    # 1. Get basic link information for all interfaces
-    ip_link_output = _run_command(['ip', '-o', 'link', 'show'])
-    if not ip_link_output:
+    # 1. Get links, IP addresses and routes for all interfaces in one pass each
+    links, addr_entries, route_entries = _get_snapshot(backend)
+    if not links:
         logging.error("Failed to get basic interface link information.")
         return []
 
-    link_lines = ip_link_output.strip().split('\n')
+    addresses = _index_addresses(addr_entries)
+    try:
+        routes = _index_routes(route_entries)
+    except OSError as e:
+        # The netlink route dump failed part-way; take the routes from 'ip' instead
+        if backend != 'netlink':
+            raise
+        logging.warning(f"Netlink route dump failed ({e}), falling back to 'ip'.")
+        routes = _index_routes(_iter_routes_ip())
 
-    for line in link_lines:
-        parts = line.split(':')
-        if len(parts) < 2:
-            continue
+    for link in links:
+        name = link.get('ifname')
 
-        name = parts[1].strip().split('@')[0]
-        
         # Skip loopback interface
-        if name == 'lo':
+        if not name or name == 'lo':
             continue
 
-        interface_info = {
-            'name': name,
-            'flag': 'DOWN',  # Default to DOWN, update if UP found
-            'type': 'Unknown',
-            'ip_addresses': [],
-            'mac': 'N/A',
-            'metric': 'N/A',
-            'gateways': [],
-            'system_dns': system_dns # Add system-wide DNS to each interface's info
-        }
-
-        # Extract flags (e.g., <UP,BROADCAST,RUNNING,MULTICAST>)
-        flags_match = re.search(r'<([^>]+)>', line)
-        if flags_match:
-            flags_str = flags_match.group(1)
-            if "UP" in flags_str:
-                interface_info['flag'] = "UP"
-        
-        # Only process active interfaces for detailed information
-        if interface_info['flag'] == "DOWN":
-            interfaces.append(interface_info)
-            continue # Skip detailed info for down interfaces
-
-        # Get MAC Address (usually the last part of the 'ip link show' output for 'link/ether')
-        mac_match = re.search(r'link/ether\s+([0-9a-fA-F:]{17})', line)
-        if mac_match:
-            interface_info['mac'] = mac_match.group(1).upper()
-        
-        # Determine interface type
-        if name.startswith("wl"):
-            interface_info['type'] = "Wi-Fi"
-        elif name.startswith("en") or name.startswith("eth"):
-            interface_info['type'] = "Ethernet"
-        elif name.startswith("usb"):
-            interface_info['type'] = "USB"
-        elif name.startswith("bnep") or name.startswith("bt"):
-            interface_info['type'] = "Bluetooth Tethering"
-        elif name.startswith("veth") or name.startswith("br") or \
-             name.startswith("docker") or name.startswith("tun") or \
-             name.startswith("tap"):
-            interface_info['type'] = "Virtual/Bridge/VPN"
-        
-        # 2. Get IP Addresses (IPv4 and IPv6) with CIDR
-        for family in ['inet', 'inet6']:
-            ip_addr_output = _run_command(['ip', '-f', family, 'addr', 'show', name], suppress_errors=True)
-            if ip_addr_output:
-                for ip_line in ip_addr_output.split('\n'):
-                    # Regex to find 'inet X.X.X.X/YY' or 'inet6 XXXX::/YY'
-                    ip_match = re.search(r'inet(?:6)?\s+([0-9a-fA-F.:/]+)\s+brd', ip_line)
-                    if not ip_match:
-                         ip_match = re.search(r'inet(?:6)?\s+([0-9a-fA-F.:/]+)\s+scope', ip_line)
-                    if ip_match:
-                        interface_info['ip_addresses'].append(ip_match.group(1))
-
-        # 3. Get Routes, Metric, and Gateways
-        ip_route_output = _run_command(['ip', 'route', 'show'], suppress_errors=True)
-        if ip_route_output:
-            for route_line in ip_route_output.split('\n'):
-                if f"dev {name}" in route_line:
-                    # Extract metric
-                    metric_match = re.search(r'metric\s+(\d+)', route_line)
-                    if metric_match:
-                        interface_info['metric'] = int(metric_match.group(1))
-                    
-                    # Extract gateway (via) for routes specific to this interface
-                    gateway_match = re.search(r'via\s+([0-9a-fA-F.:]+)', route_line)
-                    if gateway_match and gateway_match.group(1) not in interface_info['gateways']:
-                        interface_info['gateways'].append(gateway_match.group(1))
-
-        interfaces.append(interface_info)
-        # print(f"Detected interface: {interfaces}")
+        interfaces.append(build_interface_info(link, addresses.get(name, []), routes.get(name), system_dns))
 
     return interfaces
 
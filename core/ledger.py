@@ -0,0 +1,162 @@
+# intermux/core/ledger.py
+
+import os
+import sys
+import json
+import fcntl
+import threading
+import contextlib
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import executor
+
+# Every kernel resource intermux creates is written here *before* it is created,
+# so after a crash the leftovers are still known and can be removed.
+LEDGER_PATH = os.environ.get('INTERMUX_LEDGER', '/var/lib/intermux/ledger.json')
+
+KINDS = ['rule', 'nat', 'veth', 'netns', 'rt_table', 'cgroup']
+
+_thread_lock = threading.Lock()
+
+
+class LedgerError(RuntimeError):
+    """The ledger cannot be read; intermux would lose track of what it owns."""
+
+
+def _empty():
+    return {'version': 1, 'resources': {kind: {} for kind in KINDS}}
+
+
+def _read():
+    try:
+        with open(LEDGER_PATH) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return _empty()
+    except (ValueError, UnicodeDecodeError) as e:
+        # Starting over empty would forget every resource still in the kernel
+        raise LedgerError(f"The ledger {LEDGER_PATH} is unreadable ({e}). Repair or restore it; "
+                          f"remove it only after cleaning up by hand.")
+    if not isinstance(data, dict) or not isinstance(data.get('resources'), dict):
+        raise LedgerError(f"The ledger {LEDGER_PATH} has an unknown format. Repair or restore it; "
+                          f"remove it only after cleaning up by hand.")
+    for kind in KINDS:
+        data['resources'].setdefault(kind, {})
+    return data
+
+
+def _write(data):
+    tmp_path = f"{LEDGER_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, LEDGER_PATH)
+
+
+@contextlib.contextmanager
+def transaction():
+    """
+    Locks the ledger across threads and processes and yields its data for update.
+
+    The data is written back atomically (temp file + rename) when the block exits
+    without an exception.
+    """
+    os.makedirs(os.path.dirname(LEDGER_PATH), exist_ok=True)
+    with _thread_lock, open(LEDGER_PATH + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = _read()
+        yield data
+        _write(data)
+
+
+def record(resources):
+    """
+    Adds resources to the ledger in one write.
+
+    Args:
+        resources (list): (kind, key, details) tuples, kind being one of KINDS.
+    """
+    if not resources or executor.dry_running():
+        return
+    with transaction() as data:
+        for kind, key, details in resources:
+            data['resources'][kind][key] = details
+
+
+def forget(resources):
+    """
+    Removes resources from the ledger in one write.
+
+    Args:
+        resources (list): (kind, key) tuples.
+    """
+    if not resources or executor.dry_running():
+        return
+    with transaction() as data:
+        for kind, key in resources:
+            data['resources'][kind].pop(key, None)
+
+
+def setdefault(kind, key, create):
+    """
+    Returns the details recorded for `key`, recording create(resources) for it first
+    if it is missing. Lookup and write happen under the ledger lock, so concurrent
+    callers (threads or processes) never allocate the same value twice.
+
+    Args:
+        create (callable): create(resources) -> details, given every recorded resource by kind.
+    """
+    if executor.dry_running():
+        with _thread_lock:
+            resources = _read()['resources']
+        return resources[kind].get(key) or create(resources)
+    with transaction() as data:
+        resources = data['resources']
+        if key not in resources[kind]:
+            resources[kind][key] = create(resources)
+        details = dict(resources[kind][key])
+    return details
+
+
+def entries(kind):
+    """
+    Returns:
+        dict: key -> details of every recorded resource of `kind`.
+    """
+    with _thread_lock:
+        return dict(_read()['resources'][kind])
+
+
+def namespace_resources(names, table_id=None, priority=None):
+    """
+    Lists the ledger entries of a namespace described like core.provision.namespace_for().
+
+    Returns:
+        list: (kind, key, details) tuples for record().
+    """
+    ns = names['ns']
+    details = {'iface': names['iface'], 'dir': f"/etc/netns/{ns}", 'subnet': names['subnet']}
+    if names.get('shape'):
+        details['shape'] = names['shape']
+    resources = [
+        ('netns', ns, details),
+        ('veth', names['veth0'], {'ns': ns}),
+        ('nat', names['subnet'], {'ns': ns}),
+    ]
+    if table_id is not None:
+        resources.append(('rule', f"from {names['subnet']} table {table_id} priority {priority}",
+                          {'ns': ns, 'table': table_id}))
+    return resources
+
+
+def owned_by(ns):
+    """
+    Returns:
+        list: (kind, key) of every recorded resource belonging to namespace `ns`, itself included.
+    """
+    with _thread_lock:
+        resources = _read()['resources']
+    owned = [('netns', ns)] if ns in resources['netns'] else []
+    for kind in ('rule', 'nat', 'veth'):
+        owned += [(kind, key) for key, details in resources[kind].items() if details.get('ns') == ns]
+    return owned
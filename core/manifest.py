@@ -0,0 +1,242 @@
+# intermux/core/manifest.py
+
+import os
+import sys
+import json
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import cgroup
+from core.interface import get_active_interfaces
+from core.provision import provision
+from core.reconcile import reconcile
+from core.multipath import setup_multipath_routing, multipath_name, check_weights, HASH_POLICIES
+from core.shaping import make_shape, shape_key
+
+# A manifest lists many bindings so they can be applied together. JSON:
+#   {"defaults": {"mode": "netns"},
+#    "bindings": [{"app": "/usr/bin/firefox", "iface": "wlan0", "download": "20mbit"},
+#                 {"app": "/usr/bin/thunderbird", "iface": ["wlan0", "eth0"]}]}
+# or the same as TOML, with a [defaults] table and [[bindings]] tables. A bare
+# JSON list of bindings works too. Relative app paths are relative to the manifest.
+MODES = ('netns', 'cgroup')
+FIELDS = {'app', 'iface', 'args', 'download', 'upload', 'priority', 'mode', 'weights', 'hash_policy'}
+
+
+def load(path):
+    """
+    Reads a manifest file; '.toml' files are parsed as TOML, everything else as JSON.
+
+    Returns:
+        list: The bindings as dicts, with the defaults merged in. They are not
+              validated yet, see validate().
+
+    Raises:
+        ValueError: If the file cannot be parsed or has no bindings.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML manifests need Python 3.11 or later; use JSON instead")
+        try:
+            data = tomllib.loads(content.decode())
+        except (tomllib.TOMLDecodeError, UnicodeDecodeError) as e:
+            raise ValueError(f"{path}: {e}")
+    else:
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}")
+
+    if isinstance(data, list):
+        data = {'bindings': data}
+    if not isinstance(data, dict) or not isinstance(data.get('bindings'), list) or not data['bindings']:
+        raise ValueError(f"{path}: expected a non-empty list of bindings")
+    defaults = data.get('defaults', {})
+    if not isinstance(defaults, dict):
+        raise ValueError(f"{path}: 'defaults' must be a table of binding options")
+    base = os.path.dirname(os.path.abspath(path))
+    bindings = []
+    for entry in data['bindings']:
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}: every binding must be a table, got {entry!r}")
+        entry = dict(defaults, **entry)
+        if isinstance(entry.get('app'), str):
+            entry['app'] = os.path.join(base, os.path.expanduser(entry['app']))
+        bindings.append(entry)
+    return bindings
+
+
+def _check(entry, interfaces):
+    """Returns the normalized binding, or raises ValueError with everything wrong with it."""
+    problems = [f"unknown option '{key}'" for key in sorted(set(entry) - FIELDS)]
+    app = entry.get('app')
+    if not isinstance(app, str) or not app:
+        problems.append("'app' is missing")
+    elif not os.path.exists(app):
+        problems.append(f"application path not found: {app}")
+    elif "chromium" in app.lower():
+        problems.append("Chromium is not supported, its sandbox conflicts with network namespaces")
+
+    ifaces = entry.get('iface')
+    ifaces = [ifaces] if isinstance(ifaces, str) else ifaces
+    if not ifaces or not isinstance(ifaces, list) or not all(isinstance(i, str) for i in ifaces):
+        problems.append("'iface' must be an interface name or a list of them")
+        ifaces = []
+    elif len(set(ifaces)) != len(ifaces):
+        problems.append("an interface is listed twice")
+    for iface in ifaces:
+        info = interfaces.get(iface)
+        if info is None:
+            problems.append(f"no such interface: {iface}")
+        elif not info['gateways'] or not any(':' not in ip for ip in info['ip_addresses']):
+            problems.append(f"{iface} needs an IPv4 address and a gateway")
+
+    shape = None
+    limits = [key for key in ('download', 'upload', 'priority') if key in entry and not isinstance(entry[key], str)]
+    if limits:
+        problems.append(f"{', '.join(limits)} must be text, e.g. download = \"20mbit\"")
+    else:
+        try:
+            shape = make_shape(entry.get('download'), entry.get('upload'), entry.get('priority'))
+        except ValueError as e:
+            problems.append(str(e))
+    mode = entry.get('mode', 'netns')
+    if mode not in MODES:
+        problems.append(f"unknown mode '{mode}', expected one of: {', '.join(MODES)}")
+    elif mode == 'cgroup' and shape:
+        problems.append("bandwidth limits and priority need a namespace, not mode 'cgroup'")
+
+    weights = entry.get('weights') or {}
+    if not isinstance(weights, dict) or not all(isinstance(w, int) and w >= 1 for w in weights.values()):
+        problems.append("'weights' must map interfaces to whole numbers >= 1")
+        weights = {}
+    else:
+        try:
+            check_weights(ifaces, weights)
+        except ValueError as e:
+            problems.append(str(e))
+            weights = {}
+    hash_policy = entry.get('hash_policy', 'l3')
+    if hash_policy not in HASH_POLICIES:
+        problems.append(f"unknown hash policy '{hash_policy}', expected one of: {', '.join(HASH_POLICIES)}")
+
+    args = entry.get('args', [])
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+        problems.append("'args' must be a list of strings")
+    if problems:
+        raise ValueError("; ".join(problems))
+    return {'app': app, 'ifaces': ifaces, 'shape': shape, 'mode': mode, 'weights': weights,
+            'hash_policy': hash_policy, 'args': args}
+
+
+def validate(entries, interfaces=None):
+    """
+    Checks every binding before anything is changed.
+
+    Args:
+        entries (list): Bindings from load().
+        interfaces (list): Interface table, see core.interface; scanned now if not given.
+
+    Returns:
+        list: Normalized bindings: {'app', 'ifaces', 'shape', 'mode', 'weights',
+              'hash_policy', 'args'}.
+
+    Raises:
+        ValueError: Listing the problems of every invalid binding.
+    """
+    interfaces = {iface['name']: iface for iface in (interfaces or get_active_interfaces())}
+    bindings = []
+    problems = []
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            problems.append(f"binding {number}: expected a table of options, got {entry!r}")
+            continue
+        try:
+            bindings.append(_check(entry, interfaces))
+        except ValueError as e:
+            name = entry.get('app') if isinstance(entry.get('app'), str) else '?'
+            problems.append(f"binding {number} ({os.path.basename(name)}): {e}")
+    # The hash policy is a host-wide setting, so every balanced binding must use the same one
+    policies = {b['hash_policy'] for b in bindings if len(b['ifaces']) > 1}
+    if len(policies) > 1:
+        problems.append("bindings over several interfaces must all use the same hash policy")
+    if problems:
+        raise ValueError("\n".join(problems))
+    return bindings
+
+
+def _uplink(binding):
+    if len(binding['ifaces']) > 1:
+        return multipath_name(binding['ifaces'], binding['weights'])
+    return binding['ifaces'][0]
+
+
+def apply(bindings, launch=None, pool=None, progress=None, prune=False):
+    """
+    Sets up every binding in one pass and launches the apps.
+
+    Each multipath route is set up once for all bindings balanced over the same
+    interfaces and weights. The namespace
+    bindings then go through a single core.provision.provision() call: the host
+    state is read and prepared once, apps on the same uplink and shape share one
+    namespace, and the namespaces are built in parallel. The cgroup bindings
+    share one cgroup per uplink.
+
+    Args:
+        bindings (list): Normalized bindings from validate().
+        launch (callable): launch(binding, names) called once the binding's
+                           namespace or cgroup is ready.
+        pool (core.pool.NamespacePool): Optional pool of ready namespaces.
+        progress (callable): Called with a message before each step.
+        prune (bool): Afterwards, remove the namespaces in the ledger that no binding
+                      uses, see core.reconcile.
+
+    Returns:
+        dict: {'bindings': [{'app', 'iface', 'ns' or 'cgroup', 'seconds'}], 'total_seconds': float},
+              like core.provision.provision(); with prune, 'pruned' lists the removed namespaces.
+
+    Raises:
+        RuntimeError: If a multipath route could not be set up.
+    """
+    step = progress or (lambda message: None)
+    start = time.perf_counter()
+    balanced = {}
+    for binding in bindings:
+        if len(binding['ifaces']) > 1:
+            balanced.setdefault(_uplink(binding), binding)
+    for binding in balanced.values():
+        step(f"Balancing over {', '.join(binding['ifaces'])}")
+        if setup_multipath_routing(binding['ifaces'], binding['weights'], binding['hash_policy']) is None:
+            raise RuntimeError(f"Could not balance over {', '.join(binding['ifaces'])}")
+
+    # The provisioners launch by app path; each launch takes the next binding with that
+    # path, uplink and shape, which keeps per-binding args apart
+    waiting = {}
+    for binding in bindings:
+        waiting.setdefault((binding['app'], _uplink(binding), shape_key(binding['shape'])), []).append(binding)
+    lock = threading.Lock()
+
+    def launch_binding(app, names):
+        with lock:
+            binding = waiting[(app, names['iface'], shape_key(names.get('shape')))].pop(0)
+        if launch:
+            launch(binding, names)
+
+    report = {'bindings': [], 'total_seconds': 0.0}
+    netns = [(b['app'], _uplink(b), b['shape']) for b in bindings if b['mode'] == 'netns']
+    if netns:
+        report['bindings'] += provision(netns, launch=launch_binding, progress=step, pool=pool)['bindings']
+    in_cgroups = [(b['app'], _uplink(b)) for b in bindings if b['mode'] == 'cgroup']
+    if in_cgroups:
+        offset = time.perf_counter() - start
+        for result in cgroup.provision(in_cgroups, launch=launch_binding, progress=step)['bindings']:
+            report['bindings'].append(dict(result, seconds=result['seconds'] + offset))
+    if prune:
+        in_use = {result['ns'] for result in report['bindings'] if 'ns' in result}
+        report['pruned'] = sorted(reconcile([], keep=in_use, progress=step)['prune'])
+    report['total_seconds'] = time.perf_counter() - start
+    return report
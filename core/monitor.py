@@ -0,0 +1,230 @@
+# intermux/core/monitor.py
+
+import os
+import sys
+import errno
+import socket
+import logging
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import netlink
+from core import interface
+
+# rtnetlink multicast groups (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+MONITOR_GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR | RTMGRP_IPV4_ROUTE
+
+
+class InterfaceMonitor:
+    """
+    Keeps an in-memory interface table up to date from rtnetlink events.
+
+    The table holds the same dictionaries as core.interface.get_active_interfaces.
+    It is loaded once from a netlink dump, then every link, address and route
+    notification only updates the interface it refers to. Registered callbacks are
+    called from the monitor thread as callback(name, info), with info set to None
+    when the interface disappeared. GUI code must hand the call over to its own
+    thread (e.g. through a queue polled with root.after).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._sock = None
+        self._links = {}      # ifindex -> link dict
+        self._addresses = {}  # ifindex -> {'local/prefix': addr_info}
+        self._routes = {}     # dev name -> {(dst, gateway, metric): route}
+        self._table = {}      # name -> interface info
+        self._system_dns = []
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def get_interfaces(self):
+        """
+        Returns:
+            list: A copy of the current interface table.
+        """
+        with self._lock:
+            return [dict(info) for info in self._table.values()]
+
+    def start(self):
+        """
+        Subscribes to the netlink groups, loads the initial table and starts the
+        monitor thread.
+
+        Raises:
+            OSError: If netlink sockets are not available.
+        """
+        # Subscribe before the dump so no event between the two is lost
+        self._sock = netlink.open_socket(MONITOR_GROUPS)
+        self._sock.settimeout(0.5)
+        self._resync()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="intermux-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def _resync(self):
+        """Reloads the whole table from a netlink dump and reports what changed."""
+        links, addresses, routes = netlink.get_snapshot()
+        with self._lock:
+            self._system_dns = interface.get_system_dns_servers()
+            self._links = {link['ifindex']: link for link in links}
+            by_name = {link['ifname']: link['ifindex'] for link in links}
+            self._addresses = {}
+            for entry in addresses:
+                index = by_name.get(entry['ifname'])
+                self._addresses[index] = {self._address_key(a): a for a in entry['addr_info']}
+            self._routes = {}
+            for route in routes:
+                for dev in self._route_devs(route):
+                    self._routes.setdefault(dev, {})[self._route_key(route)] = route
+            names = set(self._table) | set(by_name)
+        for name in names:
+            self._refresh(name)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data = self._sock.recv(1 << 16)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # The kernel dropped events; the table can no longer be trusted
+                    logging.warning("Netlink event queue overflowed, resyncing interface table.")
+                    self._resync()
+                    continue
+                if self._stop.is_set():
+                    break
+                raise
+            for msg_type, _flags, payload in netlink.iter_messages(data):
+                try:
+                    self._handle(msg_type, payload)
+                except Exception as e:
+                    logging.error(f"Failed to handle netlink event {msg_type}: {e}")
+
+    @staticmethod
+    def _address_key(addr):
+        return f"{addr['local']}/{addr['prefixlen']}"
+
+    @staticmethod
+    def _route_key(route):
+        return (route.get('dst'), route.get('gateway'), route.get('metric'))
+
+    @staticmethod
+    def _route_devs(route):
+        return {dev for dev, _gateway in interface.route_hops(route) if dev}
+
+    def _handle(self, msg_type, payload):
+        changed = set()
+        with self._lock:
+            if msg_type in (netlink.RTM_NEWLINK, netlink.RTM_DELLINK):
+                link = netlink.parse_link(payload)
+                old = self._links.get(link['ifindex'])
+                if old:
+                    changed.add(old['ifname'])
+                if msg_type == netlink.RTM_NEWLINK:
+                    self._links[link['ifindex']] = link
+                else:
+                    self._links.pop(link['ifindex'], None)
+                    self._addresses.pop(link['ifindex'], None)
+                    self._routes.pop(link['ifname'], None)
+                changed.add(link['ifname'])
+
+            elif msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+                index, addr = netlink.parse_address(payload)
+                if addr is None:
+                    return
+                addrs = self._addresses.setdefault(index, {})
+                if msg_type == netlink.RTM_NEWADDR:
+                    addrs[self._address_key(addr)] = addr
+                else:
+                    addrs.pop(self._address_key(addr), None)
+                if index in self._links:
+                    changed.add(self._links[index]['ifname'])
+
+            elif msg_type in (netlink.RTM_NEWROUTE, netlink.RTM_DELROUTE):
+                if payload[0] != socket.AF_INET:
+                    return
+                names = {index: link['ifname'] for index, link in self._links.items()}
+                route = netlink.parse_route(payload, names)
+                if route is None:
+                    return
+                for dev in self._route_devs(route):
+                    routes = self._routes.setdefault(dev, {})
+                    if msg_type == netlink.RTM_NEWROUTE:
+                        routes[self._route_key(route)] = route
+                    else:
+                        routes.pop(self._route_key(route), None)
+                    changed.add(dev)
+
+        if changed:
+            interface.invalidate_cache()
+        for name in changed:
+            self._refresh(name)
+
+    def _refresh(self, name):
+        """Rebuilds the table entry of one interface and notifies callbacks if it changed."""
+        with self._lock:
+            link = next((entry for entry in self._links.values() if entry['ifname'] == name), None)
+            if link is None or name == 'lo':
+                info = None
+            else:
+                addr_info = list(self._addresses.get(link['ifindex'], {}).values())
+                ip_addresses = interface._index_addresses([{'ifname': name, 'addr_info': addr_info}]).get(name, [])
+                route_info = interface._index_routes(self._routes.get(name, {}).values()).get(name)
+                info = interface.build_interface_info(link, ip_addresses, route_info, self._system_dns)
+
+            if info == self._table.get(name):
+                return
+            if info is None:
+                self._table.pop(name, None)
+            else:
+                self._table[name] = info
+
+        for callback in list(self._callbacks):
+            try:
+                callback(name, info)
+            except Exception as e:
+                logging.error(f"Interface monitor callback failed: {e}")
+
+
+if __name__ == "__main__":
+    import time
+
+    def _print_change(name, info):
+        if info is None:
+            print(f"[-] {name} removed")
+        else:
+            print(f"[~] {name}: {info['flag']} {', '.join(info['ip_addresses']) or 'N/A'} "
+                  f"gateways={', '.join(info['gateways']) or 'N/A'}")
+
+    monitor = InterfaceMonitor()
+    monitor.add_callback(_print_change)
+    monitor.start()
+    print("--- Watching network interfaces (Ctrl+C to stop) ---")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        monitor.stop()
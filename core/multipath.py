@@ -0,0 +1,185 @@
+# intermux/core/multipath.py
+
+import os
+import sys
+import math
+import hashlib
+from functools import reduce
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import ledger
+from core import rt_tables
+from core.executor import run_cmd
+from core.interface import get_active_interfaces
+from core.router import RouteBatch, check_existing_routing_tables, setup_routing_tables
+
+# A weighted multipath default route spreads connections over several uplinks.
+# Every set of uplinks and weights gets its own route, table and namespaces:
+# bindings use it through a pseudo-uplink named by multipath_name() (its table is
+# '<name>_rt', so provision finds it like any per-uplink table); the whole host
+# uses one of them through two rules placed after the per-uplink source rules.
+MULTIPATH_NAME = "multipath"
+# Host traffic: the main table keeps everything but its default route, then the multipath table
+MULTIPATH_PRIORITY = 32000
+
+# net.ipv4.fib_multipath_hash_policy: 'l3' hashes source/destination address,
+# 'l4' adds ports and protocol so connections between the same hosts spread too
+HASH_POLICIES = {'l3': 0, 'l4': 1}
+MAX_WEIGHT = 256
+
+
+def link_capacity(name):
+    """
+    Returns the link speed of an interface in Mbit/s, or None if the driver does not report one.
+    """
+    try:
+        with open(f"/sys/class/net/{name}/speed") as f:
+            speed = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return speed if speed > 0 else None
+
+
+def check_weights(uplinks, weights):
+    """
+    Checks configured weights: either none, or a whole number >= 1 for every uplink.
+
+    Raises:
+        ValueError: If weights are given for only some uplinks or for other interfaces.
+    """
+    weights = weights or {}
+    unknown = sorted(set(weights) - set(uplinks))
+    if unknown:
+        raise ValueError(f"weights for interfaces not balanced over: {', '.join(unknown)}")
+    missing = [name for name in uplinks if name not in weights]
+    if weights and missing:
+        raise ValueError(f"weights must be given for every interface or none, missing: {', '.join(missing)}")
+
+
+def compute_weights(uplinks, weights=None):
+    """
+    Turns configured weights or link capacities into nexthop weights (1-256).
+
+    Configured weights, which must cover every uplink, are used as given;
+    without them the link speed is used, and uplinks the driver reports no
+    speed for get the average of the others (or 1). The ratios are kept, reduced
+    by their common divisor and scaled down if the largest exceeds 256.
+
+    Args:
+        uplinks (list): Interface names.
+        weights (dict): Interface name -> configured weight, see check_weights().
+
+    Returns:
+        dict: Interface name -> weight.
+
+    Raises:
+        ValueError: If the weights do not pass check_weights().
+    """
+    check_weights(uplinks, weights)
+    if weights:
+        raw = {name: int(weights[name]) for name in uplinks}
+    else:
+        raw = {name: link_capacity(name) for name in uplinks}
+        known = [value for value in raw.values() if value]
+        fallback = round(sum(known) / len(known)) if known else 1
+        raw = {name: value or fallback for name, value in raw.items()}
+    divisor = reduce(math.gcd, raw.values())
+    raw = {name: value // divisor for name, value in raw.items()}
+    largest = max(raw.values())
+    if largest > MAX_WEIGHT:
+        raw = {name: max(1, round(value * MAX_WEIGHT / largest)) for name, value in raw.items()}
+    return raw
+
+
+def multipath_name(uplinks, weights=None):
+    """
+    Returns the pseudo-uplink name of a balanced binding, e.g. 'multipath_1a2b3c4d'.
+
+    It is derived from the uplinks and their weights as compute_weights() returns
+    them, so the same set with the same ratios always maps to the same route.
+    """
+    weights = compute_weights(uplinks, weights)
+    key = ",".join(f"{name}={weights[name]}" for name in sorted(uplinks))
+    return f"{MULTIPATH_NAME}_{hashlib.md5(key.encode()).hexdigest()[:8]}"
+
+
+def set_hash_policy(policy):
+    """Selects how flows are hashed onto nexthops ('l3' or 'l4'); the setting is host-wide."""
+    if policy not in HASH_POLICIES:
+        raise ValueError(f"Unknown hash policy '{policy}', expected one of: {', '.join(HASH_POLICIES)}")
+    run_cmd(f"sysctl -w net.ipv4.fib_multipath_hash_policy={HASH_POLICIES[policy]}")
+
+
+def setup_multipath_routing(uplinks, weights=None, hash_policy='l3', system_wide=False):
+    """
+    Installs a weighted multipath default route over `uplinks` in the table of
+    their multipath_name().
+
+    The per-uplink tables are created first if they are missing, so replies to
+    each uplink's address keep leaving through that uplink. System-wide, the host
+    is moved off any other multipath route it used before.
+
+    Args:
+        uplinks (list): Interface names; each must be UP with an IPv4 address and a gateway.
+        weights (dict): Interface name -> configured weight, see compute_weights().
+        hash_policy (str): 'l3' or 'l4'.
+        system_wide (bool): Also send the host's own traffic through the multipath route.
+
+    Returns:
+        str or None: The name bindings use as their uplink, or None if the route
+                     could not be installed.
+    """
+    if len(uplinks) < 2:
+        print("[X] Load balancing needs at least two interfaces.")
+        return None
+    gateways = {iface['name']: iface['gateways'][0] for iface in get_active_interfaces()
+                if iface['flag'] == 'UP' and iface['gateways']
+                and any(':' not in ip for ip in iface['ip_addresses'])}
+    missing = [name for name in uplinks if name not in gateways]
+    if missing:
+        print(f"[X] No IPv4 gateway on: {', '.join(missing)}")
+        return None
+    try:
+        check_weights(uplinks, weights)
+    except ValueError as e:
+        print(f"[X] Invalid weights: {e}")
+        return None
+
+    set_hash_policy(hash_policy)
+    if not check_existing_routing_tables():
+        setup_routing_tables()
+
+    name = multipath_name(uplinks, weights)
+    with rt_tables.transaction() as tables:
+        table_id = tables.allocate(f"{name}_rt")
+        ledger.record([('rt_table', entry, {}) for entry in tables.added])
+
+    requested, weights = weights, compute_weights(uplinks, weights)
+    if requested and any(weights[uplink] != requested[uplink] for uplink in uplinks):
+        asked = ", ".join(f"{uplink}={requested[uplink]}" for uplink in uplinks)
+        applied = ", ".join(f"{uplink}={weights[uplink]}" for uplink in uplinks)
+        print(f"[i] Weights {asked} are applied as {applied} (nexthop weights are 1-{MAX_WEIGHT}, in lowest terms)")
+    nexthops = " ".join(f"nexthop via {gateways[name]} dev {name} weight {weights[name]}" for name in uplinks)
+    batch = RouteBatch()
+    batch.declare_tables(tables.added)
+    batch.flush_table(table_id)
+    batch.add(f"route add default table {table_id} {nexthops}", undo=f"route flush table {table_id}")
+    replaced = []
+    if system_wide:
+        # The host follows one multipath route; rules to the tables of other sets go
+        replaced = [key for key, details in ledger.entries('rule').items()
+                    if key.endswith(f" priority {MULTIPATH_PRIORITY + 1}") and details.get('table') != table_id]
+        for rule in replaced:
+            batch.drop_rule(rule)
+        for rule in (f"from all lookup main suppress_prefixlength 0 priority {MULTIPATH_PRIORITY}",
+                     f"from all table {table_id} priority {MULTIPATH_PRIORITY + 1}"):
+            batch.record('rule', rule, {'table': table_id})
+            batch.drop_rule(rule)
+            batch.add(f"rule add {rule}", undo=f"rule del {rule}")
+    if not batch.commit():
+        return None
+    ledger.forget([('rule', rule) for rule in replaced])
+
+    spread = ", ".join(f"{uplink} ({weights[uplink]})" for uplink in uplinks)
+    scope = "all traffic" if system_wide else f"'{name}' bindings"
+    print(f"[✓] Balancing {scope} over {spread} [table {table_id}, {hash_policy} hashing]")
+    return name
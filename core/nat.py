@@ -0,0 +1,209 @@
+# intermux/core/nat.py
+
+import os
+import sys
+import json
+import shutil
+import functools
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import ledger
+from core import executor
+from core.executor import run_cmd
+
+# Namespace traffic is masqueraded on its way out of the host. With nftables,
+# intermux owns one table whose postrouting chain holds a single rule matching
+# the set of namespace subnets, so the per-packet lookup stays constant however
+# many bindings exist; the uplink (and so the SNAT address) is already chosen by
+# the binding's routing rule. Every change is one atomic 'nft -f' transaction.
+# Hosts without nft fall back to one iptables MASQUERADE rule per subnet.
+# The same table marks the packets of cgroup bindings (see core.cgroup): the output
+# chain sets each binding cgroup's fwmark, and marked packets are masqueraded too,
+# as their source address was picked before the mark rerouted them.
+NAT_BACKEND = os.environ.get('INTERMUX_NAT_BACKEND', 'auto')
+TABLE = "intermux"
+SET = "bindings"
+MARKS = "marks"
+
+# Declaring existing objects again is a no-op, so this prefixes every transaction
+_DECLARE = f"""table ip {TABLE} {{
+    set {SET} {{
+        type ipv4_addr
+        flags interval
+    }}
+    set {MARKS} {{
+        type mark
+    }}
+    chain postrouting {{
+        type nat hook postrouting priority 100; policy accept;
+    }}
+    chain output {{
+        type route hook output priority -150; policy accept;
+    }}
+}}
+"""
+_RULE = (f"add rule ip {TABLE} postrouting ip saddr @{SET} masquerade\n"
+         f"add rule ip {TABLE} postrouting meta mark @{MARKS} masquerade\n")
+
+
+def backend():
+    """Returns 'nft' or 'iptables': INTERMUX_NAT_BACKEND, or nft whenever it is installed."""
+    if NAT_BACKEND in ('nft', 'iptables'):
+        return NAT_BACKEND
+    return 'nft' if shutil.which('nft') else 'iptables'
+
+
+def _elements(subnets):
+    return f"{{ {', '.join(sorted(subnets))} }}"
+
+
+def _transaction(script):
+    """Applies an nft script atomically; nothing changes if any line fails."""
+    result = executor.run(['nft', '-f', '-'], input=script)
+    if result.returncode != 0:
+        print(f"[!] nft -f -> {result.stderr.strip()}")
+    return result.returncode == 0
+
+
+def masqueraded():
+    """
+    Returns:
+        set: Subnets currently masqueraded by intermux.
+    """
+    subnets = set()
+    if backend() == 'nft':
+        output = run_cmd(f"nft -j list set ip {TABLE} {SET}", readonly=True,
+                         harmless=["No such file or directory", "command not found"])
+        try:
+            objects = json.loads(output or '{}').get('nftables', [])
+        except ValueError:
+            return subnets
+        for obj in objects:
+            for element in obj.get('set', {}).get('elem', []):
+                if isinstance(element, dict) and 'prefix' in element:
+                    subnets.add(f"{element['prefix']['addr']}/{element['prefix']['len']}")
+                elif isinstance(element, str):
+                    subnets.add(f"{element}/32")
+        return subnets
+
+    for line in (run_cmd("iptables -w -t nat -S POSTROUTING", readonly=True) or "").split('\n'):
+        parts = line.split()
+        if parts[:3] == ['-A', 'POSTROUTING', '-s'] and parts[4:] == ['-j', 'MASQUERADE']:
+            subnets.add(parts[3])
+    return subnets
+
+
+def add(subnets):
+    """
+    Masquerades traffic from `subnets`.
+
+    With nft, the table, set and rule are (re)declared in the same transaction, so
+    this also repairs a table that was flushed or deleted by hand.
+    """
+    subnets = list(subnets)
+    if not subnets:
+        return True
+    if backend() == 'nft':
+        return _transaction(_DECLARE + f"flush chain ip {TABLE} postrouting\n" + _RULE +
+                            f"add element ip {TABLE} {SET} {_elements(subnets)}\n")
+    for subnet in subnets:
+        run_cmd(f"iptables -w -t nat -A POSTROUTING -s {subnet} -j MASQUERADE")
+    return True
+
+
+def remove(subnets):
+    """
+    Stops masquerading `subnets`; subnets that are not masqueraded are ignored.
+    """
+    subnets = list(subnets)
+    if not subnets:
+        return True
+    if backend() == 'nft':
+        # Adding first makes the delete succeed for elements that are already gone
+        elements = _elements(subnets)
+        return _transaction(_DECLARE + f"add element ip {TABLE} {SET} {elements}\n"
+                            f"delete element ip {TABLE} {SET} {elements}\n")
+    for subnet in subnets:
+        run_cmd(f"iptables -w -t nat -D POSTROUTING -s {subnet} -j MASQUERADE")
+    return True
+
+
+def remove_all(subnets):
+    """
+    Removes intermux's NAT completely; with nft, the whole table goes in one transaction.
+
+    Args:
+        subnets (iterable): The subnets intermux masquerades (for the iptables backend).
+    """
+    if backend() == 'nft':
+        return _transaction(f"table ip {TABLE} {{}}\ndelete table ip {TABLE}\n")
+    return remove(subnets)
+
+
+def _marking(cgroups):
+    """nft commands that mark the packets of every existing cgroup in `cgroups`."""
+    lines = []
+    marks = set()
+    for path, details in sorted(cgroups.items()):
+        if not os.path.isdir(details['dir']) and not executor.dry_running():
+            continue  # nft resolves the path when the rule is loaded
+        level = path.count('/') + 1
+        lines.append(f'add rule ip {TABLE} output socket cgroupv2 level {level} "{path}" '
+                     f'meta mark set {details["mark"]:#x}\n')
+        marks.add(f"{details['mark']:#x}")
+    if marks:
+        lines.append(f"add element ip {TABLE} {MARKS} {_elements(marks)}\n")
+    return "".join(lines)
+
+
+def rebuild():
+    """
+    Replaces the NAT state with exactly the subnets recorded in the ledger.
+
+    With nft, the table is deleted and re-created with its full set and the
+    cgroup marking rules in one transaction, so no packet ever sees a
+    half-built table.
+
+    Returns:
+        int: Number of subnets masqueraded.
+    """
+    subnets = ledger.entries('nat')
+    if backend() == 'nft':
+        elements = f"add element ip {TABLE} {SET} {_elements(subnets)}\n" if subnets else ""
+        if not _transaction(f"table ip {TABLE} {{}}\ndelete table ip {TABLE}\n" + _DECLARE + _RULE + elements +
+                            _marking(ledger.entries('cgroup'))):
+            return 0
+        return len(subnets)
+    current = masqueraded()
+    add(set(subnets) - current)
+    return len(subnets)
+
+
+def mark_cgroups(cgroups):
+    """
+    Replaces the cgroup marking rules with rules for `cgroups`, in one transaction.
+
+    Args:
+        cgroups (dict): cgroup path (relative to the cgroup2 root) -> {'dir', 'mark'},
+                        as recorded in the ledger by core.cgroup.
+
+    Raises:
+        RuntimeError: If nft is not available; cgroup bindings need it.
+    """
+    if backend() != 'nft':
+        raise RuntimeError("cgroup bindings need nftables (nft), which is not available")
+    return _transaction(_DECLARE + f"flush chain ip {TABLE} postrouting\n" + _RULE +
+                        f"flush chain ip {TABLE} output\nflush set ip {TABLE} {MARKS}\n" + _marking(cgroups))
+
+
+def plan_add(subnet):
+    """Returns the step command that masquerades `subnet`, for core.provision.run_steps()."""
+    if backend() == 'nft':
+        return functools.partial(add, [subnet])
+    return f"iptables -w -t nat -A POSTROUTING -s {subnet} -j MASQUERADE"
+
+
+def plan_remove(subnet):
+    """Returns the step command that stops masquerading `subnet`."""
+    if backend() == 'nft':
+        return functools.partial(remove, [subnet])
+    return f"iptables -w -t nat -D POSTROUTING -s {subnet} -j MASQUERADE"
@@ -0,0 +1,332 @@
+# intermux/core/netlink.py
+
+import os
+import socket
+import struct
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import trace
+
+# rtnetlink message types (linux/rtnetlink.h)
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+# netlink control messages and flags (linux/netlink.h)
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+# Attribute types
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_MULTIPATH = 9
+RTA_TABLE = 15
+
+RT_TABLE_MAIN = 254
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+
+# Interface flags (linux/if.h), named the way 'ip -j link' names them
+IFF_FLAGS = [
+    (0x1, 'UP'),
+    (0x2, 'BROADCAST'),
+    (0x8, 'LOOPBACK'),
+    (0x10, 'POINTOPOINT'),
+    (0x40, 'RUNNING'),
+    (0x80, 'NOARP'),
+    (0x1000, 'MULTICAST'),
+    (0x10000, 'LOWER_UP'),
+]
+
+NLMSGHDR = struct.Struct('=LHHLL')
+RTATTR = struct.Struct('=HH')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTNEXTHOP = struct.Struct('=HBBi')
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _parse_attrs(data, offset):
+    """
+    Parses a run of rtattr structures.
+
+    Args:
+        data (bytes): The message payload.
+        offset (int): Offset of the first attribute.
+
+    Returns:
+        dict: Attribute type -> raw attribute payload.
+    """
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type & 0x3fff] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _cstring(raw):
+    return raw.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _format_address(family, raw):
+    return socket.inet_ntop(family, raw)
+
+
+def open_socket(groups=0):
+    """
+    Opens a NETLINK_ROUTE socket.
+
+    Args:
+        groups (int): Multicast group bitmask to subscribe to, 0 for request/response only.
+
+    Returns:
+        socket.socket: A bound netlink socket.
+
+    Raises:
+        OSError: If netlink sockets are not available.
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind((0, groups))
+    return sock
+
+
+def iter_messages(data):
+    """
+    Splits a buffer received from a netlink socket into messages.
+
+    Yields:
+        tuple: (message type, flags, payload bytes)
+    """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, flags, _seq, _pid = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield msg_type, flags, data[offset + NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+
+def _dump(sock, msg_type, family, seq):
+    """
+    Sends a dump request and yields the reply messages as they are received, so
+    a dump of any size is handled one receive buffer at a time.
+
+    Args:
+        sock (socket.socket): An open netlink socket.
+        msg_type (int): RTM_GETLINK, RTM_GETADDR or RTM_GETROUTE.
+        family (int): Address family to dump, AF_UNSPEC for all.
+        seq (int): Sequence number of the request.
+
+    Yields:
+        tuple: (message type, payload)
+
+    Raises:
+        OSError: If the kernel answers with an error.
+    """
+    if msg_type == RTM_GETLINK:
+        body = IFINFOMSG.pack(family, 0, 0, 0, 0)
+    elif msg_type == RTM_GETADDR:
+        body = IFADDRMSG.pack(family, 0, 0, 0, 0)
+    else:
+        body = RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+    header = NLMSGHDR.pack(NLMSGHDR.size + len(body), msg_type, NLM_F_REQUEST | NLM_F_DUMP, seq, 0)
+    name = {RTM_GETLINK: 'RTM_GETLINK', RTM_GETADDR: 'RTM_GETADDR'}.get(msg_type, 'RTM_GETROUTE')
+
+    with trace.command(f"netlink {name}", kind='netlink') as traced:
+        sock.send(header + body)
+        count = 0
+        while True:
+            data = sock.recv(1 << 16)
+            for reply_type, _flags, payload in iter_messages(data):
+                if reply_type == NLMSG_DONE:
+                    traced.returncode = 0
+                    traced.args['messages'] = count
+                    return
+                if reply_type == NLMSG_ERROR:
+                    error = struct.unpack_from('=i', payload)[0]
+                    if error:
+                        traced.returncode = -error
+                        raise OSError(-error, os.strerror(-error))
+                    continue
+                count += 1
+                yield reply_type, payload
+
+
+def parse_link(payload):
+    """
+    Converts an RTM_NEWLINK payload into an 'ip -j link' style dictionary.
+    """
+    _family, link_type, index, flags, _change = IFINFOMSG.unpack_from(payload)
+    attrs = _parse_attrs(payload, IFINFOMSG.size)
+    link = {
+        'ifindex': index,
+        'ifname': _cstring(attrs.get(IFLA_IFNAME, b'')),
+        'flags': [name for bit, name in IFF_FLAGS if flags & bit],
+        'link_type': {ARPHRD_ETHER: 'ether', ARPHRD_LOOPBACK: 'loopback'}.get(link_type, 'none'),
+    }
+    if IFLA_ADDRESS in attrs:
+        link['address'] = ':'.join(f"{b:02x}" for b in attrs[IFLA_ADDRESS])
+    return link
+
+
+def parse_address(payload):
+    """
+    Converts an RTM_NEWADDR payload into an 'ip -j addr' style addr_info entry.
+
+    Returns:
+        tuple: (interface index, addr_info dictionary) or (index, None) for unknown families.
+    """
+    family, prefixlen, _flags, _scope, index = IFADDRMSG.unpack_from(payload)
+    if family not in (socket.AF_INET, socket.AF_INET6):
+        return index, None
+    attrs = _parse_attrs(payload, IFADDRMSG.size)
+    raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if raw is None:
+        return index, None
+    return index, {
+        'family': 'inet' if family == socket.AF_INET else 'inet6',
+        'local': _format_address(family, raw),
+        'prefixlen': prefixlen,
+    }
+
+
+def parse_route(payload, links_by_index):
+    """
+    Converts an RTM_NEWROUTE payload into an 'ip -j route' style dictionary.
+
+    Args:
+        payload (bytes): The message payload.
+        links_by_index (dict): Interface index -> interface name.
+
+    Returns:
+        dict or None: The route, or None if it is not in the main table.
+    """
+    family, dst_len, _src_len, _tos, table, _proto, _scope, _type, _flags = RTMSG.unpack_from(payload)
+    attrs = _parse_attrs(payload, RTMSG.size)
+    if RTA_TABLE in attrs:
+        table = struct.unpack('=I', attrs[RTA_TABLE])[0]
+    if table != RT_TABLE_MAIN:
+        return None
+    route = {}
+    if RTA_DST in attrs:
+        route['dst'] = f"{_format_address(family, attrs[RTA_DST])}/{dst_len}"
+    else:
+        route['dst'] = 'default' if dst_len == 0 else ''
+    if RTA_GATEWAY in attrs:
+        route['gateway'] = _format_address(family, attrs[RTA_GATEWAY])
+    if RTA_OIF in attrs:
+        index = struct.unpack('=i', attrs[RTA_OIF])[0]
+        route['dev'] = links_by_index.get(index, str(index))
+    if RTA_PRIORITY in attrs:
+        route['metric'] = struct.unpack('=I', attrs[RTA_PRIORITY])[0]
+    if RTA_MULTIPATH in attrs:
+        route['nexthops'] = _parse_nexthops(family, attrs[RTA_MULTIPATH], links_by_index)
+    return route
+
+
+def _parse_nexthops(family, data, links_by_index):
+    """Parses the rtnexthop list of an RTA_MULTIPATH attribute."""
+    nexthops = []
+    offset = 0
+    while offset + RTNEXTHOP.size <= len(data):
+        length, _flags, _hops, index = RTNEXTHOP.unpack_from(data, offset)
+        if length < RTNEXTHOP.size:
+            break
+        hop = {'dev': links_by_index.get(index, str(index))}
+        attrs = _parse_attrs(data[:offset + length], offset + RTNEXTHOP.size)
+        if RTA_GATEWAY in attrs:
+            hop['gateway'] = _format_address(family, attrs[RTA_GATEWAY])
+        nexthops.append(hop)
+        offset += _align(length)
+    return nexthops
+
+
+def iter_routes(links_by_index):
+    """
+    Streams the IPv4 main-table routes from the kernel on a socket of its own.
+
+    The socket is opened right away, so an unusable netlink socket raises here
+    rather than when the routes are consumed.
+
+    Args:
+        links_by_index (dict): Interface index -> interface name.
+
+    Returns:
+        generator: Routes in 'ip -j route' format.
+
+    Raises:
+        OSError: If the netlink socket cannot be opened.
+    """
+    sock = open_socket()
+
+    def routes():
+        with sock:
+            for _t, payload in _dump(sock, RTM_GETROUTE, socket.AF_INET, 3):
+                route = parse_route(payload, links_by_index)
+                if route is not None:
+                    yield route
+
+    return routes()
+
+
+def get_snapshot():
+    """
+    Reads links, addresses and IPv4 main-table routes straight from the kernel.
+
+    The result has the same shape as the decoded output of 'ip -j link show',
+    'ip -j addr show' and 'ip -j route show', so it can be fed to the same indexing
+    code in core.interface. No process is spawned.
+
+    Routes are not collected: they are streamed by iter_routes() while the caller
+    iterates them, so memory does not grow with the size of the routing table.
+
+    Returns:
+        tuple: (links, addresses) lists and a routes generator that can be consumed once.
+
+    Raises:
+        OSError: If the netlink socket cannot be used.
+    """
+    with open_socket() as sock:
+        links = [parse_link(payload) for _t, payload in _dump(sock, RTM_GETLINK, socket.AF_UNSPEC, 1)]
+        links_by_index = {link['ifindex']: link['ifname'] for link in links}
+
+        addr_info = {}
+        for _t, payload in _dump(sock, RTM_GETADDR, socket.AF_UNSPEC, 2):
+            index, info = parse_address(payload)
+            if info:
+                addr_info.setdefault(index, []).append(info)
+        addresses = [{'ifname': name, 'addr_info': addr_info.get(index, [])}
+                     for index, name in links_by_index.items()]
+
+    return links, addresses, iter_routes(links_by_index)
+
+
+if __name__ == "__main__":
+    # Quick check without root, e.g.:
+    #   unshare -Urn sh -c 'ip link add d0 type dummy && ip link set d0 up && python3 core/netlink.py'
+    import json
+    links, addresses, routes = get_snapshot()
+    print(json.dumps({'links': links, 'addresses': addresses, 'routes': list(routes)}, indent=2))
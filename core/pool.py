@@ -0,0 +1,168 @@
+# intermux/core/pool.py
+
+import os
+import sys
+import json
+import logging
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import nat
+from core import ledger
+from core import executor
+from core.executor import run_cmd
+from core.provision import build_namespace, prepare_shared_state, empty_state, used_subnets
+
+# Idle namespaces are described by one JSON file each; claiming one renames the
+# file away, which only one process can do, so the CLI and GUI can share a pool.
+POOL_DIR = "/run/intermux/pool"
+POOL_SIZE = int(os.environ.get('INTERMUX_POOL_SIZE', '0'))
+POOL_PREFIX = "nsp_"
+# Pooled namespaces take their /24 from here, away from the per-uplink namespaces'
+# core.provision.NAMESPACE_SUPERNET
+POOL_SUPERNET = ipaddress.ip_network("10.64.0.0/10")
+
+
+class NamespacePool:
+    """
+    Keeps `size` fully wired namespaces ready per uplink.
+
+    A pooled namespace already has its veth pair, addressing, default route, NAT
+    and resolv.conf, so launching an app only needs claim() and an exec. Claimed
+    namespaces are replaced in the background.
+
+    Args:
+        size (int): Number of idle namespaces to keep per uplink.
+        max_workers (int): Namespaces built at the same time while refilling.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_workers=4):
+        self.size = size
+        self._lock = threading.Lock()
+        self._reserved = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="intermux-pool")
+        # Refills run one at a time so two of them never build for the same gap
+        self._refiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intermux-pool-refill")
+        os.makedirs(POOL_DIR, exist_ok=True)
+
+    def _entries(self, iface=None, claimed=False):
+        suffix = '.claimed' if claimed else '.json'
+        entries = []
+        for filename in sorted(os.listdir(POOL_DIR)):
+            if not filename.endswith(suffix):
+                continue
+            try:
+                with open(os.path.join(POOL_DIR, filename)) as f:
+                    names = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if iface is None or names['iface'] == iface:
+                entries.append(names)
+        return entries
+
+    def idle_count(self, iface):
+        return len(self._entries(iface))
+
+    def _allocate(self, iface):
+        """Picks unused names and a free /24 for a new pooled namespace."""
+        token = os.urandom(3).hex()
+        with self._lock:
+            used = used_subnets() | self._reserved
+            subnet = next(net for net in POOL_SUPERNET.subnets(new_prefix=24) if net not in used)
+            # Held until the address is on the veth and visible to used_subnets()
+            self._reserved.add(subnet)
+        hosts = list(subnet.hosts())
+        return {
+            'iface': iface,
+            'ns': f"{POOL_PREFIX}{token}",
+            'veth0': f"vp0_{token}",
+            'veth1': f"vp1_{token}",
+            'subnet': str(subnet),
+            'host_ip': str(hosts[0]),
+            'ns_ip': str(hosts[1]),
+        }
+
+    def _build_one(self, iface):
+        names = self._allocate(iface)
+        try:
+            build_namespace(iface, names=names, state=empty_state())
+        finally:
+            with self._lock:
+                self._reserved.discard(ipaddress.ip_network(names['subnet']))
+        path = os.path.join(POOL_DIR, f"{names['ns']}.json")
+        if executor.record_instead([path, '=', names['ns']]):
+            return names
+        with open(path + '.tmp', 'w') as f:
+            json.dump(names, f)
+        os.replace(path + '.tmp', path)
+        return names
+
+    def fill(self, iface):
+        """
+        Builds namespaces for `iface` until `size` are idle. Blocks until done.
+        """
+        missing = self.size - self.idle_count(iface)
+        if missing <= 0:
+            return
+        prepare_shared_state(uplinks=[iface])
+        for future in [self._executor.submit(self._build_one, iface) for _ in range(missing)]:
+            try:
+                names = future.result()
+                print(f"[+] Pooled namespace {names['ns']} ready for {iface}")
+            except Exception as e:
+                logging.error(f"Failed to pre-build namespace for {iface}: {e}")
+
+    def refill_async(self, iface):
+        return self._refiller.submit(self.fill, iface)
+
+    def claim(self, iface, refill=True):
+        """
+        Takes an idle namespace for `iface` out of the pool.
+
+        Args:
+            iface (str): The uplink interface name.
+            refill (bool): Start building a replacement in the background.
+
+        Returns:
+            dict or None: The namespace description, or None if none is ready.
+        """
+        claimed = None
+        for names in self._entries(iface):
+            path = os.path.join(POOL_DIR, names['ns'])
+            try:
+                os.rename(f"{path}.json", f"{path}.claimed")
+            except FileNotFoundError:
+                continue  # Another process got it first
+            claimed = names
+            break
+        if refill and self.size:
+            self.refill_async(iface)
+        return claimed
+
+    def drain(self):
+        """
+        Deletes every pooled namespace recorded in the ledger, idle or claimed,
+        and forgets the pool state.
+        """
+        for ns in ledger.entries('netns'):
+            if not ns.startswith(POOL_PREFIX):
+                continue
+            owned = ledger.owned_by(ns)
+            for kind, key in owned:
+                if kind == 'rule':
+                    run_cmd(f"ip rule del {key}")
+                elif kind == 'nat':
+                    nat.remove([key])
+                elif kind == 'veth':
+                    run_cmd(f"ip link del {key}")
+            run_cmd(f"ip netns del {ns}")
+            run_cmd(f"rm -rf /etc/netns/{ns}")
+            ledger.forget(owned)
+        for filename in os.listdir(POOL_DIR):
+            if not executor.record_instead(['rm', os.path.join(POOL_DIR, filename)]):
+                os.unlink(os.path.join(POOL_DIR, filename))
+
+    def shutdown(self, wait=True):
+        self._refiller.shutdown(wait=wait)
+        self._executor.shutdown(wait=wait)
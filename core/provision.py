@@ -0,0 +1,436 @@
+# intermux/core/provision.py
+
+import os
+import sys
+import json
+import time
+import hashlib
+import ipaddress
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import nat
+from core import ledger
+from core import trace
+from core.executor import run_cmd, carry
+from core.shaping import plan_shaping, shape_key
+from core.router import (check_existing_routing_tables, setup_routing_tables, ensure_uplink_routing,
+                         get_routing_table_ids, BINDING_PRIORITY)
+
+MAX_WORKERS = 8
+NETNS_DIR = "/run/netns"
+# Per-uplink namespaces take a free /24 from here; core.pool uses its own range
+NAMESPACE_SUPERNET = ipaddress.ip_network("10.0.0.0/16")
+
+# iptables takes a global lock, so NAT changes from parallel workers are serialized
+_nat_lock = threading.Lock()
+
+
+def used_subnets():
+    """
+    Returns:
+        set: The IPv4 networks of every address on the host.
+    """
+    output = run_cmd("ip -o -4 addr show", readonly=True) or ""
+    used = set()
+    for line in output.split('\n'):
+        parts = line.split()
+        if 'inet' in parts:
+            used.add(ipaddress.ip_interface(parts[parts.index('inet') + 1]).network)
+    return used
+
+
+def _recorded_subnets(resources):
+    """Returns the subnets the ledger holds for namespaces and NAT rules."""
+    taken = {ipaddress.ip_network(details['subnet']) for details in resources['netns'].values()
+             if details.get('subnet')}
+    taken |= {ipaddress.ip_network(subnet, strict=False) for subnet in resources['nat']}
+    return taken
+
+
+def _free_subnet(taken):
+    """Returns the first /24 of NAMESPACE_SUPERNET that overlaps none of `taken`."""
+    subnet = next((net for net in NAMESPACE_SUPERNET.subnets(new_prefix=24)
+                   if not any(net.overlaps(other) for other in taken)), None)
+    if subnet is None:
+        raise RuntimeError(f"No free /24 left in {NAMESPACE_SUPERNET} for a new namespace")
+    return subnet
+
+
+def _with_subnet(names, subnet):
+    """Returns `names` with its subnet and addresses taken from `subnet`."""
+    hosts = subnet.hosts()
+    return dict(names, subnet=str(subnet), host_ip=str(next(hosts)), ns_ip=str(next(hosts)))
+
+
+def namespace_for(iface, shape=None, exclude=()):
+    """
+    Returns the names and addresses used for the namespace of an uplink.
+
+    Names are derived from a hash of the interface name, so the same interface
+    always maps to the same namespace. Shaped bindings hash the shape in as well,
+    so apps with different limits on one uplink get separate namespaces. A namespace
+    the ledger records keeps its subnet; otherwise the first /24 that no address on
+    the host and nothing in the ledger uses is picked. Nothing is recorded here,
+    build_namespace() claims the subnet when it creates the namespace.
+
+    Args:
+        iface (str): The uplink interface name.
+        shape (dict): Optional limits from core.shaping.make_shape().
+        exclude (iterable): Subnets also left alone, e.g. those picked for other
+                            namespaces of the same plan.
+
+    Returns:
+        dict: iface, ns, veth0 (host side), veth1 (namespace side), subnet, host_ip, ns_ip,
+              and shape for shaped bindings.
+
+    Raises:
+        RuntimeError: If no subnet is free.
+    """
+    key = f"{iface}|{shape_key(shape)}" if shape else iface
+    iface_hash = hashlib.md5(key.encode()).hexdigest()[:8]
+    ns = f"ns_{iface_hash}"
+    resources = {kind: ledger.entries(kind) for kind in ('netns', 'nat')}
+    recorded = resources['netns'].get(ns, {}).get('subnet')
+    if recorded:
+        subnet = ipaddress.ip_network(recorded)
+    else:
+        subnet = _free_subnet(used_subnets() | _recorded_subnets(resources)
+                              | {ipaddress.ip_network(net) for net in exclude})
+    names = _with_subnet({
+        'iface': iface,
+        'ns': ns,
+        'veth0': f"veth0_{iface_hash}",
+        'veth1': f"veth1_{iface_hash}",
+    }, subnet)
+    if shape:
+        names['shape'] = shape
+    return names
+
+
+def _claim_namespace(names):
+    """
+    Records the namespace of `names` in the ledger unless it is already there.
+
+    The planned subnet was picked without the ledger lock, so another build may
+    have recorded it since; a fresh one is allocated then. Returns the names with
+    the subnet that is recorded.
+    """
+    def create(resources):
+        subnet = ipaddress.ip_network(names['subnet'])
+        others = _recorded_subnets(resources)
+        if subnet.subnet_of(NAMESPACE_SUPERNET) and any(subnet.overlaps(other) for other in others):
+            subnet = _free_subnet(used_subnets() | others)
+        details = {'iface': names['iface'], 'dir': f"/etc/netns/{names['ns']}", 'subnet': str(subnet)}
+        if names.get('shape'):
+            details['shape'] = names['shape']
+        return details
+
+    subnet = ledger.setdefault('netns', names['ns'], create)['subnet']
+    return names if subnet == names['subnet'] else _with_subnet(names, ipaddress.ip_network(subnet))
+
+
+def _split_netns_output(output):
+    """Splits 'ip -all netns exec ... -j' output into namespace -> decoded JSON."""
+    result, current, lines = {}, None, []
+    for line in (output or "").split('\n') + ['netns: ']:
+        if line.startswith('netns: '):
+            if current:
+                try:
+                    result[current] = json.loads('\n'.join(lines) or '[]')
+                except ValueError:
+                    result[current] = []
+            current, lines = line[len('netns: '):].strip(), []
+        else:
+            lines.append(line)
+    return result
+
+
+def _index_links(entries):
+    return {entry['ifname']: {'flags': entry.get('flags', []),
+                              'addresses': {f"{a['local']}/{a['prefixlen']}" for a in entry.get('addr_info', [])}}
+            for entry in entries if entry.get('ifname')}
+
+
+def read_state():
+    """
+    Reads everything the namespace setup depends on, in a fixed number of commands.
+
+    Returns:
+        dict: namespaces (set), links (host links: name -> {'flags', 'addresses'}),
+              ns_links (namespace -> links), ns_default (namespace -> has default route),
+              rules (source subnet -> (table, priority)), nat (set of masqueraded subnets),
+              qdiscs (host link -> set of qdisc kinds), ip_forward (bool).
+    """
+    state = empty_state()
+    if os.path.isdir(NETNS_DIR):
+        state['namespaces'] = set(os.listdir(NETNS_DIR))
+
+    state['links'] = _index_links(json.loads(run_cmd("ip -j addr show", readonly=True) or '[]'))
+    if state['namespaces']:
+        inner = _split_netns_output(run_cmd("ip -all netns exec ip -j addr show", readonly=True))
+        state['ns_links'] = {ns: _index_links(entries) for ns, entries in inner.items()}
+        defaults = _split_netns_output(run_cmd("ip -all netns exec ip -j route show default", readonly=True))
+        state['ns_default'] = {ns: bool(routes) for ns, routes in defaults.items()}
+
+    for rule in json.loads(run_cmd("ip -N -j rule show", readonly=True) or '[]'):
+        if 'srclen' in rule:
+            state['rules'][f"{rule['src']}/{rule['srclen']}"] = (str(rule.get('table')), rule.get('priority'))
+
+    for qdisc in json.loads(run_cmd("tc -j qdisc show", readonly=True) or '[]'):
+        state['qdiscs'].setdefault(qdisc.get('dev'), set()).add(qdisc.get('kind'))
+
+    state['nat'] = nat.masqueraded()
+
+    try:
+        with open('/proc/sys/net/ipv4/ip_forward') as f:
+            state['ip_forward'] = f.read().strip() == '1'
+    except OSError:
+        pass
+    return state
+
+
+def empty_state():
+    """State of a host on which intermux has not set anything up yet."""
+    return {'namespaces': set(), 'links': {}, 'ns_links': {}, 'ns_default': {},
+            'rules': {}, 'nat': set(), 'qdiscs': {}, 'ip_forward': False}
+
+
+def prepare_shared_state(state=None, uplinks=()):
+    """
+    Applies the host-wide settings every namespace depends on.
+
+    Runs once, before any namespace is built: IP forwarding and the per-uplink
+    routing tables in rt_tables are shared by all of them. Nothing is run for
+    settings that are already in place.
+
+    Args:
+        state (dict): Current state from read_state(); read now if not given.
+        uplinks (iterable): Uplinks that are about to be used; each gets its
+                            routing table if it has none yet.
+
+    Raises:
+        ValueError: If a requested uplink has no IPv4 address and gateway.
+    """
+    run_steps("host", plan_shared_state(state or read_state(), uplinks))
+
+
+def plan_shared_state(state, uplinks=()):
+    steps = []
+    if not state['ip_forward']:
+        steps.append(("enabling IP forwarding", "sysctl -w net.ipv4.ip_forward=1"))
+    if not check_existing_routing_tables():
+        steps.append(("creating routing tables", setup_routing_tables))
+    # An uplink that came up after the tables were created has none of its own yet
+    tables = get_routing_table_ids()
+    for uplink in sorted(set(uplinks)):
+        if f"{uplink}_rt" not in tables:
+            steps.append((f"creating routing table for {uplink}", partial(ensure_uplink_routing, uplink)))
+    return steps
+
+
+def plan_namespace(names, state, table_id=None):
+    """
+    Lists the commands needed to bring one namespace from `state` to fully configured.
+
+    Only missing pieces are planned, so a namespace that is already set up yields
+    an empty list and is left untouched.
+
+    Args:
+        names (dict): The namespace description, see namespace_for().
+        state (dict): Current state from read_state() (or empty_state()).
+        table_id (int): Routing table of the uplink; its traffic is steered there.
+
+    Returns:
+        list: (message, command) tuples, in order.
+    """
+    ns, veth0, veth1 = names['ns'], names['veth0'], names['veth1']
+    steps = []
+
+    exists = ns in state['namespaces']
+    if not exists:
+        steps.append(("creating namespace", f"ip netns add {ns}"))
+
+    host = state['links'].get(veth0)
+    peer = state['ns_links'].get(ns, {}).get(veth1) if exists else None
+    has_default = exists and state['ns_default'].get(ns, False)
+    if host is None or peer is None:
+        # A half-present pair cannot be repaired, recreate it
+        if host is not None:
+            steps.append(("removing broken veth pair", f"ip link del {veth0}"))
+        if peer is not None:
+            steps.append(("removing broken veth pair", f"ip netns exec {ns} ip link del {veth1}"))
+        steps.append(("creating veth pair", f"ip link add {veth0} type veth peer name {veth1}"))
+        steps.append(("moving veth into namespace", f"ip link set {veth1} netns {ns}"))
+        host = peer = {'flags': [], 'addresses': set()}
+        has_default = False
+        qdiscs = set()
+    else:
+        qdiscs = state['qdiscs'].get(veth0, set())
+
+    if f"{names['host_ip']}/24" not in host['addresses']:
+        steps.append(("addressing host veth", f"ip addr add {names['host_ip']}/24 dev {veth0}"))
+    if 'UP' not in host['flags']:
+        steps.append(("bringing host veth up", f"ip link set {veth0} up"))
+    if f"{names['ns_ip']}/24" not in peer['addresses']:
+        steps.append(("addressing namespace veth", f"ip netns exec {ns} ip addr add {names['ns_ip']}/24 dev {veth1}"))
+    if 'UP' not in peer['flags']:
+        steps.append(("bringing namespace veth up", f"ip netns exec {ns} ip link set {veth1} up"))
+    if not has_default:
+        steps.append(("adding default route", f"ip netns exec {ns} ip route add default via {names['host_ip']}"))
+    steps += plan_shaping(veth0, names.get('shape'), qdiscs)
+
+    if not os.path.exists(f"/etc/netns/{ns}/resolv.conf"):
+        resolv_conf_path = os.path.realpath("/etc/resolv.conf")
+        steps.append(("configuring DNS", f"mkdir -p /etc/netns/{ns}"))
+        steps.append(("configuring DNS", f"cp {resolv_conf_path} /etc/netns/{ns}/resolv.conf"))
+
+    if names['subnet'] not in state['nat']:
+        steps.append(("configuring NAT", nat.plan_add(names['subnet'])))
+
+    if table_id is not None:
+        current = state['rules'].get(names['subnet'])
+        if current != (str(table_id), BINDING_PRIORITY):
+            if current:
+                steps.append(("steering to uplink table",
+                              f"ip rule del from {names['subnet']} table {current[0]} priority {current[1]}"))
+            steps.append(("steering to uplink table",
+                          f"ip rule add from {names['subnet']} table {table_id} priority {BINDING_PRIORITY}"))
+    return steps
+
+
+def run_steps(label, steps, progress=None):
+    """
+    Runs planned (message, command) steps; NAT changes are serialized across threads.
+    """
+    step = progress or (lambda message: None)
+    for message, command in steps:
+        step(f"{label}: {message}")
+        with trace.span(f"{label}: {message}"):
+            if callable(command):
+                command()
+            elif command.startswith("iptables"):
+                with _nat_lock:
+                    run_cmd(command)
+            else:
+                run_cmd(command)
+
+
+def build_namespace(iface, progress=None, names=None, state=None):
+    """
+    Brings the namespace, veth pair, addressing, DNS, NAT and routing of one uplink up to date.
+
+    Args:
+        iface (str): The uplink interface name.
+        progress (callable): Called with a message before each step; may raise to abort.
+        names (dict): Names and addresses to use; defaults to namespace_for(iface).
+        state (dict): Current state from read_state(); read now if not given.
+
+    Returns:
+        dict: The namespace description.
+    """
+    names = _claim_namespace(names or namespace_for(iface))
+    state = state if state is not None else read_state()
+    table_id = get_routing_table_ids().get(f"{iface}_rt")
+    steps = plan_namespace(names, state, table_id)
+    if steps:
+        # Record before creating, so a crash half-way still leaves everything findable
+        resources = ledger.namespace_resources(names, table_id, BINDING_PRIORITY)
+        ledger.record(resources)
+        stale = [(kind, key) for kind, key in ledger.owned_by(names['ns']) if (kind, key) not in
+                 {(kind, key) for kind, key, _details in resources}]
+        run_steps(iface, steps, progress)
+        ledger.forget(stale)
+    return names
+
+
+def provision(bindings, launch=None, progress=None, max_workers=MAX_WORKERS, pool=None):
+    """
+    Builds the namespaces for a list of app bindings in parallel and launches the apps.
+
+    Bindings on the same uplink (and with the same shaping) share one namespace,
+    which is built once and only where it is missing or incomplete, so apps already
+    running in it keep their network. Different
+    uplinks are independent and are built concurrently in a bounded worker pool, after
+    the shared host state has been prepared. If a NamespacePool is given, apps are
+    launched in a pre-built namespace from it whenever one is ready for their uplink;
+    a shaped binding gets its limits applied to the claimed namespace.
+
+    Args:
+        bindings (list): (app, iface) or (app, iface, shape) tuples, see core.shaping.make_shape().
+        launch (callable): launch(app, names) called once the app's namespace is ready.
+        progress (callable): Called with a message before each step; may raise to abort.
+        max_workers (int): Upper bound on namespaces built at the same time.
+        pool (core.pool.NamespacePool): Optional pool of ready namespaces.
+
+    Returns:
+        dict: {'bindings': [{'app', 'iface', 'ns', 'seconds'}], 'total_seconds': float}
+              where 'seconds' is the wall-clock time from start until the app was launched.
+    """
+    step = progress or (lambda message: None)
+    start = time.perf_counter()
+
+    by_namespace = {}
+    report = []
+    for app, iface, *shape in bindings:
+        shape = shape[0] if shape else None
+        names = pool.claim(iface) if pool else None
+        if names:
+            # Fast path: the namespace is already wired up, only exec the app
+            if shape:
+                names['shape'] = shape
+                run_steps(iface, plan_shaping(names['veth0'], shape), step)
+            step(f"{iface}: launching {os.path.basename(app)} in pooled {names['ns']}")
+            if launch:
+                launch(app, names)
+            report.append({'app': app, 'iface': iface, 'ns': names['ns'],
+                           'seconds': time.perf_counter() - start})
+        else:
+            # Namespaces of the same run must not pick the same free subnet
+            names = namespace_for(iface, shape, {planned['subnet'] for planned, _apps in by_namespace.values()})
+            by_namespace.setdefault(names['ns'], (names, []))[1].append(app)
+    if not by_namespace:
+        return {'bindings': report, 'total_seconds': time.perf_counter() - start}
+
+    step("Preparing forwarding and routing tables")
+    with trace.span("read state"):
+        state = read_state()
+    prepare_shared_state(state, {names['iface'] for names, _apps in by_namespace.values()})
+
+    def build_and_launch(ns):
+        names, apps = by_namespace[ns]
+        iface = names['iface']
+        with trace.span(f"build {iface}"):
+            names = build_namespace(iface, step, names=names, state=state)
+        results = []
+        for app in apps:
+            if launch:
+                step(f"{iface}: launching {os.path.basename(app)}")
+                launch(app, names)
+            results.append({'app': app, 'iface': iface, 'ns': names['ns'],
+                            'seconds': time.perf_counter() - start})
+        return results
+
+    workers = max(1, min(max_workers, len(by_namespace)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="intermux-provision") as executor:
+        futures = [executor.submit(carry(build_and_launch), ns) for ns in by_namespace]
+        errors = []
+        for future in futures:
+            try:
+                report.extend(future.result())
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+
+    return {'bindings': report, 'total_seconds': time.perf_counter() - start}
+
+
+def print_report(report):
+    for binding in report['bindings']:
+        where = binding.get('ns') or binding.get('cgroup')
+        print(f"[✓] {binding['app']} -> {binding['iface']} ({where}): {binding['seconds']:.2f}s")
+    for ns in report.get('pruned', []):
+        print(f"[✓] Removed unused namespace {ns}")
+    print(f"[✓] {len(report['bindings'])} app(s) ready in {report['total_seconds']:.2f}s")
@@ -0,0 +1,138 @@
+# intermux/core/reconcile.py
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.router import get_routing_table_ids
+from core import nat
+from core import ledger
+from core.executor import carry
+from core.pool import POOL_PREFIX
+from core.provision import (namespace_for, read_state, plan_shared_state, plan_namespace,
+                            build_namespace, run_steps, MAX_WORKERS)
+
+
+def _plan_removal(ns, state):
+    """Lists the commands that remove a namespace and what the ledger records for it."""
+    steps = []
+    for kind, key in ledger.owned_by(ns):
+        if kind == 'veth' and key in state['links']:
+            steps.append(("removing veth pair", f"ip link del {key}"))
+        elif kind == 'rule' and key.split()[1] in state['rules']:
+            steps.append(("removing uplink steering", f"ip rule del {key}"))
+        elif kind == 'nat' and key in state['nat']:
+            steps.append(("removing NAT", nat.plan_remove(key)))
+    steps.append(("removing namespace", f"ip netns del {ns}"))
+    if os.path.exists(f"/etc/netns/{ns}"):
+        steps.append(("removing DNS config", f"rm -rf /etc/netns/{ns}"))
+    return steps
+
+
+def plan(bindings, state=None, prune=True, keep=()):
+    """
+    Computes the changes that turn the current state into the desired bindings.
+
+    Args:
+        bindings (list): (app, iface) or (app, iface, shape) tuples, like
+                         core.provision.provision(); apps on the same uplink and
+                         shape share a namespace. A balanced binding uses the
+                         name returned by core.multipath.setup_multipath_routing().
+        state (dict): Current state from read_state(); read now if not given.
+        prune (bool): Also remove the namespaces the ledger records that no binding uses.
+        keep (iterable): Namespaces never pruned, e.g. pooled ones apps were launched in.
+
+    Returns:
+        dict: {'host': [...], 'namespaces': {ns: (names, [...])}, 'prune': {ns: [...]}}
+              lists of (message, command) steps; namespaces that are already in place
+              have no entry. Namespace steps assume the host steps have been applied.
+    """
+    state = state if state is not None else read_state()
+    wanted = {}
+    for _app, iface, *shape in bindings:
+        names = namespace_for(iface, shape[0] if shape else None,
+                              {planned['subnet'] for planned in wanted.values()})
+        wanted.setdefault(names['ns'], names)
+
+    result = {'host': plan_shared_state(state, {names['iface'] for names in wanted.values()}),
+              'namespaces': {}, 'prune': {}}
+    tables = get_routing_table_ids()
+    for ns, names in wanted.items():
+        steps = plan_namespace(names, state, tables.get(f"{names['iface']}_rt"))
+        if steps:
+            result['namespaces'][ns] = (names, steps)
+
+    if prune:
+        # Only what intermux recorded is removed; pooled namespaces belong to core.pool
+        keep = set(wanted) | set(keep)
+        for ns in sorted(ledger.entries('netns')):
+            if ns not in keep and not ns.startswith(POOL_PREFIX):
+                result['prune'][ns] = _plan_removal(ns, state)
+    return result
+
+
+def count_steps(changes):
+    return (len(changes['host']) + sum(len(steps) for _names, steps in changes['namespaces'].values())
+            + sum(len(steps) for steps in changes['prune'].values()))
+
+
+def apply(changes, state=None, progress=None, max_workers=MAX_WORKERS):
+    """
+    Applies a plan: host-wide steps first, then every namespace in parallel, then removals.
+
+    Namespaces are built with core.provision.build_namespace(), so they are recorded in
+    the ledger like the ones provision() builds.
+    """
+    state = state if state is not None else read_state()
+    run_steps("host", changes['host'], progress)
+    if changes['namespaces']:
+        def build(names):
+            build_namespace(names['iface'], progress, names=names, state=state)
+
+        workers = max(1, min(max_workers, len(changes['namespaces'])))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="intermux-reconcile") as executor:
+            futures = [executor.submit(carry(build), names) for names, _steps in changes['namespaces'].values()]
+            for future in futures:
+                future.result()
+    for ns, steps in changes['prune'].items():
+        run_steps(ns, steps, progress)
+        ledger.forget(ledger.owned_by(ns))
+
+
+def reconcile(bindings, prune=True, dry_run=False, progress=None, keep=()):
+    """
+    Reads the current state once, then applies only the difference to `bindings`.
+
+    Running it again with the same bindings executes no commands.
+
+    Args:
+        bindings (list): (app, iface) or (app, iface, shape) tuples, see plan().
+        prune (bool): Remove intermux namespaces that are no longer wanted.
+        dry_run (bool): Only compute and return the plan.
+        progress (callable): Called with a message before each step.
+        keep (iterable): Namespaces never pruned, see plan().
+
+    Returns:
+        dict: The plan, with 'commands' (number of steps) and 'seconds' added.
+    """
+    start = time.perf_counter()
+    state = read_state()
+    changes = plan(bindings, state, prune=prune, keep=keep)
+    if not dry_run:
+        apply(changes, state, progress)
+    changes['commands'] = count_steps(changes)
+    changes['seconds'] = time.perf_counter() - start
+    return changes
+
+
+def print_plan(changes):
+    sections = [("host", changes['host'])]
+    sections += [(names['iface'], steps) for names, steps in changes['namespaces'].values()]
+    sections += list(changes['prune'].items())
+    for label, steps in sections:
+        for message, command in steps:
+            shown = command if isinstance(command, str) else message
+            print(f"[{label}] {shown}")
+    if not count_steps(changes):
+        print("[✓] Nothing to do, everything is up to date.")
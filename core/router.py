@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 import sys
 import os
-import subprocess
 import re
+import json
+import logging
 import ipaddress
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from core.interface import get_active_interfaces
+from core import ledger
+from core import executor
+from core import rt_tables
 
-RT_TABLES_PATH = "/etc/iproute2/rt_tables"
-BASE_TABLE_ID = 100
 BASE_PRIORITY = 1000
+# Rules at or after 32766 would only be consulted after the main table
+LAST_RULE_PRIORITY = 32765
+# Rules steering a namespace subnet into its uplink's table come before the per-address rules
+BINDING_PRIORITY = 500
 
 
 
@@ -17,27 +23,187 @@ def get_network(ip_with_cidr):
     net = ipaddress.ip_interface(ip_with_cidr).network
     return str(net)
 
-def run_cmd(cmd):
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    if result.stderr and not result.returncode == 0:
-        print(f"[!] {cmd} -> {result.stderr.strip()}")
-    return result.stdout.strip()
-
-
+def run_batch(commands, force=False):
+    """
+    Runs a list of 'ip' commands (without the leading 'ip') in one 'ip -batch' process.
+
+    Without force, ip stops at the first failing command.
+
+    Returns:
+        int or None: Index of the first failed command, or None if all succeeded.
+    """
+    if not commands:
+        return None
+    cmd = ['ip', '-force', '-batch', '-'] if force else ['ip', '-batch', '-']
+    result = executor.run(cmd, input="\n".join(commands) + "\n")
+    if result.returncode == 0:
+        return None
+    if not force:
+        print(f"[!] ip -batch -> {result.stderr.strip()}")
+    failed = re.findall(r'Command failed -:(\d+)', result.stderr)
+    return int(failed[0]) - 1 if failed else 0
+
+
+def _route_command(route):
+    """'route add' command re-creating a route from 'ip -j route show' output."""
+    parts = ['route', 'add']
+    if route.get('type', 'unicast') != 'unicast':
+        parts.append(route['type'])
+    parts.append(route['dst'])
+    for key, word in (('gateway', 'via'), ('dev', 'dev'), ('protocol', 'proto'), ('scope', 'scope'),
+                      ('prefsrc', 'src'), ('metric', 'metric'), ('table', 'table')):
+        if key in route:
+            parts += [word, str(route[key])]
+    if 'onlink' in route.get('flags', []):
+        parts.append('onlink')
+    for nexthop in route.get('nexthops', []):
+        parts.append('nexthop')
+        for key, word in (('gateway', 'via'), ('dev', 'dev'), ('weight', 'weight')):
+            if key in nexthop:
+                parts += [word, str(nexthop[key])]
+    return " ".join(parts)
+
+
+def _rule_command(rule):
+    """'rule add' command re-creating a rule from 'ip -N -j rule show' output."""
+    source = rule.get('src', 'all')
+    parts = ['rule', 'add', 'priority', str(rule['priority']),
+             'from', f"{source}/{rule['srclen']}" if 'srclen' in rule else source]
+    if 'dst' in rule:
+        parts += ['to', f"{rule['dst']}/{rule['dstlen']}" if 'dstlen' in rule else rule['dst']]
+    if 'fwmark' in rule:
+        parts += ['fwmark', f"{rule['fwmark']}/{rule['fwmask']}" if 'fwmask' in rule else rule['fwmark']]
+    for key, word in (('iif', 'iif'), ('oif', 'oif'), ('table', 'table'),
+                      ('suppress_prefixlen', 'suppress_prefixlength')):
+        if key in rule:
+            parts += [word, str(rule[key])]
+    return " ".join(parts)
+
+
+def _read_json(cmd):
+    return json.loads(executor.run(cmd, readonly=True).stdout or '[]')
+
+
+class RouteBatch:
+    """
+    Collects route and rule changes and applies them in a single 'ip -batch' run.
+
+    Cleanup (flushing a table, deleting a rule that may not exist) is applied first
+    with -force. The remaining commands are applied as a transaction: if one fails,
+    the undo commands of every change applied before it are run in reverse order,
+    then the routes of the flushed tables and the deleted rules are put back from a
+    snapshot taken before the cleanup, leaving the kernel as it was. Routing tables
+    declared for the batch are removed from rt_tables again, and ledger entries it
+    added are forgotten.
+
+    Ledger entries queued with record() are written in one go before anything
+    is applied.
+    """
+
+    def __init__(self):
+        self.cleanup = []
+        self.commands = []
+        self.undo = []
+        self.resources = []
+        self.flushed = set()
+        self.dropped = []
+        self.tables = []
+
+    def record(self, kind, key, details):
+        self.resources.append((kind, key, details))
+
+    def declare_tables(self, entries):
+        """Marks rt_tables entries ('id name') as created for this batch."""
+        self.tables += entries
+
+    def flush_table(self, table_id):
+        self.cleanup.append(f"route flush table {table_id}")
+        self.flushed.add(str(table_id))
+
+    def drop_rule(self, rule):
+        self.cleanup.append(f"rule del {rule}")
+        self.dropped.append(rule)
+
+    def add(self, command, undo=None):
+        self.commands.append(command)
+        self.undo.append(undo)
+
+    def _snapshot(self):
+        """Routes of the tables to flush and every rule, as read before the cleanup."""
+        routes = []
+        if self.flushed:
+            index = rt_tables.load()
+            for route in _read_json("ip -j route show table all"):
+                table_id = str(index.get(route.get('table')) or route.get('table'))
+                if table_id in self.flushed:
+                    routes.append(dict(route, table=table_id))
+        rules = _read_json("ip -N -j rule show") if self.dropped else []
+        return routes, rules
+
+    def _restore(self, routes, rules):
+        present = {json.dumps(rule, sort_keys=True) for rule in _read_json("ip -N -j rule show")} if rules else set()
+        commands = [f"route flush table {table_id}" for table_id in sorted(self.flushed)]
+        commands += [_route_command(route) for route in routes]
+        commands += [_rule_command(rule) for rule in rules if json.dumps(rule, sort_keys=True) not in present]
+        run_batch(commands, force=True)
+
+    def commit(self):
+        """
+        Applies the batch.
+
+        Returns:
+            bool: True if every change was applied, False if it was rolled back.
+        """
+        known = {kind: ledger.entries(kind) for kind in {kind for kind, _key, _details in self.resources}}
+        added = [(kind, key) for kind, key, _details in self.resources if key not in known[kind]]
+        routes, rules = self._snapshot()
+        ledger.record(self.resources)
+        run_batch(self.cleanup, force=True)
+        failed = run_batch(self.commands)
+        if failed is None:
+            return True
+        print(f"[!] Failed: ip {self.commands[failed]}")
+        rollback = [undo for undo in reversed(self.undo[:failed]) if undo]
+        run_batch(rollback, force=True)
+        self._restore(routes, rules)
+        remove_routing_table_entries(self.tables)
+        ledger.forget(added + [('rt_table', entry) for entry in self.tables])
+        print(f"[!] Rolled back {len(rollback)} change(s) and restored the previous routes and rules.")
+        return False
 
 def extract_ip_and_prefix(ip_with_cidr):
     if '/' in ip_with_cidr:
         return ip_with_cidr.split('/')
     return ip_with_cidr, '24'
 
-def ensure_routing_table(table_id, name):
-    with open(RT_TABLES_PATH, 'r+') as f:
-        lines = f.read().splitlines()
-        entry = f"{table_id} {name}"
-        if entry not in lines:
-            f.write(f"\n{entry}\n")
-            print(f"[+] Added routing table entry: {entry}")
-    return True
+def ensure_routing_table(table_id, name, tables=None):
+    """
+    Declares routing table `name` in rt_tables if it is missing.
+
+    Args:
+        table_id (int): Preferred ID, or None for the first free one.
+        name (str): Table name.
+        tables (rt_tables.TableIndex): Index of an open rt_tables.transaction(); the
+                                       caller then records and writes the change.
+
+    Returns:
+        int: The table's ID.
+    """
+    if tables is None:
+        with rt_tables.transaction() as tables:
+            table_id = ensure_routing_table(table_id, name, tables)
+            ledger.record([('rt_table', entry, {}) for entry in tables.added])
+        return table_id
+    existing = tables.get(name)
+    if existing is not None:
+        return existing
+    table_id = tables.allocate(name, table_id)
+    print(f"[+] Added routing table entry: {table_id} {name}")
+    return table_id
+
+def rule_priority(table_id):
+    """Priority of the source rule of a table; the 32-bit ID range is folded in front of main."""
+    return min(BASE_PRIORITY + table_id, LAST_RULE_PRIORITY)
 
 # def setup_interface_routing(name, ip_with_cidr, gateway, table_id):
 #     ip, prefix = extract_ip_and_prefix(ip_with_cidr)
@@ -54,94 +220,177 @@ def ensure_routing_table(table_id, name):
 
 #     print(f"[✓] Routing set for {name} ({ip}/{prefix}) via {gateway} [table {table_id}]")
 
-def setup_interface_routing(name, ip_with_cidr, gateway, table_id):
+def setup_interface_routing(name, ip_with_cidr, gateway, table_id=None, batch=None, tables=None):
+    """
+    Programs the routing table and source rule of one interface.
+
+    If a RouteBatch is given the changes are only queued on it and the caller
+    commits them; otherwise they are applied immediately in their own batch.
+    The table keeps its ID if it already exists; see ensure_routing_table() for
+    `table_id` and `tables`. A table declared here is removed again if the batch
+    is rolled back; with `tables`, the caller declares the tables of its transaction.
+    """
     ip, prefix = extract_ip_and_prefix(ip_with_cidr)
-    table_name = f"{name}_rt"
+    declared = []
+    if tables is None:
+        with rt_tables.transaction() as own_tables:
+            table_id = ensure_routing_table(table_id, f"{name}_rt", own_tables)
+            ledger.record([('rt_table', entry, {}) for entry in own_tables.added])
+        declared = own_tables.added
+    else:
+        table_id = ensure_routing_table(table_id, f"{name}_rt", tables)
+    priority = rule_priority(table_id)
+
+    own_batch = batch is None
+    if own_batch:
+        batch = RouteBatch()
+
+    batch.declare_tables(declared)
+    batch.flush_table(table_id)
+    batch.drop_rule(f"from {ip} table {table_id} priority {priority}")
 
-    ensure_routing_table(table_id, table_name)
+    network = get_network(ip_with_cidr)
+    route = f"{network} dev {name} scope link table {table_id}"
+    batch.add(f"route add {route}", undo=f"route del {route}")
 
-    run_cmd(f"ip route flush table {table_id}")
-    run_cmd(f"ip rule del from {ip} table {table_id} priority {BASE_PRIORITY + table_id} 2>/dev/null")
+    default = f"default via {gateway} dev {name} table {table_id}"
+    batch.add(f"route add {default}", undo=f"route del {default}")
+
+    rule = f"from {ip} table {table_id} priority {priority}"
+    batch.record('rule', rule, {'table': table_id})
+    batch.add(f"rule add {rule}", undo=f"rule del {rule}")
+
+    if own_batch:
+        if not batch.commit():
+            return False
+        print(f"[✓] Routing set for {name} ({ip}/{prefix}) via {gateway} [table {table_id}]")
+    return True
 
-    network = get_network(ip_with_cidr)
-    run_cmd(f"ip route add {network} dev {name} scope link table {table_id}")
 
-    run_cmd(f"ip route add default via {gateway} dev {name} table {table_id}")
-    run_cmd(f"ip rule add from {ip} table {table_id} priority {BASE_PRIORITY + table_id}")
+def ensure_uplink_routing(name):
+    """
+    Returns the routing table ID of uplink `name`, creating its table and source
+    rule first if it has none.
 
-    print(f"[✓] Routing set for {name} ({ip}/{prefix}) via {gateway} [table {table_id}]")
+    Raises:
+        ValueError: If `name` is not UP with an IPv4 address and a gateway.
+        RuntimeError: If its routing could not be set up.
+    """
+    table_id = get_routing_table_ids().get(f"{name}_rt")
+    if table_id is not None:
+        return table_id
+    for iface in get_active_interfaces():
+        ipv4s = [ip for ip in iface['ip_addresses'] if ':' not in ip]
+        if iface['name'] != name or iface['flag'] != 'UP' or not ipv4s or not iface['gateways']:
+            continue
+        with rt_tables.transaction() as tables:
+            table_id = ensure_routing_table(None, f"{name}_rt", tables)
+            ledger.record([('rt_table', entry, {}) for entry in tables.added])
+        if not setup_interface_routing(name, ipv4s[0], iface['gateways'][0], table_id, tables=tables):
+            remove_routing_table_entries(tables.added)
+            ledger.forget([('rt_table', entry) for entry in tables.added])
+            raise RuntimeError(f"Could not set up the routing table of {name}")
+        return table_id
+    raise ValueError(f"No routing table for {name}; it needs an IPv4 address and a gateway")
 
 
 def check_existing_routing_tables():
-    with open(RT_TABLES_PATH, 'r') as f:
-        lines = f.read().splitlines()
-
-    for line in lines:
-        if line.strip() and not line.strip().startswith("#"):
-            parts = line.strip().split()
-            if len(parts) == 2:
-                table_id, name = parts
-                if name.endswith('_rt'):
-                    return True
-    return False
+    return bool(rt_tables.load().custom())
+
+def get_routing_table_ids():
+    """
+    Returns:
+        dict: Table name -> table id for the custom ('_rt') tables in rt_tables.
+    """
+    return rt_tables.load().custom()
+
+def remove_routing_table_entries(entries):
+    """
+    Removes tables from rt_tables if they are still declared with the same ID.
+
+    Args:
+        entries (iterable): 'id name' strings, e.g. '100 wlan0_rt'.
+    """
+    entries = [entry.split() for entry in entries]
+    if not entries:
+        return
+    with rt_tables.transaction() as tables:
+        for table_id, name in entries:
+            if tables.get(name) == int(table_id):
+                tables.remove(name)
 
 def clear_custom_routing_tables():
     if os.geteuid() != 0:
         print("[X] Run this script as root.")
         return
 
-    # Read existing tables
-    with open(RT_TABLES_PATH, 'r') as f:
-        lines = f.read().splitlines()
-
-    # Filter out custom tables (ending in _rt)
-    remaining_lines = []
-    custom_tables = []
-
-    for line in lines:
-        if line.strip() and not line.strip().startswith("#"):
-            parts = line.strip().split()
-            if len(parts) == 2:
-                table_id, name = parts
-                if name.endswith('_rt'):
-                    custom_tables.append((table_id, name))
-                    continue
-        remaining_lines.append(line)
-
-    # Write back only non-custom entries
-    with open(RT_TABLES_PATH, 'w') as f:
-        f.write("\n".join(remaining_lines) + "\n")
-
-    # Clear associated routes and rules
+    # Remove the custom tables (ending in _rt) from rt_tables and its drop-ins
+    with rt_tables.transaction() as tables:
+        custom_tables = sorted((table_id, name) for name, table_id in tables.custom().items())
+        for table_id, name in custom_tables:
+            tables.remove(name)
+
+    # Rules recorded in the ledger for these tables are removed exactly
+    cleared = {table_id for table_id, name in custom_tables}
+    rules = [key for key, details in ledger.entries('rule').items() if details.get('table') in cleared]
+
+    # Clear associated routes and rules in a single batch
+    commands = [f"rule del {rule}" for rule in rules]
     for table_id, name in custom_tables:
-        try:
-            run_cmd(f"ip route flush table {table_id}")
-            run_cmd(f"ip rule del table {table_id}")
-            print(f"[✓] Cleared routing table {table_id} ({name})")
-        except Exception as e:
-            print(f"[!] Failed to clear table {table_id}: {e}")
+        commands.append(f"route flush table {table_id}")
+        commands.append(f"rule del table {table_id}")
+    run_batch(commands, force=True)
+    ledger.forget([('rt_table', f"{table_id} {name}") for table_id, name in custom_tables] +
+                  [('rule', rule) for rule in rules])
+    for table_id, name in custom_tables:
+        print(f"[✓] Cleared routing table {table_id} ({name})")
+
+def setup_routing_tables():
+    """
+    Creates a routing table and source rule for every UP interface with an IPv4
+    address and a gateway, in one batch.
+
+    Returns:
+        bool: True if the routing was applied, False if it was rolled back.
+    """
+    interfaces = get_active_interfaces()
+    batch = RouteBatch()
+    configured = []
+
+    # One locked read and one atomic write of rt_tables for all interfaces
+    with rt_tables.transaction() as tables:
+        for iface in interfaces:
+            if iface['flag'] != 'UP':
+                continue
+
+            ipv4s = [ip for ip in iface['ip_addresses'] if ':' not in ip]
+            if not ipv4s or not iface['gateways']:
+                continue
+
+            ip_with_cidr = ipv4s[0]
+            gateway = iface['gateways'][0]
+
+            setup_interface_routing(iface['name'], ip_with_cidr, gateway, batch=batch, tables=tables)
+            configured.append(iface['name'])
+        # Recorded before the transaction writes the tables
+        ledger.record([('rt_table', entry, {}) for entry in tables.added])
+    batch.declare_tables(tables.added)
+
+    if not batch.commit():
+        print("[X] Routing setup failed, no changes were kept.")
+        return False
+    print(f"[✓] Routing tables active for: {', '.join(configured) if configured else 'none'}")
+    return True
 
 def main():
+    logging.basicConfig(level=os.environ.get('INTERMUX_LOG_LEVEL', 'INFO').upper(),
+                        format='%(levelname)s: %(message)s')
     if os.geteuid() != 0:
         print("[X] Run this script as root.")
         return
 
-    interfaces = get_active_interfaces()
-    table_id = BASE_TABLE_ID
-
-    for iface in interfaces:
-        if iface['flag'] != 'UP':
-            continue
-
-        ipv4s = [ip for ip in iface['ip_addresses'] if ':' not in ip]
-        if not ipv4s or not iface['gateways']:
-            continue
-
-        ip_with_cidr = ipv4s[0]
-        gateway = iface['gateways'][0]
-
-        setup_interface_routing(iface['name'], ip_with_cidr, gateway, table_id)
-        table_id += 1
+    if not setup_routing_tables():
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
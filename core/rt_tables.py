@@ -0,0 +1,193 @@
+# intermux/core/rt_tables.py
+
+import os
+import sys
+import glob
+import fcntl
+import threading
+import contextlib
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import executor
+
+# iproute2 reads table names from rt_tables and from every rt_tables.d/*.conf file.
+# intermux keeps its own tables in one drop-in file, and only removes entries from
+# the main file when clearing tables created by older versions.
+RT_TABLES_PATH = "/etc/iproute2/rt_tables"
+RT_TABLES_DIR = "/etc/iproute2/rt_tables.d"
+DROPIN_NAME = "intermux.conf"
+
+FIRST_TABLE_ID = 100
+MAX_TABLE_ID = 2 ** 32 - 1
+# iproute2 reads rt_tables IDs as signed integers, so names above this do not resolve
+MAX_ALLOCATED_ID = 2 ** 31 - 1
+# unspec, default, main and local
+RESERVED_IDS = {0, 253, 254, 255}
+
+_thread_lock = threading.Lock()
+_cache = {'signature': None, 'index': None}
+
+
+def dropin_path():
+    return os.path.join(RT_TABLES_DIR, DROPIN_NAME)
+
+
+def _sources():
+    return [RT_TABLES_PATH] + sorted(glob.glob(os.path.join(RT_TABLES_DIR, '*.conf')))
+
+
+def _signature():
+    signature = []
+    for path in _sources():
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+    return tuple(signature)
+
+
+class TableIndex:
+    """
+    Id/name index of every routing table declared in rt_tables and its drop-ins.
+
+    Lookups are O(1). allocate() hands out free IDs from a cursor, so assigning IDs
+    to many tables in one go is linear overall. Changes are kept in memory until
+    the transaction() that produced the index is closed.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.source = {}   # name -> file it is declared in
+        self.removed = {}  # file -> names removed from it
+        self.added = []
+        self._cursor = FIRST_TABLE_ID
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            parts = line.split('#', 1)[0].split()
+            if len(parts) != 2:
+                continue
+            try:
+                table_id = int(parts[0], 0)
+            except ValueError:
+                continue
+            self.by_id[table_id] = parts[1]
+            self.by_name[parts[1]] = table_id
+            self.source[parts[1]] = path
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def custom(self):
+        """
+        Returns:
+            dict: name -> id of the per-uplink ('_rt') tables.
+        """
+        return {name: table_id for name, table_id in self.by_name.items() if name.endswith('_rt')}
+
+    def allocate(self, name, table_id=None):
+        """
+        Returns the ID of table `name`, declaring it with a free ID if it is missing.
+
+        Args:
+            name (str): Table name.
+            table_id (int): Preferred ID, used if it is free.
+
+        Raises:
+            ValueError: If no free ID is left.
+        """
+        if name in self.by_name:
+            return self.by_name[name]
+        if (table_id is None or table_id in self.by_id or table_id in RESERVED_IDS
+                or not 0 < table_id <= MAX_TABLE_ID):
+            while self._cursor in self.by_id or self._cursor in RESERVED_IDS:
+                self._cursor += 1
+            if self._cursor > MAX_ALLOCATED_ID:
+                raise ValueError("No free routing table ID left")
+            table_id = self._cursor
+        self.by_id[table_id] = name
+        self.by_name[name] = table_id
+        self.source[name] = dropin_path()
+        self.added.append(f"{table_id} {name}")
+        return table_id
+
+    def remove(self, name):
+        """Removes table `name` from whichever file declares it."""
+        table_id = self.by_name.pop(name, None)
+        if table_id is None:
+            return None
+        del self.by_id[table_id]
+        self.removed.setdefault(self.source.pop(name), set()).add(name)
+        self._cursor = min(self._cursor, max(table_id, FIRST_TABLE_ID))
+        return table_id
+
+
+def _read_index():
+    index = TableIndex()
+    for path in _sources():
+        index._load(path)
+    return index
+
+
+def load():
+    """
+    Returns the current table index, parsed again only when one of the files changed.
+
+    The returned index is shared; use transaction() to make changes.
+    """
+    signature = _signature()
+    with _thread_lock:
+        if _cache['signature'] != signature:
+            _cache['index'] = _read_index()
+            _cache['signature'] = signature
+        return _cache['index']
+
+
+def _write_atomic(path, lines):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _rewrite(path, removed, added):
+    """Drops the `removed` names from `path` and appends the `added` lines, keeping comments."""
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = ["# Routing tables created by intermux"] if path == dropin_path() else []
+    kept = [line for line in lines
+            if len(line.split('#', 1)[0].split()) != 2 or line.split('#', 1)[0].split()[1] not in removed]
+    _write_atomic(path, kept + added)
+
+
+@contextlib.contextmanager
+def transaction():
+    """
+    Locks the table files against other intermux processes and yields a fresh
+    TableIndex. Added and removed tables are written back atomically (temp file +
+    rename) when the block exits without an exception.
+    """
+    os.makedirs(RT_TABLES_DIR, exist_ok=True)
+    with _thread_lock, open(dropin_path() + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        index = _read_index()
+        yield index
+        changes = {path: (names, []) for path, names in index.removed.items()}
+        if index.added:
+            changes.setdefault(dropin_path(), (set(), []))[1].extend(index.added)
+        for path, (removed, added) in changes.items():
+            description = [path] + (['-=', ', '.join(sorted(removed))] if removed else []) + \
+                          (['+=', ', '.join(added)] if added else [])
+            if not executor.record_instead(description):
+                _rewrite(path, removed, added)
+        _cache['signature'] = None
@@ -0,0 +1,113 @@
+# intermux/core/shaping.py
+
+import re
+
+# A binding can be shaped on the host side of its veth pair:
+#   download  HTB class + fq_codel on the veth's egress (traffic going into the namespace)
+#   upload    policer on the veth's ingress (traffic coming out of the namespace)
+#   priority  TOS bits set on upload traffic; the kernel derives the packet priority
+#             from them when forwarding, so the uplink's qdisc (pfifo_fast bands,
+#             cake diffserv) serves interactive traffic first and bulk traffic last
+# Everything lives on the veth, so it disappears together with the binding's namespace.
+PRIORITIES = {
+    'interactive': 0x10,  # IPTOS_LOWDELAY
+    'normal': None,
+    'bulk': 0x08,         # IPTOS_THROUGHPUT
+}
+
+RATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)(bit|kbit|mbit|gbit|bps|kbps|mbps|gbps)$')
+RATE_UNITS = {'bit': 1, 'kbit': 1e3, 'mbit': 1e6, 'gbit': 1e9,
+              'bps': 8, 'kbps': 8e3, 'mbps': 8e6, 'gbps': 8e9}
+# The policer lets this much traffic through in a burst, but never less than MIN_BURST bytes
+BURST_SECONDS = 0.02
+MIN_BURST = 16 * 1024
+
+
+def rate_bits(rate):
+    """
+    Converts a tc rate ('20mbit', '500kbit', '2mbps') to bits per second.
+
+    Raises:
+        ValueError: If the rate is not in tc's notation.
+    """
+    match = RATE_PATTERN.match(rate.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid rate '{rate}', expected e.g. 500kbit, 20mbit or 2mbps")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+
+def make_shape(download=None, upload=None, priority=None):
+    """
+    Validates shaping options.
+
+    Args:
+        download (str): Rate limit for traffic to the app, e.g. '50mbit'.
+        upload (str): Rate limit for traffic from the app.
+        priority (str): 'interactive', 'normal' or 'bulk'.
+
+    Returns:
+        dict or None: {'download', 'upload', 'priority'} with the options set, or None if none is.
+
+    Raises:
+        ValueError: If a rate or the priority is invalid.
+    """
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}', expected one of: {', '.join(PRIORITIES)}")
+    shape = {}
+    for key, rate in (('download', download), ('upload', upload)):
+        if rate:
+            rate_bits(rate)
+            shape[key] = rate.strip().lower()
+    if PRIORITIES.get(priority) is not None:
+        shape['priority'] = priority
+    return shape or None
+
+
+def shape_key(shape):
+    """Short stable description of a shape, e.g. 'down=50mbit,up=5mbit,prio=bulk'."""
+    if not shape:
+        return ''
+    parts = [f"down={shape['download']}" if 'download' in shape else None,
+             f"up={shape['upload']}" if 'upload' in shape else None,
+             f"prio={shape['priority']}" if 'priority' in shape else None]
+    return ','.join(part for part in parts if part)
+
+
+def plan_shaping(veth, shape, qdiscs=None):
+    """
+    Lists the tc commands that shape the host-side veth of a binding.
+
+    Args:
+        veth (str): The host-side veth name.
+        shape (dict): From make_shape(); None plans nothing.
+        qdiscs (set): Kinds of the qdiscs already on `veth` (see core.provision.read_state);
+                      parts that are present are not planned again.
+
+    Returns:
+        list: (message, command) tuples, in order.
+    """
+    if not shape:
+        return []
+    qdiscs = qdiscs or set()
+    steps = []
+    if 'download' in shape and 'htb' not in qdiscs:
+        rate = shape['download']
+        steps.append(("limiting download", f"tc qdisc replace dev {veth} root handle 1: htb default 10"))
+        steps.append(("limiting download",
+                      f"tc class replace dev {veth} parent 1: classid 1:10 htb rate {rate} ceil {rate}"))
+        steps.append(("limiting download", f"tc qdisc replace dev {veth} parent 1:10 handle 10: fq_codel"))
+
+    if ('upload' in shape or 'priority' in shape) and 'ingress' not in qdiscs:
+        actions = []
+        tos = PRIORITIES[shape['priority']] if 'priority' in shape else None
+        if tos is not None:
+            # Rewrite the TOS bits and keep ECN; csum fixes the IP header checksum
+            actions += ["action", "pedit", "ex", "munge", "ip", "dsfield", "set", f"{tos:#04x}",
+                        "retain", "0xfc", "pipe", "action", "csum", "ip", "pipe"]
+        if 'upload' in shape:
+            burst = max(int(rate_bits(shape['upload']) / 8 * BURST_SECONDS), MIN_BURST)
+            actions += ["action", "police", "rate", shape['upload'], "burst", str(burst), "drop"]
+        steps.append(("shaping upload", f"tc qdisc replace dev {veth} handle ffff: ingress"))
+        steps.append(("shaping upload", f"tc filter replace dev {veth} parent ffff: protocol ip pref 1 "
+                                         f"handle 1 matchall {' '.join(actions)}"))
+    return steps
@@ -0,0 +1,205 @@
+# intermux/core/stats.py
+
+import os
+import sys
+import time
+import logging
+import threading
+from array import array
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import ledger
+
+SYS_CLASS_NET = "/sys/class/net"
+# Counters read for every interface, from /sys/class/net/<name>/statistics
+COUNTERS = ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'rx_dropped', 'tx_dropped')
+
+INTERVAL = float(os.environ.get('INTERMUX_STATS_INTERVAL', '1'))
+# Samples kept per interface; with the default interval, five minutes of history
+CAPACITY = 300
+
+
+class RingBuffer:
+    """
+    Fixed-size history of timestamped counter samples, backed by flat arrays.
+
+    All memory is allocated up front; appending overwrites the oldest sample.
+
+    Args:
+        capacity (int): Number of samples kept.
+        width (int): Number of values per sample.
+    """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self._times = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity * width))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        slot = self._next
+        self._times[slot] = timestamp
+        self._values[slot * self.width:(slot + 1) * self.width] = array('d', values)
+        self._next = (slot + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def get(self, age=0):
+        """
+        Returns the sample `age` steps back (0 is the latest) as (timestamp, values).
+
+        Raises:
+            IndexError: If fewer samples are stored.
+        """
+        if not 0 <= age < self._count:
+            raise IndexError(age)
+        slot = (self._next - 1 - age) % self.capacity
+        return self._times[slot], tuple(self._values[slot * self.width:(slot + 1) * self.width])
+
+
+def read_counters(name):
+    """
+    Reads the COUNTERS of one interface.
+
+    Returns:
+        tuple or None: The counter values, or None if the interface is gone.
+    """
+    values = []
+    for counter in COUNTERS:
+        try:
+            with open(f"{SYS_CLASS_NET}/{name}/statistics/{counter}", 'rb') as f:
+                values.append(int(f.read()))
+        except (OSError, ValueError):
+            return None
+    return tuple(values)
+
+
+def binding_labels():
+    """
+    Maps the host-side veth of every binding in the ledger to 'binding <ns> via <uplink>'.
+    """
+    namespaces = ledger.entries('netns')
+    labels = {}
+    for veth, details in ledger.entries('veth').items():
+        ns = details.get('ns')
+        iface = namespaces.get(ns, {}).get('iface', '?')
+        labels[veth] = f"binding {ns} via {iface}"
+    return labels
+
+
+class ThroughputSampler:
+    """
+    Samples the traffic counters of every interface at a fixed interval.
+
+    Each interface has its own RingBuffer, so memory stays constant however long
+    the sampler runs; buffers of interfaces that disappear are dropped. The
+    host-side veths of bindings are labelled with their namespace and uplink.
+
+    Args:
+        interval (float): Seconds between samples.
+        capacity (int): Samples kept per interface.
+    """
+
+    def __init__(self, interval=INTERVAL, capacity=CAPACITY):
+        self.interval = interval
+        self.capacity = capacity
+        self._buffers = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self, now=None):
+        """Takes one sample of every interface."""
+        now = time.monotonic() if now is None else now
+        try:
+            names = os.listdir(SYS_CLASS_NET)
+        except OSError:
+            names = []
+        readings = {}
+        for name in names:
+            values = read_counters(name)
+            if values is not None:
+                readings[name] = values
+        with self._lock:
+            for name in set(self._buffers) - set(readings):
+                del self._buffers[name]
+            if set(readings) - set(self._buffers):
+                # New interfaces: bindings may have been created since the last look at the ledger
+                try:
+                    self._labels = binding_labels()
+                except (OSError, ValueError, ledger.LedgerError) as e:
+                    # Keep the labels from the last good read
+                    logging.warning(f"Could not read the ledger for binding names: {e}")
+            for name, values in readings.items():
+                buffer = self._buffers.get(name)
+                if buffer is None:
+                    buffer = self._buffers[name] = RingBuffer(self.capacity, len(COUNTERS))
+                buffer.append(now, values)
+
+    def rates(self, name, window=1):
+        """
+        Computes per-second rates of one interface over the last `window` intervals.
+
+        Returns:
+            dict or None: name, label, rx_bps, tx_bps, rx_pps, tx_pps, rx_drops, tx_drops
+                          (bits, packets and drops per second), or None until two samples exist.
+        """
+        with self._lock:
+            buffer = self._buffers.get(name)
+            if buffer is None or len(buffer) < 2:
+                return None
+            end_time, end = buffer.get(0)
+            start_time, start = buffer.get(min(window, len(buffer) - 1))
+            label = self._labels.get(name, 'interface')
+        elapsed = end_time - start_time
+        if elapsed <= 0:
+            return None
+        # A counter that went backwards was reset (the interface was recreated)
+        delta = [max(b - a, 0) / elapsed for a, b in zip(start, end)]
+        return {
+            'name': name,
+            'label': label,
+            'rx_bps': delta[0] * 8,
+            'tx_bps': delta[1] * 8,
+            'rx_pps': delta[2],
+            'tx_pps': delta[3],
+            'rx_drops': delta[4],
+            'tx_drops': delta[5],
+        }
+
+    def snapshot(self, window=1):
+        """Returns rates() of every sampled interface, sorted by name."""
+        with self._lock:
+            names = sorted(self._buffers)
+        return [rate for rate in (self.rates(name, window) for name in names) if rate]
+
+    def start(self):
+        """Samples in a background thread until stop() is called."""
+        if self._thread:
+            return
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="intermux-stats", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def format_rate(bits_per_second):
+    """Formats a bit rate for display, e.g. '12.3 Mbit/s'."""
+    for unit, scale in (('Gbit/s', 1e9), ('Mbit/s', 1e6), ('kbit/s', 1e3)):
+        if bits_per_second >= scale:
+            return f"{bits_per_second / scale:.1f} {unit}"
+    return f"{bits_per_second:.0f} bit/s"
@@ -0,0 +1,130 @@
+# intermux/core/tasks.py
+
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from core import trace
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task when it notices it has been cancelled."""
+
+
+class Task:
+    """
+    Handle passed to a background function so it can report progress and
+    check for cancellation between steps.
+    """
+
+    def __init__(self, name, events):
+        self.name = name
+        self._events = events
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def step(self, message):
+        """
+        Reports progress and stops the task if it was cancelled.
+
+        Raises:
+            TaskCancelled: If cancel() was called.
+        """
+        if self._cancelled.is_set():
+            raise TaskCancelled(self.name)
+        self._events.put(('progress', self, message, None))
+
+
+class TaskRunner:
+    """
+    Runs blocking network operations on a worker thread.
+
+    Results, errors and progress messages are put on a queue and delivered on the
+    caller's thread by poll(), which reschedules itself through `schedule`
+    (e.g. Tk's root.after). Tasks run one at a time in submission order, since
+    most of them change shared kernel state.
+
+    Args:
+        schedule (callable): schedule(delay_ms, func), e.g. root.after.
+        on_progress (callable): on_progress(task, message), called on the caller's thread.
+        poll_ms (int): Queue polling interval.
+    """
+
+    def __init__(self, schedule, on_progress=None, poll_ms=100):
+        self._schedule = schedule
+        self._on_progress = on_progress
+        self._poll_ms = poll_ms
+        self._events = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intermux-task")
+        self._tasks = []
+        self._schedule(self._poll_ms, self.poll)
+
+    @property
+    def busy(self):
+        return bool(self._tasks)
+
+    def submit(self, name, func, *args, on_done=None, on_error=None):
+        """
+        Queues func(task, *args) to run in the background.
+
+        Args:
+            name (str): Shown in progress messages.
+            func (callable): The blocking operation; receives the Task as first argument.
+            on_done (callable): on_done(result), called on the caller's thread.
+            on_error (callable): on_error(exception), called on the caller's thread.
+                                 Not called when the task was cancelled.
+
+        Returns:
+            Task: The task handle.
+        """
+        task = Task(name, self._events)
+        self._tasks.append(task)
+
+        def run():
+            try:
+                if task.cancelled:
+                    raise TaskCancelled(name)
+                with trace.action(name):
+                    result = func(task, *args)
+                self._events.put(('done', task, result, on_done))
+            except TaskCancelled:
+                self._events.put(('cancelled', task, None, None))
+            except Exception as e:
+                logging.error(f"Task '{name}' failed: {e}")
+                self._events.put(('error', task, e, on_error))
+
+        self._executor.submit(run)
+        return task
+
+    def cancel_all(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def poll(self):
+        while True:
+            try:
+                kind, task, value, callback = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                if self._on_progress:
+                    self._on_progress(task, value)
+                continue
+            if task in self._tasks:
+                self._tasks.remove(task)
+            if self._on_progress:
+                status = {'done': "Done", 'cancelled': "Cancelled"}.get(kind, f"Failed: {value}")
+                self._on_progress(task, status)
+            if callback:
+                callback(value)
+        self._schedule(self._poll_ms, self.poll)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=False)
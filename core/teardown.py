@@ -0,0 +1,189 @@
+# intermux/core/teardown.py
+
+import os
+import sys
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import nat
+from core import cgroup
+from core import ledger
+from core import trace
+from core import executor
+from core import rt_tables
+from core.router import run_batch, remove_routing_table_entries
+from core.pool import POOL_PREFIX
+
+
+def _stage(name, items, run):
+    return {'name': name, 'items': items, 'run': run}
+
+
+def plan():
+    """
+    Collects everything intermux owns into a teardown plan, without changing anything.
+
+    Work is proportional to what intermux owns: the resources come from the ledger,
+    plus per-uplink tables in rt_tables that older versions did not record; no
+    interface or namespace scan is done. Resources of one kind are removed together,
+    'ip' changes in a single 'ip -batch' run per stage and the NAT in one 'nft -f'
+    transaction.
+
+    Returns:
+        dict: 'lanes', lane name -> stages ({'name', 'items', 'run'}) that run in order;
+              the lanes do not depend on each other and run in parallel. 'resources',
+              the (kind, key) ledger entries the plan removes.
+    """
+    rules = ledger.entries('rule')
+    subnets = ledger.entries('nat')
+    veths = ledger.entries('veth')
+    namespaces = ledger.entries('netns')
+    tables = ledger.entries('rt_table')
+    cgroups = ledger.entries('cgroup')
+    # Tables left by versions without a ledger, and their source rules
+    stray = sorted({f"{table_id} {name}" for name, table_id in rt_tables.load().custom().items()} - set(tables))
+    all_tables = sorted(tables) + stray
+
+    routing = ([f"rule del {rule}" for rule in rules] +
+               [f"route flush table {entry.split()[0]}" for entry in all_tables] +
+               [f"rule del table {entry.split()[0]}" for entry in stray])
+    links = [f"link del {veth}" for veth in veths] + [f"netns del {ns}" for ns in namespaces]
+
+    def remove_cgroups():
+        for details in cgroups.values():
+            if not executor.record_instead(['rmdir', details['dir']]):
+                cgroup.remove_cgroup(details['dir'])
+
+    def remove_dns():
+        for details in namespaces.values():
+            if not executor.record_instead(['rm', '-rf', details['dir']]):
+                shutil.rmtree(details['dir'], ignore_errors=True)
+
+    lanes = {
+        'routing': [_stage("rules and routes", list(rules) + [f"table {entry}" for entry in all_tables],
+                           lambda: run_batch(routing, force=True)),
+                    _stage("routing tables", all_tables, lambda: remove_routing_table_entries(all_tables))],
+        'nat': [_stage("NAT", list(subnets) + [f"mark of {path}" for path in cgroups],
+                       lambda: nat.remove_all(subnets)),
+                _stage("cgroups", list(cgroups), remove_cgroups)],
+        'links': [_stage("veths and namespaces", list(veths) + list(namespaces),
+                         lambda: run_batch(links, force=True)),
+                  _stage("namespace DNS", list(namespaces), remove_dns)],
+    }
+    resources = [(kind, key) for kind, entries in (('rule', rules), ('nat', subnets), ('veth', veths),
+                                                    ('netns', namespaces), ('rt_table', tables),
+                                                    ('cgroup', cgroups))
+                 for key in entries]
+    return {'lanes': {name: [stage for stage in lane if stage['items']] for name, lane in lanes.items()},
+            'resources': resources}
+
+
+def print_plan(changes):
+    for name, lane in changes['lanes'].items():
+        for number, stage in enumerate(lane):
+            then = "then " if number else ""
+            print(f"[{name}] {then}{stage['name']} ({len(stage['items'])}): {', '.join(stage['items'])}")
+    if not any(changes['lanes'].values()):
+        print("[i] Nothing to remove.")
+
+
+def run(changes, progress=None):
+    """
+    Runs a teardown plan: the lanes in parallel, the stages of each lane in order.
+    The ledger forgets the removed resources once every stage is done.
+
+    Args:
+        changes (dict): The plan, see plan().
+        progress (callable): Called with a message before each stage.
+
+    Returns:
+        dict: {'stages': [{'name', 'items', 'seconds'}], 'removed': int, 'total_seconds': float}
+    """
+    step = progress or (lambda message: None)
+    start = time.perf_counter()
+    seconds = {}
+
+    def run_lane(lane):
+        for stage in lane:
+            step(f"Removing {stage['name']} ({len(stage['items'])})")
+            began = time.perf_counter()
+            with trace.span(f"teardown: {stage['name']}"):
+                stage['run']()
+            seconds[stage['name']] = time.perf_counter() - began
+
+    lanes = [lane for lane in changes['lanes'].values() if lane]
+    if lanes:
+        with ThreadPoolExecutor(max_workers=len(lanes), thread_name_prefix="intermux-teardown") as pool:
+            futures = [pool.submit(executor.carry(run_lane), lane) for lane in lanes]
+            errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            # Nothing is forgotten, so running the teardown again finishes the job
+            raise errors[0]
+    ledger.forget(changes['resources'])
+    timings = [{'name': stage['name'], 'items': len(stage['items']), 'seconds': seconds[stage['name']]}
+               for lane in lanes for stage in lane]
+    return {'stages': timings, 'removed': len(changes['resources']),
+            'total_seconds': time.perf_counter() - start}
+
+
+def print_timings(report):
+    for stage in report['stages']:
+        print(f"[✓] {stage['name']}: {stage['items']} in {stage['seconds']:.2f}s")
+
+
+def teardown(progress=None):
+    """
+    Removes every resource intermux created, and nothing else, see plan().
+
+    Args:
+        progress (callable): Called with a message before each stage.
+
+    Returns:
+        dict: The timing report of run().
+    """
+    return run(plan(), progress)
+
+
+def release(iface, progress=None):
+    """
+    Removes the bindings of one uplink: its namespaces and cgroups with their rules,
+    NAT and veths, as recorded in the ledger. Apps still running in a namespace lose
+    their network; apps in a cgroup fall back to the host's default routing.
+    Routing tables are shared and stay.
+
+    Pre-built namespaces waiting in the pool are left to core.pool.
+
+    Args:
+        iface (str): The uplink interface name.
+        progress (callable): Called with a message before each stage.
+
+    Returns:
+        int: Number of resources removed.
+    """
+    step = progress or (lambda message: None)
+    namespaces = {ns: details for ns, details in ledger.entries('netns').items()
+                  if details.get('iface') == iface and not ns.startswith(POOL_PREFIX)}
+    all_cgroups = ledger.entries('cgroup')
+    cgroups = {path: details for path, details in all_cgroups.items() if details.get('iface') == iface}
+    owned = [resource for ns in namespaces for resource in ledger.owned_by(ns)]
+    owned += [('rule', key) for key, details in ledger.entries('rule').items() if details.get('cgroup') in cgroups]
+    owned += [('cgroup', path) for path in cgroups]
+    if not owned:
+        return 0
+
+    step(f"Releasing {len(namespaces)} namespace(s) and {len(cgroups)} cgroup(s) of {iface}")
+    run_batch([f"rule del {key}" for kind, key in owned if kind == 'rule'] +
+              [f"link del {key}" for kind, key in owned if kind == 'veth'] +
+              [f"netns del {ns}" for ns in namespaces], force=True)
+    nat.remove([key for kind, key in owned if kind == 'nat'])
+    for details in namespaces.values():
+        if not executor.record_instead(['rm', '-rf', details['dir']]):
+            shutil.rmtree(details['dir'], ignore_errors=True)
+    if cgroups:
+        nat.mark_cgroups({path: details for path, details in all_cgroups.items() if path not in cgroups})
+        for details in cgroups.values():
+            if not executor.record_instead(['rmdir', details['dir']]):
+                cgroup.remove_cgroup(details['dir'])
+    ledger.forget(owned)
+    return len(owned)
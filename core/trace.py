@@ -0,0 +1,237 @@
+# intermux/core/trace.py
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+# Set INTERMUX_TRACE=/path/trace.json to trace a whole process (e.g. the GUI);
+# the CLI turns tracing on with --profile instead.
+TRACE_PATH = os.environ.get('INTERMUX_TRACE')
+
+ENABLED = False
+
+# Programs whose first argument names the object they work on ('ip route', 'tc qdisc')
+SUBCOMMAND_PROGRAMS = ('ip', 'tc', 'nft', 'bridge')
+
+_lock = threading.Lock()
+_local = threading.local()
+_events = []
+_threads = {}
+_epoch = time.perf_counter()
+_action = None
+
+
+def enable():
+    """Starts recording, dropping anything recorded before."""
+    global ENABLED, _epoch
+    with _lock:
+        _events.clear()
+        _threads.clear()
+        _epoch = time.perf_counter()
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _label(cmd):
+    """Groups a command line by program and object, e.g. 'ip route' or 'ip -batch'."""
+    parts = cmd.split() if isinstance(cmd, str) else list(cmd)
+    while parts and parts[0] == 'sudo':
+        parts = parts[1:]
+    if not parts:
+        return '?'
+    program = os.path.basename(parts[0])
+    if '-batch' in parts:
+        return f"{program} -batch"
+    if program not in SUBCOMMAND_PROGRAMS:
+        return program
+    subject = next((part for part in parts[1:] if not part.startswith('-')), '')
+    return f"{program} {subject}".strip()
+
+
+class Span:
+    """
+    Times a block and records it as one trace event.
+
+    Spans nest per thread; commands run inside a span are attributed to it.
+    Does nothing while tracing is disabled.
+
+    Args:
+        name (str): Event name.
+        category (str): 'action', 'operation', 'exec' or 'netlink'.
+        args (dict): Extra details stored with the event.
+    """
+
+    def __init__(self, name, category='operation', args=None):
+        self.name = name
+        self.category = category
+        self.args = dict(args or {})
+        self.active = ENABLED
+
+    def __enter__(self):
+        if self.active:
+            _stack().append(self.name)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active:
+            return False
+        end = time.perf_counter()
+        stack = _stack()
+        stack.pop()
+        if exc_type is not None:
+            self.args.setdefault('error', f"{exc_type.__name__}: {exc}")
+        self.args.setdefault('action', _action)
+        if stack:
+            self.args.setdefault('operation', stack[-1])
+        thread = threading.current_thread()
+        with _lock:
+            _threads[thread.ident] = thread.name
+            _events.append({
+                'name': self.name,
+                'cat': self.category,
+                'ph': 'X',
+                'ts': round((self.start - _epoch) * 1e6, 1),
+                'dur': round((end - self.start) * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': self.args,
+            })
+        return False
+
+
+class _Command(Span):
+
+    def __init__(self, cmd, kind, caller):
+        super().__init__(_label(cmd) if kind == 'exec' else cmd, kind)
+        self.returncode = None
+        if self.active:
+            self.args['cmd'] = cmd if isinstance(cmd, str) else ' '.join(cmd)
+            self.args['caller'] = caller
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.active:
+            self.args['exit'] = self.returncode
+        return super().__exit__(exc_type, exc, tb)
+
+
+class _Action(Span):
+
+    def __init__(self, name):
+        super().__init__(name, 'action')
+        self.previous = None
+
+    def __enter__(self):
+        global _action
+        self.previous, _action = _action, self.name
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        global _action
+        result = super().__exit__(exc_type, exc, tb)
+        _action = self.previous
+        return result
+
+
+def command(cmd, kind='exec', caller=None):
+    """
+    Records one external command or netlink request.
+
+    Set `returncode` on the returned object before the block ends. The function
+    that called the run helper is stored with the event as the caller.
+
+    Args:
+        cmd (str or list): The command line, or a description of the request.
+        kind (str): 'exec' for processes, 'netlink' for kernel requests.
+        caller (str): Calling function; defaults to the caller of the run helper.
+    """
+    if ENABLED and caller is None:
+        # Frame 0 is this function, 1 the run helper, 2 the code that asked for the command
+        caller = sys._getframe(2).f_code.co_name
+    return _Command(cmd, kind, caller)
+
+
+def span(name, **args):
+    """Records a named step; commands run inside it are attributed to it."""
+    return Span(name, 'operation', args)
+
+
+def action(name):
+    """
+    Marks a high-level action (list, assign, reset, ...). Every command run
+    while it is open, from any thread, is aggregated under it.
+    """
+    return _Action(name)
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def export_chrome(path):
+    """
+    Writes the recorded events in Chrome trace format (chrome://tracing, Perfetto).
+    """
+    with _lock:
+        trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident,
+                         'args': {'name': name}} for ident, name in _threads.items()]
+        trace_events += _events
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary():
+    """
+    Aggregates recorded commands per action and command label.
+
+    Returns:
+        list: Dicts with action, label, calls, failures, total_ms and max_ms,
+              slowest first.
+    """
+    rows = {}
+    for event in events():
+        if event['cat'] not in ('exec', 'netlink'):
+            continue
+        key = (event['args'].get('action') or '-', event['name'])
+        row = rows.setdefault(key, {'action': key[0], 'label': key[1], 'calls': 0, 'failures': 0,
+                                    'total_ms': 0.0, 'max_ms': 0.0})
+        ms = event['dur'] / 1000
+        row['calls'] += 1
+        row['failures'] += 1 if event['args'].get('exit') not in (0, None) or 'error' in event['args'] else 0
+        row['total_ms'] += ms
+        row['max_ms'] = max(row['max_ms'], ms)
+    return sorted(rows.values(), key=lambda row: row['total_ms'], reverse=True)
+
+
+def print_summary(file=None):
+    file = file or sys.stdout
+    actions = {event['name']: event['dur'] / 1000 for event in events() if event['cat'] == 'action'}
+    for name, ms in actions.items():
+        print(f"[i] Action '{name}' took {ms:.1f} ms", file=file)
+    rows = summary()
+    if not rows:
+        print("[i] No commands were recorded.", file=file)
+        return
+    print(f"{'action':<10} {'command':<22} {'calls':>6} {'failed':>6} {'total ms':>10} {'max ms':>9}", file=file)
+    for row in rows:
+        print(f"{row['action']:<10} {row['label']:<22} {row['calls']:>6} {row['failures']:>6} "
+              f"{row['total_ms']:>10.1f} {row['max_ms']:>9.1f}", file=file)
+
+
+if TRACE_PATH:
+    enable()
+    atexit.register(export_chrome, TRACE_PATH)
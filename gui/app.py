@@ -1,20 +1,34 @@
 import sys
 import os
-import subprocess
+import logging
 import tkinter as tk
-import hashlib
 import tempfile
+import queue
 from tkinter import ttk
 from tkinter import messagebox
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import core.interface as interface
-from core.router import check_existing_routing_tables, clear_custom_routing_tables
+from core.monitor import InterfaceMonitor
+from core.tasks import TaskRunner
+from core.shaping import make_shape, shape_key, PRIORITIES
+# The throughput panel samples /sys/class/net/*/statistics locally, also as a client
+from core.stats import ThroughputSampler, format_rate
+from core import executor
+from core import client
+# Provisioning, pool and teardown are imported where local mode uses them: a client
+# of intermuxd never loads them
+
+logging.basicConfig(level=os.environ.get('INTERMUX_LOG_LEVEL', 'INFO').upper(),
+                    format='%(levelname)s: %(message)s')
 
 # Allow root to access the X server
-subprocess.run("xhost +SI:localuser:root", shell=True, capture_output=True, text=True)
+executor.run(["xhost", "+SI:localuser:root"], readonly=True)
+
+# With intermuxd running, the GUI is an unprivileged client; otherwise it needs root itself
+use_daemon = client.available()
 
 # Elevate privileges if not running as root
-if os.geteuid() != 0:
+if os.geteuid() != 0 and not use_daemon:
     script_path = os.path.abspath(__file__)
     try:
         os.execvp("pkexec", ["pkexec", "python3", script_path])
@@ -34,40 +48,15 @@ if "XAUTHORITY" not in os.environ:
 
 
 
-# def run_cmd(cmd):
-#     result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-#     if result.returncode != 0:
-#         print(f"[!] Failed: {cmd}")
-#         print(f"[✗] stderr: {result.stderr.strip()}")
-#     else:
-#         print(f"[✓] Ran: {cmd}")
-    
-#     return result.stdout.strip()
-
-def run_cmd(cmd):
-    try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stderr = result.stderr.strip()
-
-        # Skip harmless 'already exists' or 'File exists' errors
-        harmless_errors = [
-            "File exists",
-            "Cannot create namespace file",
-            "already exists",
-            "exists but is not a directory"
-        ]
-
-        if result.returncode != 0 and not any(err in stderr for err in harmless_errors):
-            print(f"[!] {cmd}\n    -> {stderr}")
-        return result.stdout.strip()
-
-    except Exception as e:
-        print(f"[X] Exception while running '{cmd}': {e}")
-
 def refresh():
+    if use_daemon:
+        runner.submit("Refresh", lambda task: client.request('list'), on_done=show_interfaces)
+        return
+    runner.submit("Refresh", lambda task: interface.get_active_interfaces(use_cache=False),
+                  on_done=show_interfaces)
+
+def show_interfaces(interfaces):
     global interface_names
-    interfaces = interface.get_active_interfaces()
     interface_names = [i['name'] for i in interfaces if i['flag'] == 'UP' and i['ip_addresses']]
     interface_combo['values'] = interface_names
     if not interface_names:
@@ -75,14 +64,56 @@ def refresh():
     else:
         interface_combo.set(interface_names[0])  # Set first available as default 
 
+def on_interface_change(name, info):
+    # Called from the monitor thread; the Tk thread picks it up in process_interface_events()
+    interface_events.put((name, info))
+
+def process_interface_events():
+    global interface_names
+    changed = False
+    while True:
+        try:
+            name, info = interface_events.get_nowait()
+        except queue.Empty:
+            break
+        usable = info is not None and info['flag'] == 'UP' and info['ip_addresses']
+        if usable and name not in interface_names:
+            interface_names.append(name)
+            changed = True
+        elif not usable and name in interface_names:
+            interface_names.remove(name)
+            changed = True
+
+    if changed:
+        interface_combo['values'] = interface_names
+        if interface_combo.get() not in interface_names:
+            interface_combo.set(interface_names[0] if interface_names else "No active interfaces found")
+    root.after(250, process_interface_events)
+
 def add_path():
     app = path_entry.get()
     iface = interface_combo.get()
     if not app or not iface:
         messagebox.showerror("Error", "Please enter a valid application path and select an interface.")
         return
+    try:
+        shape = make_shape(download_entry.get() or None, upload_entry.get() or None, priority_combo.get())
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+    mode = 'cgroup' if cgroup_mode.get() else 'netns'
+    if mode == 'cgroup' and shape:
+        messagebox.showerror("Error", "Limits and priority need a namespace; uncheck 'no namespace'.")
+        return
     if app:
-        selected_paths.insert(tk.END, f"{app} -> {iface}")
+        label = f"{app} -> {iface}"
+        if shape:
+            label += f" [{shape_key(shape)}]"
+        if mode == 'cgroup':
+            label += " [cgroup]"
+        selected_paths.insert(tk.END, label)
+        # The listbox only shows the bindings; assign() takes them from here
+        pending_bindings.append((app, iface, shape, mode))
         path_entry.delete(0, tk.END)
 
         return app, iface
@@ -92,133 +123,159 @@ def clear_all():
         messagebox.showinfo("Info", "No paths to clear.")
         return
     if messagebox.askyesno("Confirm", "Are you sure you want to clear all paths?"):
-        clear_custom_routing_tables()
-        messagebox.showinfo("Success", "All paths cleared successfully!")
-        # Clear the listboxes and entry
-        selected_paths.delete(0, tk.END)
-        created_paths.delete(0, tk.END)
-        path_entry.delete(0, tk.END)
-
-def routing():
-
-    if check_existing_routing_tables():
-        # messagebox.showinfo("Info", "Routing tables already exist. No need to create again.")
-        return
-    
-    script_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../core/router.py'))
+        runner.submit("Clear paths", lambda task: clear_tables(), on_done=on_paths_cleared)
 
-    create_cmd = ['python3', script_path]
-    create_result = subprocess.run(create_cmd)
-    if create_result.returncode == 0:
-        # messagebox.showinfo("Success", "All routing tables created successfully!\nTaking you to the configure page...")
-        pass
-    else:
-        messagebox.showerror("Error", f"Failed to create routing tables:\n{create_result.stderr}")
+def on_paths_cleared(_result):
+    messagebox.showinfo("Success", "All paths cleared successfully!")
+    # Clear the listboxes and entry
+    selected_paths.delete(0, tk.END)
+    pending_bindings.clear()
+    created_paths.delete(0, tk.END)
+    path_entry.delete(0, tk.END)
 
 def assign():
 
-    app_interface = selected_paths.get(first=0, last=tk.END)
-    
-    app_list = []
-    for item in app_interface:
-        app, iface = item.split(" -> ")
-        app_list.append((app, iface))
+    app_list = list(pending_bindings)
+    pending_bindings.clear()
 
     print(f"[✓] Assigning paths: {app_list}")
 
     for i in selected_paths.get(first= 0, last=tk.END):
         created_paths.insert(tk.END, i)
         selected_paths.delete(0, tk.END)
-    routing()
-
-    for app, iface in app_list:
-        if "chromium" in app.lower():
-            messagebox.showinfo("Info", "Chromium support is not yet implemented. Please use another application for now.")
-            continue
-
-        iface_hash = hashlib.md5(iface.encode()).hexdigest()[:8]
-        ns = f"ns_{iface_hash}"
-        veth0 = f"veth0_{iface_hash}"
-        veth1 = f"veth1_{iface_hash}"
-
-        # run_cmd(f"ip netns del {ns}", ignore_errors=True)
-        # run_cmd(f"ip link del {veth0}", ignore_errors=True)
-        run_cmd(f"ip netns del {ns}")
-        run_cmd(f"ip link del {veth0}")
-        run_cmd(f"ip link del {veth1}")
-
-        run_cmd(f"ip netns add {ns}")
-        run_cmd(f"ip link add {veth0} type veth peer name {veth1}")
-        run_cmd(f"ip link set {veth1} netns {ns}")
-        run_cmd(f"ip addr add 10.0.{hash(iface)%255}.1/24 dev {veth0}")
-        run_cmd(f"ip link set {veth0} up")
-        # run_cmd(f"ip netns exec {ns} ip link set {veth1} up")
-        run_cmd(f"ip netns exec {ns} ip addr add 10.0.{hash(iface)%255}.2/24 dev {veth1}")
-        run_cmd(f"ip netns exec {ns} ip link set {veth1} up")
-        run_cmd(f"ip netns exec {ns} ip route add default via 10.0.{hash(iface)%255}.1")
-        run_cmd(f"mkdir -p /etc/netns/{ns}")
-        resolv_conf_path = os.path.realpath("/etc/resolv.conf")
-        run_cmd(f"cp {resolv_conf_path} /etc/netns/{ns}/resolv.conf")
-        run_cmd(f"iptables -t nat -A POSTROUTING -s 10.0.{hash(iface)%255}.0/24 -j MASQUERADE")
-        run_cmd(f"sysctl -w net.ipv4.ip_forward=1")
-
-        os.environ["DISPLAY"] = ":1"
-        os.environ["XAUTHORITY"] = f"/home/{os.getlogin()}/.Xauthority"
-        
-        launch_cmd = f"ip netns exec {ns} env DISPLAY={os.environ['DISPLAY']} XAUTHORITY={os.environ['XAUTHORITY']} {app}"
-        
-        if "firefox" in app.lower():
-            profile_dir = tempfile.mkdtemp()
-            launch_cmd += f" --profile {profile_dir} -no-remote"
-
-        # Launch GUI app in namespace with proper env
-        subprocess.Popen(
-            launch_cmd,
-            shell=True
-        )
+
+    if any("chromium" in app.lower() for app, *_rest in app_list):
+        messagebox.showinfo("Info", "Chromium support is not yet implemented. Please use another application for now.")
+    app_list = [binding for binding in app_list if "chromium" not in binding[0].lower()]
+
+    runner.submit("Assign", assign_apps, app_list, on_done=on_assigned,
+                  on_error=lambda e: messagebox.showerror("Error", f"Assignment failed: {e}"))
+
+def on_assigned(report):
+    status_label.configure(text=f"Assign: {len(report['bindings'])} app(s) ready in {report['total_seconds']:.2f}s")
+
+def launch_app(app, names):
+    os.environ["DISPLAY"] = ":1"
+    os.environ["XAUTHORITY"] = f"/home/{os.getlogin()}/.Xauthority"
+    
+    launch_cmd = ["env", f"DISPLAY={os.environ['DISPLAY']}", f"XAUTHORITY={os.environ['XAUTHORITY']}", app]
+    
+    if "firefox" in app.lower():
+        profile_dir = tempfile.mkdtemp()
+        launch_cmd += ["--profile", profile_dir, "-no-remote"]
+
+    # Launch GUI app in its namespace (or cgroup) with proper env
+    if 'ns' in names:
+        executor.spawn(["ip", "netns", "exec", names['ns']] + launch_cmd)
+    else:
+        executor.spawn(launch_cmd, cgroup=names['dir'])
+
+def assign_through_daemon(task, app_list):
+    # The daemon launches the apps as this user, with this session's display
+    env = {key: os.environ[key] for key in client.LAUNCH_ENV if key in os.environ}
+    report = {'bindings': [], 'total_seconds': 0.0}
+    for app, iface, shape, mode in app_list:
+        task.step(f"{iface}: assigning {os.path.basename(app)}")
+        args = ["--profile", tempfile.mkdtemp(), "-no-remote"] if "firefox" in app.lower() else []
+        result = client.request('assign', app=app, ifaces=[iface], shape=shape, mode=mode, args=args, env=env)
+        report['bindings'] += result['bindings']
+        report['total_seconds'] += result['total_seconds']
+    return report
+
+def assign_apps(task, app_list):
+    # Runs on the worker thread; must not touch Tk widgets
+    from core.provision import provision, print_report
+    if use_daemon:
+        report = assign_through_daemon(task, app_list)
+        print_report(report)
+        return report
+    # Namespaces for different interfaces are built in parallel
+    report = provision([(app, iface, shape) for app, iface, shape, mode in app_list if mode == 'netns'],
+                       launch=launch_app, progress=task.step, pool=namespace_pool)
+    lightweight = [(app, iface) for app, iface, _shape, mode in app_list if mode == 'cgroup']
+    if lightweight:
+        from core import cgroup
+        cgroup_report = cgroup.provision(lightweight, launch=launch_app, progress=task.step)
+        report['bindings'] += cgroup_report['bindings']
+        report['total_seconds'] += cgroup_report['total_seconds']
+    print_report(report)
+    return report
 
 def clear_routing_tables():
+    from core.router import check_existing_routing_tables
     if not check_existing_routing_tables():
         messagebox.showinfo("Info", "No custom routing tables found to clear.")
         return
     
     if messagebox.askyesno("Confirm", "Are you sure you want to clear all custom routing tables?"):
-        clear_custom_routing_tables()
-        messagebox.showinfo("Success", "All custom routing tables cleared successfully!")
+        runner.submit("Clear routing tables", lambda task: clear_tables(),
+                      on_done=lambda _result: messagebox.showinfo("Success", "All custom routing tables cleared successfully!"))
     else:
         messagebox.showinfo("Cancelled", "Clearing of routing tables cancelled.")
 
+def clear_tables():
+    if use_daemon:
+        client.request('clear')
+    else:
+        from core.router import clear_custom_routing_tables
+        clear_custom_routing_tables()
+
 def reset_all():
     if messagebox.askyesno("Confirm", "This will remove all veth interfaces, network namespaces, and routing tables created by this application. Are you sure you want to proceed?"):
-        try:
-            # Clear custom routing tables first
-            clear_custom_routing_tables()
-
-            # Remove veth interfaces
-            veth_interfaces = [line.split(':')[1].strip().split('@')[0] for line in run_cmd("ip -o link show").split('\n') if 'veth' in line]
-            for veth in veth_interfaces:
-                run_cmd(f"ip link del {veth}")
-
-            # Remove network namespaces
-            for iface in interface_names:
-                iface_hash = hashlib.md5(iface.encode()).hexdigest()[:8]
-                ns = f"ns_{iface_hash}"
-                run_cmd(f"ip netns del {ns} 2>/dev/null")
-
-            # Clear GUI lists
-            selected_paths.delete(0, tk.END)
-            created_paths.delete(0, tk.END)
-            
-            messagebox.showinfo("Success", "System has been reset to its defaults.")
-            refresh() # Refresh the interface list
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during reset: {e}")
+        runner.submit("Reset", reset_system, on_done=on_reset,
+                      on_error=lambda e: messagebox.showerror("Error", f"An error occurred during reset: {e}"))
+
+def reset_system(task):
+    # Runs on the worker thread; must not touch Tk widgets
+    if use_daemon:
+        task.step("Resetting through intermuxd")
+        client.request('reset')
+        return
+
+    # Remove exactly what the ledger says this application created; other veths
+    # (e.g. Docker's) are never touched. Routing tables of older versions go too.
+    from core.teardown import teardown
+    teardown(progress=task.step)
+
+    # Forget pre-built namespace state
+    if namespace_pool:
+        namespace_pool.drain()
+
+def on_reset(_result):
+    # Clear GUI lists
+    selected_paths.delete(0, tk.END)
+    pending_bindings.clear()
+    created_paths.delete(0, tk.END)
+
+    messagebox.showinfo("Success", "System has been reset to its defaults.")
+    refresh() # Refresh the interface list
+
+def update_stats():
+    # Reads the sampler's ring buffers only; sampling happens on its own thread
+    rows = [row for row in stats_sampler.snapshot() if row['name'] != 'lo']
+    names = {row['name'] for row in rows}
+    for item in stats_tree.get_children():
+        if item not in names:
+            stats_tree.delete(item)
+    for row in rows:
+        role = row['label'] if row['label'] != 'interface' else "uplink"
+        values = (row['name'], format_rate(row['rx_bps']), format_rate(row['tx_bps']),
+                  f"{row['rx_pps'] + row['tx_pps']:.0f}", f"{row['rx_drops'] + row['tx_drops']:.0f}", role)
+        if stats_tree.exists(row['name']):
+            stats_tree.item(row['name'], values=values)
+        else:
+            stats_tree.insert('', tk.END, iid=row['name'], values=values)
+    root.after(int(stats_sampler.interval * 1000), update_stats)
+
+def show_progress(task, message):
+    status_label.configure(text=f"{task.name}: {message}")
+    cancel_btn.configure(state=tk.NORMAL if runner.busy else tk.DISABLED)
 
 
 # Create main window
 root = tk.Tk()
 root.title("Network Interface Binding")
-root.geometry("800x600")
+root.geometry("800x760")
 
 # Configure network tool theme colors
 bg_color = "#0d1117"        # GitHub dark theme background
@@ -290,13 +347,23 @@ interface_label = ttk.Label(interface_frame,
                           font=('JetBrainsMono Nerd Font', 10))
 interface_label.pack(side=tk.LEFT)
 
-interfaces = interface.get_active_interfaces()
+interfaces = client.request('list') if use_daemon else interface.get_active_interfaces()
 interface_names = [i['name'] for i in interfaces if i['flag'] == 'UP' and i['ip_addresses']]
 
 interface_combo = ttk.Combobox(interface_frame, 
                              values=interface_names)
 interface_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
+# Follow interface changes (Wi-Fi, tethering plugged in or out) without a manual refresh
+interface_events = queue.Queue()
+interface_monitor = InterfaceMonitor()
+interface_monitor.add_callback(on_interface_change)
+try:
+    interface_monitor.start()
+    root.after(250, process_interface_events)
+except OSError as e:
+    print(f"[!] Interface monitor unavailable, use Refresh instead: {e}")
+
 # Application Path
 path_frame = ttk.Frame(main_frame, style="Dark.TFrame")
 path_frame.pack(fill=tk.X, pady=(0, 10))
@@ -309,6 +376,29 @@ path_label.pack(side=tk.LEFT)
 path_entry = ttk.Entry(path_frame, style="Dark.TEntry")
 path_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
+# Optional bandwidth limits and priority for the binding
+shaping_frame = ttk.Frame(main_frame, style="Dark.TFrame")
+shaping_frame.pack(fill=tk.X, pady=(0, 10))
+shaping_label = ttk.Label(shaping_frame,
+                          text="$ Limits (optional)",
+                          width=20,
+                          style="Dark.TLabel",
+                          font=('JetBrainsMono Nerd Font', 10))
+shaping_label.pack(side=tk.LEFT)
+ttk.Label(shaping_frame, text="down", style="Dark.TLabel").pack(side=tk.LEFT)
+download_entry = ttk.Entry(shaping_frame, width=10, style="Dark.TEntry")
+download_entry.pack(side=tk.LEFT, padx=(5, 10))
+ttk.Label(shaping_frame, text="up", style="Dark.TLabel").pack(side=tk.LEFT)
+upload_entry = ttk.Entry(shaping_frame, width=10, style="Dark.TEntry")
+upload_entry.pack(side=tk.LEFT, padx=(5, 10))
+ttk.Label(shaping_frame, text="priority", style="Dark.TLabel").pack(side=tk.LEFT)
+priority_combo = ttk.Combobox(shaping_frame, values=list(PRIORITIES), width=12, state="readonly")
+priority_combo.set('normal')
+priority_combo.pack(side=tk.LEFT, padx=(5, 0))
+# Steer the app by cgroup and fwmark instead of a namespace (no limits then)
+cgroup_mode = tk.BooleanVar(value=False)
+ttk.Checkbutton(shaping_frame, text="no namespace", variable=cgroup_mode).pack(side=tk.LEFT, padx=(10, 0))
+
 # Add button
 add_frame = ttk.Frame(main_frame, style="Dark.TFrame")
 add_frame.pack(fill=tk.X, pady=(0, 20))
@@ -319,6 +409,9 @@ add_btn = ttk.Button(add_frame,
                     style="Dark.TButton")
 add_btn.pack(anchor=tk.CENTER)
 
+# Bindings waiting for Assign: (app, iface, shape, mode)
+pending_bindings = []
+
 # Paths lists frame
 paths_frame = ttk.Frame(main_frame, style="Dark.TFrame")
 paths_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 20))
@@ -361,6 +454,23 @@ created_paths = tk.Listbox(created_frame,
                          font=('JetBrainsMono Nerd Font', 10))
 created_paths.pack(fill=tk.BOTH, expand=True)
 
+# Live throughput of uplinks and bindings
+stats_frame = ttk.LabelFrame(main_frame,
+                             text="Throughput",
+                             style="Dark.TLabelframe",
+                             padding=10)
+stats_frame.pack(fill=tk.X, pady=(0, 20))
+style.configure("Dark.Treeview", background=listbox_bg, fieldbackground=listbox_bg, foreground=listbox_fg)
+stats_columns = ('interface', 'rx', 'tx', 'pkt/s', 'drops/s', 'role')
+stats_tree = ttk.Treeview(stats_frame, columns=stats_columns, show='headings', height=5, style="Dark.Treeview")
+for column in stats_columns:
+    stats_tree.heading(column, text=column)
+    stats_tree.column(column, width=200 if column == 'role' else 90, anchor=tk.W)
+stats_tree.pack(fill=tk.X)
+stats_sampler = ThroughputSampler()
+stats_sampler.start()
+root.after(int(stats_sampler.interval * 1000), update_stats)
+
 # Bottom buttons frame
 bottom_frame = ttk.Frame(main_frame, style="Dark.TFrame")
 bottom_frame.pack(fill=tk.X)
@@ -390,6 +500,35 @@ reset_btn = ttk.Button(buttons_frame,
                        style="Dark.TButton")
 reset_btn.pack(side=tk.LEFT, padx=5)
 
+cancel_btn = ttk.Button(buttons_frame,
+                        text="✕ Cancel",
+                        width=12,
+                        command=lambda: runner.cancel_all(),
+                        state=tk.DISABLED,
+                        style="Dark.TButton")
+cancel_btn.pack(side=tk.LEFT, padx=5)
+
+# Progress of the background operations
+status_label = ttk.Label(bottom_frame,
+                         text="Ready",
+                         style="Dark.TLabel",
+                         font=('JetBrainsMono Nerd Font', 9))
+status_label.pack(anchor=tk.W, pady=(10, 0))
+
+# Network operations run here, off the Tk event loop, so the window stays responsive
+runner = TaskRunner(root.after, on_progress=show_progress)
+
+# Optional pool of ready namespaces (INTERMUX_POOL_SIZE > 0) so assigning launches instantly
+# intermuxd keeps its own pool
+namespace_pool = None
+if not use_daemon:
+    from core.pool import NamespacePool, POOL_SIZE
+    if POOL_SIZE > 0:
+        namespace_pool = NamespacePool(size=POOL_SIZE)
+if namespace_pool:
+    for name in interface_names:
+        namespace_pool.refill_async(name)
+
 # Start the application
 if __name__ == '__main__':
     root.mainloop()
@@ -1,12 +1,19 @@
 import sys
 import os
+import logging
 import subprocess
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import queue
 import tkinter as tk
 from tkinter import *
 import core.interface as interface
+from core.monitor import InterfaceMonitor
+from core import client
 from tkinter import messagebox, Toplevel
 
+logging.basicConfig(level=os.environ.get('INTERMUX_LOG_LEVEL', 'INFO').upper(),
+                    format='%(levelname)s: %(message)s')
+
 root = tk.Tk()
 root.title("Interfaces")
 root.geometry("700x600")
@@ -25,12 +32,38 @@ root.grid_columnconfigure(3, weight=1)
 #refresh button function
 def refresh():
     interface_list.delete(0, END)  # Step 1: Clear
-    interfaces_list = interface.get_active_interfaces()  # Step 2: Get new data
+    interfaces_list = interface.get_active_interfaces(use_cache=False)  # Step 2: Get new data
     if not interfaces_list:
         interface_list.insert(END, "No active interfaces found.")
     else:
         for name in interfaces_list:  # Step 3: Fill again
-            interface_list.insert(END, f"{name['name']} - {name['flag']} - {name['type']} - {''.join(name['ip_addresses'][0]) if name['ip_addresses'] else 'N/A'}")
+            interface_list.insert(END, format_interface(name))
+
+def format_interface(name):
+    return f"{name['name']} - {name['flag']} - {name['type']} - {''.join(name['ip_addresses'][0]) if name['ip_addresses'] else 'N/A'}"
+
+#interface monitor callback, runs on the monitor thread
+def on_interface_change(name, info):
+    interface_events.put((name, info))
+
+#applies queued interface changes to the listbox on the Tk thread
+def process_interface_events():
+    while True:
+        try:
+            name, info = interface_events.get_nowait()
+        except queue.Empty:
+            break
+        rows = interface_list.get(0, END)
+        row = next((i for i, text in enumerate(rows) if text.split(' - ')[0] == name), None)
+        if row is not None:
+            interface_list.delete(row)
+        if info is not None:
+            if rows == ("No active interfaces found.",):
+                interface_list.delete(0, END)
+            interface_list.insert(row if row is not None else END, format_interface(info))
+        elif interface_list.size() == 0:
+            interface_list.insert(END, "No active interfaces found.")
+    root.after(250, process_interface_events)
 
 #congigure window opening
 def open_configure_window():
@@ -43,6 +76,17 @@ def open_configure_window():
 
 #routing button function
 def routing():
+    if client.available():
+        # intermuxd already runs as root, no second privileged process is needed
+        try:
+            client.request('tables')
+        except (OSError, client.DaemonError) as e:
+            messagebox.showerror("Error", f"Routing failed:\n{e}")
+            return
+        messagebox.showinfo("Success", "All routing tables created successfully!\nTaking you to the configure page...")
+        open_configure_window()
+        return
+
     script_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../core/router.py'))
     
     result = subprocess.run(['pkexec', 'python3', script_path], capture_output=True, text=True)
@@ -77,7 +121,17 @@ if not interfaces_list:
     interface_list.insert(END, "No active interfaces found.")
 
 for name in interfaces_list:
-    interface_list.insert(END, f"{name['name']} - {name['flag']} - {name['type']} - {''.join(name['ip_addresses'][0]) if name['ip_addresses'] else 'N/A'}")
+    interface_list.insert(END, format_interface(name))
 interface_list.grid(row=1, column=0, columnspan=4, pady=20)
 
+#keep the list current without pressing Refresh
+interface_events = queue.Queue()
+interface_monitor = InterfaceMonitor()
+interface_monitor.add_callback(on_interface_change)
+try:
+    interface_monitor.start()
+    root.after(250, process_interface_events)
+except OSError as e:
+    print(f"Interface monitor unavailable: {e}")
+
 root.mainloop()
\ No newline at end of file